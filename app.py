@@ -0,0 +1,98 @@
+"""
+Сборка диспетчера и сервисов бота.
+
+Модуль без побочных эффектов при импорте: его используют и main.py (один процесс),
+и воркеры supervisor.py. Логирование настраивает вызывающий через setup_logging().
+"""
+
+import logging
+import os
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import FSM_STORAGE
+from database import ConnectionManager, AsyncDatabase
+from broadcast import BroadcastEngine
+from outbound import OutboundDispatcher
+from outbox import OutboxRelay
+from bot_identity import BotIdentity
+from fsm_storage import SQLiteStorage
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.user_lock import UserLockMiddleware
+from handlers import start, callbacks, admin, admin_earn, chat_member
+
+
+def setup_logging():
+    """Логирование в файл logs/bot.log и в консоль"""
+    # Создаем директорию для логов, если её нет
+    os.makedirs('logs', exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('logs/bot.log', encoding='utf-8'),
+            logging.StreamHandler()  # Также выводим в консоль
+        ]
+    )
+
+
+def include_routers(dp: Dispatcher):
+    """Регистрация роутеров"""
+    # Важно: callbacks.router должен быть ПЕРВЫМ, чтобы FSM состояния обрабатывались раньше
+    dp.include_router(callbacks.router)
+    dp.include_router(admin.router)  # Админ-панель
+    dp.include_router(admin_earn.router)  # Настройки раздела "Начать зарабатывать"
+    dp.include_router(start.router)
+    # События chat_member из каналов-спонсоров (бот - администратор) для проверки подписки
+    dp.include_router(chat_member.router)
+
+
+async def create_dispatcher(bot: Bot, db_manager: ConnectionManager, background_jobs: bool = True) -> Dispatcher:
+    """
+    Диспетчер с роутерами и сервисами в workflow data.
+    background_jobs - выполнять рассылки и outbox в этом процессе (в режиме воркеров - только воркер 0).
+    """
+    db = AsyncDatabase(db_manager)
+    # Состояния FSM в БД переживают перезапуск и общие для воркеров
+    if FSM_STORAGE == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = SQLiteStorage(db)
+        if background_jobs:
+            storage.start_cleanup()
+    dp = Dispatcher(storage=storage)
+    # Лишние нажатия "горячих" кнопок отсекаются до блокировки пользователя и обработчиков
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    # Обновления одного пользователя - по очереди (защита от двойных нажатий), разных - параллельно
+    dp.update.outer_middleware(UserLockMiddleware())
+    # БД передается во все обработчики через workflow data (параметр db)
+    dp["db"] = db
+    # Данные бота (username для реферальных ссылок) без getMe на каждый показ
+    bot_identity = BotIdentity(bot)
+    await bot_identity.start()
+    dp["bot_identity"] = bot_identity
+    # Очередь исходящих сообщений с лимитами Telegram (уведомления и рассылка)
+    outbound = OutboundDispatcher(bot)
+    outbound.start()
+    dp["outbound"] = outbound
+    # Уведомления, записанные в outbox вместе с заявками на вывод
+    outbox = OutboxRelay(db, outbound)
+    if background_jobs:
+        outbox.start()
+    dp["outbox"] = outbox
+    # Фоновые рассылки; прерванные продолжаются с места остановки
+    broadcaster = BroadcastEngine(db, outbound, finish_markup=admin.get_admin_keyboard(), run_jobs=background_jobs)
+    dp["broadcaster"] = broadcaster
+    if background_jobs:
+        await broadcaster.resume()
+
+    include_routers(dp)
+    return dp
+
+
+async def stop_services(dp: Dispatcher):
+    await dp["broadcaster"].stop()
+    await dp["bot_identity"].stop()
+    await dp["outbox"].stop()
+    await dp["outbound"].stop()
+    await dp.storage.close()
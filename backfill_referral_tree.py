@@ -0,0 +1,40 @@
+"""
+Пересборка таблицы referral_tree по users.referrer_id.
+
+Миграция 5 заполняет дерево один раз автоматически. Скрипт нужен, если
+referrer_id меняли вручную в обход бота (импорт, правка базы).
+
+Запуск: python backfill_referral_tree.py [путь к БД]
+"""
+
+import logging
+import sys
+
+from config import DB_NAME
+from database import Database
+from migrations import rebuild_referral_tree
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main() -> int:
+    db_name = sys.argv[1] if len(sys.argv) > 1 else DB_NAME
+    db = Database(db_name)
+    try:
+        # IMMEDIATE: бот продолжает читать старое дерево, пока пересборка не закоммичена
+        db.conn.execute("BEGIN IMMEDIATE")
+        try:
+            count = rebuild_referral_tree(db.conn.cursor())
+            db.conn.execute("COMMIT")
+        except Exception:
+            db.conn.execute("ROLLBACK")
+            raise
+    finally:
+        db.close()
+    logger.info(f"✅ referral_tree пересобрана в {db_name}: связей {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Сравнение накладных расходов хранилищ FSM: MemoryStorage и SQLiteStorage.
+
+Каждое "обновление" повторяет то, что делает aiogram с FSM в шаге диалога вывода:
+чтение состояния (фильтры), чтение данных, запись данных и смена состояния.
+Обновления идут от USERS пользователей параллельно, как при реальной нагрузке,
+поэтому запись SQLiteStorage объединяется групповым коммитом.
+
+Запуск: python benchmark_fsm.py [обновлений] [пользователей]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from database import ConnectionManager, AsyncDatabase
+from fsm_storage import SQLiteStorage
+
+BOT_ID = 1
+
+
+async def _user_updates(storage: BaseStorage, user_id: int, updates: int):
+    key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+    for step in range(updates):
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        data['amount'] = step
+        await storage.set_data(key, data)
+        await storage.set_state(key, 'WithdrawStates:waiting_wallet' if step % 2 else 'WithdrawStates:waiting_amount')
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+
+
+async def run(storage: BaseStorage, total: int, users: int) -> float:
+    """Время на одно обновление, мкс"""
+    per_user = max(1, total // users)
+    started = time.perf_counter()
+    await asyncio.gather(*(_user_updates(storage, user_id, per_user) for user_id in range(1, users + 1)))
+    return (time.perf_counter() - started) / (per_user * users) * 1_000_000
+
+
+async def main(total: int, users: int):
+    memory_us = await run(MemoryStorage(), total, users)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = ConnectionManager(os.path.join(tmp_dir, 'fsm_benchmark.db'))
+        await manager.open()
+        try:
+            sqlite_us = await run(SQLiteStorage(AsyncDatabase(manager)), total, users)
+            batches, operations = manager.batcher.batches, manager.batcher.operations
+        finally:
+            await manager.close()
+
+    print(f"Обновлений: {total}, пользователей параллельно: {users}")
+    print(f"MemoryStorage: {memory_us:8.1f} мкс/обновление")
+    print(f"SQLiteStorage: {sqlite_us:8.1f} мкс/обновление "
+          f"(+{sqlite_us - memory_us:.1f} мкс, записей на коммит: {operations / max(1, batches):.1f})")
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(total, users))
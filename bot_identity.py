@@ -0,0 +1,72 @@
+"""
+Данные бота (getMe), загруженные один раз.
+
+Реферальная ссылка строится из username бота. Раньше каждый показ ссылки делал
+запрос getMe к Bot API; теперь username загружается при запуске, хранится в
+workflow data диспетчера (параметр bot_identity) и обновляется раз в
+BOT_IDENTITY_REFRESH_INTERVAL на случай переименования бота.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import User
+from config import BOT_IDENTITY_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Повтор после неудачной загрузки, сек
+_RETRY_INTERVAL = 30
+
+
+class BotIdentity:
+    """Кэш getMe с периодическим обновлением"""
+
+    def __init__(self, bot: Bot, refresh_interval: float = BOT_IDENTITY_REFRESH_INTERVAL):
+        self.bot = bot
+        self.refresh_interval = refresh_interval
+        self.me: Optional[User] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def username(self) -> Optional[str]:
+        return self.me.username if self.me else None
+
+    async def refresh(self) -> User:
+        me = await self.bot.get_me()
+        if self.me is not None and me.username != self.me.username:
+            logger.info(f"Username бота изменился: @{self.me.username} -> @{me.username}")
+        self.me = me
+        return me
+
+    async def start(self):
+        """Загрузить данные бота (ошибка не мешает запуску) и запустить обновление"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Не удалось получить данные бота: {e}")
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval if self.me else _RETRY_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Ошибка обновления данных бота: {e}")
+
+    async def referral_link(self, user_id: int) -> str:
+        """Реферальная ссылка пользователя (getMe - только если данные еще не загружены)"""
+        if self.me is None:
+            await self.refresh()
+        return f"https://t.me/{self.me.username}?start={user_id}"
@@ -0,0 +1,305 @@
+"""
+Фоновая рассылка сообщений администратора всем пользователям.
+
+Рассылка не занимает обработчик: она выполняется отдельной задачей, где
+несколько отправителей берут пользователей из общей очереди и передают
+сообщения в очередь исходящих сообщений (outbound.py) с низким приоритетом.
+Лимиты Bot API и flood wait соблюдает она, а уведомления о выводах
+обгоняют рассылку. Прогресс периодически обновляется в сообщении администратору.
+
+Задание хранится в таблице broadcasts, каждая отправка - в broadcast_deliveries.
+Получатели читаются страницами по возрастанию user_id после сохраненного курсора,
+поэтому после перезапуска рассылка продолжается с места остановки, а
+пользователи с записанной доставкой повторно не получают сообщение.
+
+Пользователи, заблокировавшие бота или удалившие аккаунт (Forbidden, chat not found),
+отмечаются недоступными и не попадают в следующие рассылки, пока снова не нажмут /start.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import CopyMessage, EditMessageText
+from aiogram.types import InlineKeyboardMarkup, Message
+from config import BROADCAST_WORKERS, BROADCAST_PROGRESS_INTERVAL, BROADCAST_PAGE_SIZE, BROADCAST_POLL_INTERVAL
+from database import AsyncDatabase
+from outbound import OutboundDispatcher, PRIORITY_HIGH, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Повторные проходы по пользователям, для которых доставка не записалась (ошибка БД), и пауза перед ними, сек
+_RETRY_PASSES = 2
+_RETRY_DELAY = 5
+
+
+def is_unreachable_error(error: Exception) -> bool:
+    """Пользователю больше нельзя писать: бот заблокирован, аккаунт удален или чат не найден"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+
+
+class Broadcast:
+    """Одна рассылка (строка broadcasts): копия сообщения администратора каждому пользователю"""
+
+    def __init__(self, job: Dict):
+        self.id = job['id']
+        self.from_chat_id = job['from_chat_id']
+        self.message_id = job['message_id']
+        self.progress_chat_id = job.get('progress_chat_id')
+        self.progress_message_id = job.get('progress_message_id')
+        self.total = job.get('total') or 0
+        self.sent = job.get('sent') or 0
+        self.failed = job.get('failed') or 0
+        # Все пользователи с user_id <= cursor уже обработаны
+        self.cursor = job.get('cursor_user_id') or 0
+        self.started_at = time.monotonic()
+        self.done_at_start = self.sent + self.failed
+        self.finished_at: Optional[float] = None
+        # Отправляются сейчас (в очереди или у отправителя) и последний поставленный в очередь
+        self.pending: Set[int] = set()
+        self.last_queued = self.cursor
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def rate(self) -> float:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return (self.done - self.done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def safe_cursor(self) -> int:
+        """Наибольший user_id, до которого включительно все уже обработаны"""
+        return min(self.pending) - 1 if self.pending else self.last_queued
+
+    def progress_text(self, errors: Optional[Dict[str, int]] = None) -> str:
+        if self.finished_at is not None:
+            text = (
+                f"✅ Рассылка завершена!\n\n"
+                f"📊 Статистика:\n"
+                f"• Отправлено: {self.sent}\n"
+                f"• Ошибок: {self.failed}\n"
+                f"• Всего: {self.done}\n"
+                f"• Скорость: {self.rate:.1f} сообщ./сек"
+            )
+            if errors:
+                text += "\n\nОшибки:\n" + "\n".join(f"• {error}: {count}" for error, count in errors.items())
+            return text
+        return (
+            f"📤 Рассылка: {self.done} из {self.total}\n\n"
+            f"• Отправлено: {self.sent}\n"
+            f"• Ошибок: {self.failed}\n"
+            f"• Скорость: {self.rate:.1f} сообщ./сек"
+        )
+
+
+class BroadcastEngine:
+    """Запуск и продолжение рассылок в фоне через общую очередь исходящих сообщений"""
+
+    def __init__(self, db: AsyncDatabase, outbound: OutboundDispatcher, workers: int = BROADCAST_WORKERS,
+                 finish_markup: Optional[InlineKeyboardMarkup] = None, run_jobs: bool = True):
+        self.db = db
+        self.outbound = outbound
+        self.workers = max(1, workers)
+        self.finish_markup = finish_markup
+        # False - процесс только создает задания, выполняет их воркер с run_jobs (см. watch)
+        self.run_jobs = run_jobs
+        # задача -> id рассылки
+        self._tasks: Dict[asyncio.Task, int] = {}
+
+    async def create(self, from_chat_id: int, message_id: int, progress_message: Message) -> Broadcast:
+        """Сохранить новое задание рассылки и запустить его"""
+        total = await self.db.get_reachable_users_count()
+        job_id = await self.db.create_broadcast(
+            from_chat_id, message_id, progress_message.chat.id, progress_message.message_id, total
+        )
+        broadcast = Broadcast({
+            'id': job_id,
+            'from_chat_id': from_chat_id,
+            'message_id': message_id,
+            'progress_chat_id': progress_message.chat.id,
+            'progress_message_id': progress_message.message_id,
+            'total': total,
+        })
+        if self.run_jobs:
+            self.start(broadcast)
+        else:
+            logger.info(f"📤 Рассылка #{job_id} создана, ее запустит основной воркер")
+        return broadcast
+
+    async def resume(self) -> int:
+        """Продолжить рассылки, прерванные остановкой бота (и еще не запущенные в этом процессе)"""
+        running = set(self._tasks.values())
+        jobs = [job for job in await self.db.get_running_broadcasts() if job['id'] not in running]
+        for job in jobs:
+            logger.info(f"📤 Продолжаем рассылку #{job['id']} с user_id > {job['cursor_user_id']}")
+            self.start(Broadcast(job))
+        return len(jobs)
+
+    async def watch(self, interval: float = BROADCAST_POLL_INTERVAL):
+        """Периодически запускать рассылки, созданные другими процессами"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.error(f"Ошибка при поиске новых рассылок: {e}", exc_info=True)
+
+    def start(self, broadcast: Broadcast) -> asyncio.Task:
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[task] = broadcast.id
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        self._tasks.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("❌ Рассылка прервана ошибкой (продолжится при следующем запуске)", exc_info=task.exception())
+
+    async def stop(self):
+        """Остановить рассылки (задания остаются в статусе running и продолжатся при запуске)"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, broadcast: Broadcast):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+
+        logger.info(f"📤 Рассылка #{broadcast.id}: {broadcast.total} пользователей, {self.workers} отправителей")
+        progress = asyncio.create_task(self._report_progress(broadcast))
+        senders = [asyncio.create_task(self._sender(broadcast, queue)) for _ in range(self.workers)]
+        try:
+            after = broadcast.cursor
+            for attempt in range(_RETRY_PASSES + 1):
+                await self._produce(broadcast, queue, after)
+                await queue.join()
+                if not broadcast.pending or attempt == _RETRY_PASSES:
+                    break
+                logger.warning(
+                    f"⚠️ Рассылка #{broadcast.id}: доставка не записана для {len(broadcast.pending)} "
+                    f"пользователей, повтор через {_RETRY_DELAY} сек"
+                )
+                await asyncio.sleep(_RETRY_DELAY)
+                # Повтор - с первого необработанного; курсор не должен уйти дальше него до постановки в очередь
+                after = broadcast.safe_cursor()
+                broadcast.last_queued = after
+                broadcast.pending.clear()
+        finally:
+            for sender in senders:
+                sender.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+            progress.cancel()
+            await asyncio.gather(progress, return_exceptions=True)
+            # Сохраняем курсор и при остановке: доставки уже записаны, курсор лишь ускоряет продолжение
+            try:
+                await self.db.update_broadcast_cursor(broadcast.id, broadcast.safe_cursor())
+            except Exception as e:
+                logger.error(f"Не удалось сохранить курсор рассылки #{broadcast.id}: {e}")
+
+        if broadcast.pending:
+            # Задание остается в статусе running и продолжится с курсора при следующем запуске
+            logger.error(
+                f"❌ Рассылка #{broadcast.id} не завершена: доставка не записана для "
+                f"{len(broadcast.pending)} пользователей, продолжится при следующем запуске"
+            )
+            return
+
+        broadcast.finished_at = time.monotonic()
+        await self.db.update_broadcast_cursor(broadcast.id, broadcast.safe_cursor(), finished=True)
+        # Задание уже завершено: ошибки ниже влияют только на итоговое сообщение
+        try:
+            stats = await self.db.get_broadcast_stats(broadcast.id)
+        except Exception as e:
+            logger.error(f"Не удалось получить статистику рассылки #{broadcast.id}: {e}")
+            stats = None
+        logger.info(
+            f"✅ Рассылка #{broadcast.id} завершена: отправлено {broadcast.sent}, ошибок {broadcast.failed}, "
+            f"{broadcast.rate:.1f} сообщ./сек"
+        )
+        await self._edit_progress(broadcast, stats['errors'] if stats else None, self.finish_markup)
+
+    async def _produce(self, broadcast: Broadcast, queue: asyncio.Queue, after: int):
+        """Ставить в очередь получателей после after страницами по возрастанию user_id"""
+        while True:
+            user_ids = await self.db.get_broadcast_recipients(broadcast.id, after, BROADCAST_PAGE_SIZE)
+            if not user_ids:
+                return
+            for user_id in user_ids:
+                broadcast.pending.add(user_id)
+                broadcast.last_queued = user_id
+                await queue.put(user_id)
+            after = user_ids[-1]
+
+    async def _sender(self, broadcast: Broadcast, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                status, error = await self._send(broadcast, user_id)
+                await self.db.record_broadcast_delivery(broadcast.id, user_id, status, error)
+                if status == 'unreachable':
+                    await self.db.set_user_reachable(user_id, False)
+                if status == 'sent':
+                    broadcast.sent += 1
+                else:
+                    broadcast.failed += 1
+                broadcast.pending.discard(user_id)
+            except Exception as e:
+                # Доставка не записана - пользователь останется за курсором и будет отправлен повторно
+                logger.error(f"Ошибка рассылки #{broadcast.id} для пользователя {user_id}: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def _send(self, broadcast: Broadcast, user_id: int):
+        """Отправить копию сообщения: ('sent', None), ('failed', тип ошибки) или ('unreachable', тип ошибки)"""
+        try:
+            await self.outbound.call(CopyMessage(
+                chat_id=user_id,
+                from_chat_id=broadcast.from_chat_id,
+                message_id=broadcast.message_id
+            ), PRIORITY_BULK)
+            return 'sent', None
+        except Exception as e:
+            if is_unreachable_error(e):
+                logger.info(f"Пользователь {user_id} недоступен: {e}")
+                return 'unreachable', type(e).__name__
+            logger.error(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
+            return 'failed', type(e).__name__
+
+    async def _report_progress(self, broadcast: Broadcast):
+        """Редактировать сообщение с прогрессом и сохранять курсор не чаще раза в BROADCAST_PROGRESS_INTERVAL"""
+        last_done = -1
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            if broadcast.done == last_done:
+                continue
+            try:
+                await self.db.update_broadcast_cursor(broadcast.id, broadcast.safe_cursor())
+                await self._edit_progress(broadcast)
+                last_done = broadcast.done
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении прогресса рассылки #{broadcast.id}: {e}", exc_info=True)
+
+    async def _edit_progress(self, broadcast: Broadcast, errors: Optional[Dict[str, int]] = None,
+                             reply_markup: Optional[InlineKeyboardMarkup] = None):
+        if not broadcast.progress_chat_id or not broadcast.progress_message_id:
+            return
+        try:
+            await self.outbound.call(EditMessageText(
+                text=broadcast.progress_text(errors),
+                chat_id=broadcast.progress_chat_id,
+                message_id=broadcast.progress_message_id,
+                reply_markup=reply_markup
+            ), PRIORITY_HIGH)
+        except TelegramRetryAfter as e:
+            # Прогресс не важнее рассылки - пропускаем это обновление
+            logger.warning(f"Flood wait {e.retry_after} сек при обновлении прогресса рассылки")
+        except TelegramBadRequest as e:
+            logger.debug(f"Прогресс рассылки не обновлен: {e}")
+        except Exception as e:
+            # Администратор заблокировал бота, сбой сети и т.п. - на рассылку это не влияет
+            logger.warning(f"Не удалось обновить прогресс рассылки #{broadcast.id}: {e}")
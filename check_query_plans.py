@@ -0,0 +1,211 @@
+"""
+Проверка планов запросов AsyncDatabase через EXPLAIN QUERY PLAN.
+
+Скрипт создает временную БД со всеми миграциями и индексами, вызывает типовой
+набор методов AsyncDatabase, перехватывает каждый выполненный SQL-запрос и
+сообщает о запросах, которые читают таблицу целиком (SCAN без поиска по индексу)
+или сортируют через временное B-дерево. Публичные корутины AsyncDatabase, которых
+нет в наборе вызовов (_workload) и в EXPECTED_FULL_SCANS, тоже считаются ошибкой:
+новый метод нужно добавить в набор, иначе его запросы не проверяются.
+
+Запуск: python check_query_plans.py
+Код возврата 1, если найдены неожиданные полные проходы по таблицам.
+"""
+
+import asyncio
+import inspect
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+from database import ConnectionManager, AsyncDatabase
+
+# Методы, которые по смыслу читают всю таблицу (рассылка, счетчики, список в админке, снимок настроек)
+EXPECTED_FULL_SCANS = {
+    'get_settings',
+    'get_all_users',
+    'get_users_count',
+    'get_reachable_users_count',
+    'get_all_users_with_details',
+}
+
+# Загрузка снимка настроек: выполняется в том методе, который первым обратился к настройкам
+# после их изменения (в том числе после изменения заданий - см. AsyncDatabase._catalog_changed)
+EXPECTED_FULL_SCAN_QUERIES = {
+    'SELECT key, value FROM settings',
+}
+
+# Служебные команды, для которых план не нужен
+_SKIP_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA', 'SAVEPOINT', 'RELEASE')
+
+
+def _workload(task_id: int) -> List[Tuple[str, tuple, dict]]:
+    """Типовые вызовы методов AsyncDatabase (имя метода, args, kwargs)"""
+    return [
+        ('ping', (), {}),
+        ('get_settings', (), {}),
+        ('get_task_catalog', (), {}),
+        ('create_user', (1, 'root', 'Root'), {}),
+        ('create_user', (2, 'child', 'Child', 1), {}),
+        ('create_user', (3, 'grandchild', 'Grandchild', 2), {}),
+        ('ensure_user', (4, 'user', 'User'), {}),
+        ('get_user', (1,), {}),
+        ('get_referrer', (2,), {}),
+        ('get_invited_count', (1,), {}),
+        ('get_referrals_count', (1,), {'depth': 2}),
+        ('get_friends_referrals_count', (1,), {}),
+        ('get_referrals_counts', (1, 3), {}),
+        ('get_referrals', (1, 2), {}),
+        ('update_user_balance', (1, 10.0), {}),
+        ('set_user_balance', (1, 100.0), {}),
+        ('can_get_daily_bonus', (1,), {}),
+        ('set_daily_bonus', (1, 5.0), {}),
+        ('get_tasks', (), {}),
+        ('get_tasks', ('info',), {}),
+        ('get_tasks', ('info', False), {}),
+        ('add_task', ('custom', 'Задание', 'Описание'), {'reward': 10.0}),
+        ('update_task', (task_id,), {'title': 'Задание 2'}),
+        ('get_task', (task_id,), {}),
+        ('complete_task', (2, task_id), {}),
+        ('is_task_completed', (2, task_id), {}),
+        ('grant_reward', (3, task_id, 10.0, (350.0, 100.0)), {}),
+        ('delete_task', (task_id,), {}),
+        ('add_subscription', (2, 'https://t.me/channel'), {}),
+        ('is_subscribed', (2, 'https://t.me/channel'), {}),
+        ('add_subscribe_channel', ('channel', 'https://t.me/channel', 'Канал'), {}),
+        ('get_subscribe_channels', (), {}),
+        ('set_channel_membership', (['@channel', '-100123'], 2, 'member', True), {}),
+        ('get_channel_membership', ('@channel', 2, 86400), {}),
+        ('get_subscribe_channel', (1,), {}),
+        ('update_subscribe_channel', (1,), {'display_name': 'Канал 2'}),
+        ('has_received_reward_for_channel', (2, 1), {}),
+        ('mark_reward_received_for_channel', (2, 1), {}),
+        ('grant_reward', (3, task_id, 10.0, (350.0, 100.0)), {'channels': [(1, 'https://t.me/channel')]}),
+        ('delete_subscribe_channel', (1,), {}),
+        ('create_withdrawal', (1, 10.0, 'usdt', '0x0'), {}),
+        ('confirm_withdrawal', (1,), {}),
+        ('create_withdrawal', (1, 5.0, 'site', 'CODE'), {'outbox': [(-100, 'text'), (-100, 'text')]}),
+        ('get_pending_outbox', (), {}),
+        ('mark_outbox_failed', (1, 'error', 5), {}),
+        ('mark_outbox_sent', (2,), {}),
+        ('set_fsm_field', ((1, 2, 2, 0, 'default'), 'state', 'S'), {}),
+        ('get_fsm_record', ((1, 2, 2, 0, 'default'), 3600), {}),
+        ('set_fsm_field', ((1, 2, 2, 0, 'default'), 'state', None), {}),
+        ('delete_expired_fsm', (3600,), {}),
+        ('get_statistics', (), {}),
+        ('get_setting', ('welcome_text',), {}),
+        ('get_setting_int', ('referral_reward',), {}),
+        ('get_setting_float', ('total_withdrawn',), {}),
+        ('set_setting', ('welcome_text', 'Привет'), {}),
+        ('create_broadcast', (1, 1, 1, 2, 3), {}),
+        ('get_running_broadcasts', (), {}),
+        ('get_broadcast_recipients', (1, 0, 100), {}),
+        ('record_broadcast_delivery', (1, 1, 'sent'), {}),
+        ('record_broadcast_delivery', (1, 2, 'failed', 'TelegramForbiddenError'), {}),
+        ('update_broadcast_cursor', (1, 2), {'finished': True}),
+        ('get_broadcast_stats', (1,), {}),
+        ('set_user_reachable', (3, False), {}),
+        ('set_user_reachable', (3, True), {}),
+        ('get_all_users', (), {}),
+        ('get_all_users', (), {'include_unreachable': True}),
+        ('get_reachable_users_count', (), {}),
+        ('get_all_users_with_details', (), {'limit': 10}),
+        ('get_users_count', (), {}),
+    ]
+
+
+def unchecked_methods() -> List[str]:
+    """Публичные методы AsyncDatabase, запросы которых скрипт не проверяет"""
+    public = {
+        name for name, _ in inspect.getmembers(AsyncDatabase, inspect.iscoroutinefunction)
+        if not name.startswith('_')
+    }
+    exercised = {method for method, _, _ in _workload(1)}
+    return sorted(public - exercised - EXPECTED_FULL_SCANS)
+
+
+async def collect_statements(db_name: str) -> List[Tuple[str, str]]:
+    """Выполнить типовые вызовы и вернуть список (метод, SQL)"""
+    manager = ConnectionManager(db_name, read_pool_size=1)
+    await manager.open()
+    db = AsyncDatabase(manager)
+    statements: List[Tuple[str, str]] = []
+    current = {'method': ''}
+
+    def trace(sql: str):
+        statements.append((current['method'], sql))
+
+    async with manager.read() as reader:
+        await reader.set_trace_callback(trace)
+    await manager.writer.set_trace_callback(trace)
+
+    try:
+        task_id = 1
+        for method, args, kwargs in _workload(task_id):
+            current['method'] = method
+            result = await getattr(db, method)(*args, **kwargs)
+            if method == 'add_task':
+                task_id = result
+    finally:
+        await manager.writer.set_trace_callback(None)
+        async with manager.read() as reader:
+            await reader.set_trace_callback(None)
+        await manager.close()
+    return statements
+
+
+def explain(conn: sqlite3.Connection, sql: str) -> List[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def find_problems(db_name: str, statements: List[Tuple[str, str]]) -> Dict[Tuple[str, str], List[str]]:
+    """Вернуть запросы с полным проходом по таблице или сортировкой во временном B-дереве"""
+    problems = {}
+    conn = sqlite3.connect(db_name)
+    try:
+        # SCAN по CTE (WITH RECURSIVE) или подзапросу - не проход по таблице
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for method, sql in statements:
+            if sql.lstrip().upper().startswith(_SKIP_PREFIXES) or (method, sql) in problems:
+                continue
+            plan = explain(conn, sql)
+            bad = [
+                detail for detail in plan
+                if (detail.startswith('SCAN ') and detail.split()[1] in tables)
+                or detail.startswith('USE TEMP B-TREE')
+            ]
+            if bad and method not in EXPECTED_FULL_SCANS and sql.strip() not in EXPECTED_FULL_SCAN_QUERIES:
+                problems[(method, sql)] = plan
+    finally:
+        conn.close()
+    return problems
+
+
+def main() -> int:
+    unchecked = unchecked_methods()
+    if unchecked:
+        print(f"ERROR: методы AsyncDatabase без проверки плана (добавьте их в _workload): {', '.join(unchecked)}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_name = os.path.join(tmp_dir, 'query_plans.db')
+        statements = asyncio.run(collect_statements(db_name))
+        problems = find_problems(db_name, statements)
+
+    checked = len({sql for _, sql in statements})
+    if not problems:
+        print(f"OK: проверено запросов: {checked}, полных проходов по таблицам нет")
+        return 0
+
+    print(f"ERROR: запросов без подходящего индекса: {len(problems)} (из {checked})")
+    for (method, sql), plan in problems.items():
+        print(f"\n[{method}] {' '.join(sql.split())}")
+        for detail in plan:
+            print(f"  - {detail}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,19 @@ load_dotenv()
 # Токен бота
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8579046645:AAH3YLjnLxUrYNfMy3-xfYJ8qn_mFIpVHxM")
 
+# Режим получения обновлений: polling или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling").strip().lower()
+
+# Webhook (RUN_MODE=webhook): встроенный aiohttp-сервер за reverse proxy
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # Публичный адрес (https://bot.example.com); пусто - не регистрировать webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Процессы-воркеры: больше 1 - главный процесс только принимает обновления и распределяет их по user_id
+WORKERS = int(os.getenv("WORKERS", "1"))
+
 # ID администраторов
 ADMINS_STR = os.getenv("ADMINS", "6933111964")
 ADMINS = [int(admin_id.strip()) for admin_id in ADMINS_STR.split(",") if admin_id.strip()]
@@ -31,6 +44,62 @@ CHEST_COST = int(os.getenv("CHEST_COST", "2000"))  # Стоимость сунд
 
 # База данных
 DB_NAME = os.getenv("DB_NAME", "bot_database.db")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))  # Соединений только для чтения
+DB_BATCH_WINDOW_MS = int(os.getenv("DB_BATCH_WINDOW_MS", "5"))  # Окно группового коммита начислений, мс
+DB_BATCH_MAX_SIZE = int(os.getenv("DB_BATCH_MAX_SIZE", "200"))  # Максимум операций в одной транзакции
+
+# Профиль производительности SQLite
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")  # WAL: чтение не блокируется записью
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # NORMAL в WAL: без fsync на каждый коммит
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))  # Кэш страниц на соединение, КБ
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", "67108864"))  # Размер mmap, байт (0 - выключен)
+DB_TEMP_STORE = os.getenv("DB_TEMP_STORE", "MEMORY")  # Временные таблицы и индексы в памяти
+DB_WAL_AUTOCHECKPOINT = int(os.getenv("DB_WAL_AUTOCHECKPOINT", "1000"))  # Автоконтрольная точка, страниц
+DB_CHECKPOINT_INTERVAL = int(os.getenv("DB_CHECKPOINT_INTERVAL", "300"))  # Периодический checkpoint, сек (0 - выключен)
+SETTINGS_SYNC_INTERVAL = float(os.getenv("SETTINGS_SYNC_INTERVAL", "1"))  # Проверка изменений настроек другими воркерами, сек
+
+# Хранилище состояний FSM: sqlite (таблица fsm_states) или memory (теряется при перезапуске)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower()
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "604800"))  # Состояние без изменений удаляется через, сек
+FSM_CLEANUP_INTERVAL = float(os.getenv("FSM_CLEANUP_INTERVAL", "3600"))  # Удаление устаревших состояний, сек
+
+# Ограничение частых нажатий "горячих" кнопок (бонус, проверки подписки, сундук)
+THROTTLE_LIMIT = int(os.getenv("THROTTLE_LIMIT", "3"))  # Нажатий одной кнопки за окно (0 - без ограничения)
+THROTTLE_WINDOW = float(os.getenv("THROTTLE_WINDOW", "2"))  # Скользящее окно, сек
+
+# Проверка подписки на каналы (get_chat_member)
+MEMBERSHIP_CHECK_CONCURRENCY = int(os.getenv("MEMBERSHIP_CHECK_CONCURRENCY", "8"))  # Одновременных запросов на процесс
+MEMBERSHIP_CHECK_TIMEOUT = float(os.getenv("MEMBERSHIP_CHECK_TIMEOUT", "5"))  # Таймаут одного запроса, сек
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "300"))  # Кэш "подписан", сек
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "10"))  # Кэш "не подписан", сек
+MEMBERSHIP_ERROR_TTL = float(os.getenv("MEMBERSHIP_ERROR_TTL", "60"))  # Кэш ошибки настройки канала, сек
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))  # Записей (пользователь, канал) в кэше
+MEMBERSHIP_TABLE_TTL = float(os.getenv("MEMBERSHIP_TABLE_TTL", "86400"))  # Подписка из таблицы channel_membership без перепроверки, сек
+
+# Очередь исходящих сообщений (Bot API: ~30 сообщений в секунду на бота, 1 в секунду в чат, 20 в минуту в группу)
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "25"))  # Сообщений в секунду (остаток - ответам в обработчиках)
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "5"))  # Запас для коротких всплесков
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "10"))  # Одновременных отправителей
+OUTBOUND_CHAT_INTERVAL = float(os.getenv("OUTBOUND_CHAT_INTERVAL", "1"))  # Между сообщениями в личный чат, сек
+OUTBOUND_GROUP_INTERVAL = float(os.getenv("OUTBOUND_GROUP_INTERVAL", "3"))  # Между сообщениями в группу/канал, сек
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))  # Повторов после flood wait
+OUTBOUND_METRICS_INTERVAL = float(os.getenv("OUTBOUND_METRICS_INTERVAL", "60"))  # Метрики очереди в лог, сек (0 - выключено)
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "10"))  # Досылка очереди при остановке, сек
+
+# Outbox уведомлений (доставка минимум один раз, повторы с растущей паузой)
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))  # Проверка outbox, сек
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))  # Уведомлений за проход
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "5"))  # Пауза после первой неудачи, сек
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "600"))  # Максимальная пауза между попытками, сек
+
+# Рассылка (идет через очередь исходящих сообщений с низким приоритетом)
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "10"))  # Одновременных отправителей
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # Обновление прогресса, сек
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))  # Получателей, читаемых из БД за раз
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "5"))  # Поиск рассылок, созданных другими воркерами, сек
+
+# Данные бота (username для реферальных ссылок): загружаются при запуске и периодически обновляются
+BOT_IDENTITY_REFRESH_INTERVAL = float(os.getenv("BOT_IDENTITY_REFRESH_INTERVAL", "3600"))  # Обновление, сек
 
 # Статистика проекта (для отображения пользователям)
 STATS_BASE_USERS = int(os.getenv("STATS_BASE_USERS", "29201"))  # Базовое количество пользователей
@@ -1,14 +1,72 @@
 import sqlite3
+import asyncio
+import contextlib
 import datetime
-from typing import Optional, List, Dict, Tuple
-from config import DB_NAME
+import logging
+import pathlib
+import time
+import types
+from typing import Any, Optional, List, Dict, Tuple, Callable, Awaitable, Sequence
+import aiosqlite
+from migrations import apply_migrations
+from config import (
+    DB_NAME, DB_READ_POOL_SIZE, DB_BATCH_WINDOW_MS, DB_BATCH_MAX_SIZE, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE, DB_TEMP_STORE, DB_WAL_AUTOCHECKPOINT, DB_CHECKPOINT_INTERVAL, SETTINGS_SYNC_INTERVAL
+)
+
+# Допустимые значения профиля: PRAGMA не принимает параметры, поэтому значения из env проверяем
+_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+_TEMP_STORE_MODES = ('DEFAULT', 'FILE', 'MEMORY')
+
+
+def _choice(name: str, value: str, allowed: Tuple[str, ...]) -> str:
+    value = value.strip().upper()
+    if value not in allowed:
+        raise ValueError(f"Недопустимое значение {name}={value}, ожидается одно из {allowed}")
+    return value
+
+
+def journal_mode() -> str:
+    """Режим журнала из профиля хранения (сохраняется в файле БД)"""
+    return _choice('DB_JOURNAL_MODE', DB_JOURNAL_MODE, _JOURNAL_MODES)
+
+
+def storage_pragmas() -> List[Tuple[str, str]]:
+    """PRAGMA профиля хранения, которые нужно выставлять на каждом соединении"""
+    return [
+        ('synchronous', _choice('DB_SYNCHRONOUS', DB_SYNCHRONOUS, _SYNCHRONOUS_MODES)),
+        # Отрицательное значение cache_size задается в килобайтах
+        ('cache_size', str(-abs(int(DB_CACHE_SIZE_KB)))),
+        ('mmap_size', str(max(0, int(DB_MMAP_SIZE)))),
+        ('temp_store', _choice('DB_TEMP_STORE', DB_TEMP_STORE, _TEMP_STORE_MODES)),
+        ('wal_autocheckpoint', str(max(0, int(DB_WAL_AUTOCHECKPOINT)))),
+    ]
+
+
+# Связи нового пользователя в referral_tree: реферер на глубине 1 и все его предки глубже
+_REFERRAL_TREE_INSERT = """
+    INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+    SELECT ?, ?, 1
+    UNION ALL
+    SELECT ancestor_id, ?, depth + 1 FROM referral_tree WHERE descendant_id = ?
+"""
 
 
 class Database:
-    def __init__(self):
+    """
+    Синхронное соединение для служебных скриптов: применяет миграции (в том числе перед
+    запуском бота) и дает init_task.py и test_db.py простые операции с заданиями.
+    Логика бота (пользователи, балансы, рефералы, рассылки) - только в AsyncDatabase.
+    """
+
+    def __init__(self, db_name: str = DB_NAME):
         try:
-            self.conn = sqlite3.connect(DB_NAME, check_same_thread=False, timeout=10.0)
+            self.conn = sqlite3.connect(db_name, check_same_thread=False, timeout=10.0)
             self.conn.row_factory = sqlite3.Row
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode()}")
+            for name, value in storage_pragmas():
+                self.conn.execute(f"PRAGMA {name}={value}")
             self.create_tables()
         except Exception as e:
             import logging
@@ -16,331 +74,480 @@ class Database:
             logger.error(f"Ошибка при инициализации базы данных: {e}", exc_info=True)
             raise
 
+    def close(self):
+        """Закрыть соединение с базой данных"""
+        self.conn.close()
+
     def create_tables(self):
+        """Применить недостающие миграции схемы (см. migrations.py)"""
         try:
-            cursor = self.conn.cursor()
-            
-            # Таблица пользователей
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    balance REAL DEFAULT 0.0,
-                    withdrawn REAL DEFAULT 0.0,
-                    referrer_id INTEGER,
-                    invited_count INTEGER DEFAULT 0,
-                    last_daily_bonus DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица заданий
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS tasks (
-                    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_type TEXT NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    channel_username TEXT,
-                    channel_link TEXT,
-                    reward REAL DEFAULT 0.0,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Добавляем поле channel_link, если его нет (для существующих баз данных)
-            try:
-                cursor.execute("ALTER TABLE tasks ADD COLUMN channel_link TEXT")
-            except sqlite3.OperationalError:
-                pass  # Поле уже существует
-            
-            # Таблица выполненных заданий
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS completed_tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    task_id INTEGER,
-                    completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (task_id) REFERENCES tasks(task_id),
-                    UNIQUE(user_id, task_id)
-                )
-            """)
-            
-            # Таблица подписок
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS subscriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    channel_username TEXT,
-                    subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    UNIQUE(user_id, channel_username)
-                )
-            """)
-            
-            # Таблица выводов
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS withdrawals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    method TEXT,
-                    wallet TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Таблица настроек
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
-            
-            # Таблица каналов для подписки
+            apply_migrations(self.conn)
+        except Exception as e:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.error(f"Ошибка при создании таблиц: {e}", exc_info=True)
+            raise
+
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return {key: row[key] for key in row.keys()} if row else None
+
+    def add_task(self, task_type: str, title: str, description: str = None, 
+                 channel_username: str = None, channel_link: str = None, reward: float = 0.0) -> int:
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            INSERT INTO tasks (task_type, title, description, channel_username, channel_link, reward)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (task_type, title, description, channel_username, channel_link, reward))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def get_tasks(self, task_type: str = None, active_only: bool = True) -> List[Dict]:
+        cursor = self.conn.cursor()
+        if task_type:
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS subscribe_channels (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel_username TEXT,
-                    channel_link TEXT,
-                    channel_chat_id TEXT,
-                    display_name TEXT,
-                    order_index INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Добавляем поле channel_chat_id, если его нет
-            try:
-                cursor.execute("ALTER TABLE subscribe_channels ADD COLUMN channel_chat_id TEXT")
-            except sqlite3.OperationalError:
-                pass  # Поле уже существует
-            
-            # Таблица для отслеживания награды за каждый канал отдельно
+                SELECT * FROM tasks 
+                WHERE task_type = ? AND is_active = ?
+                ORDER BY created_at DESC
+            """, (task_type, 1 if active_only else 0))
+        else:
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS channel_rewards (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    channel_id INTEGER,
-                    rewarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (channel_id) REFERENCES subscribe_channels(id),
-                    UNIQUE(user_id, channel_id)
-                )
-            """)
-            
-            # Миграция: обновляем структуру таблицы channel_rewards
-            try:
-                import logging
-                logger = logging.getLogger(__name__)
-                
-                # Проверяем, существует ли таблица
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='channel_rewards'")
-                table_exists = cursor.fetchone()
-                
-                if table_exists:
-                    # Проверяем, есть ли поле channel_id
-                    cursor.execute("PRAGMA table_info(channel_rewards)")
-                    columns = [row[1] for row in cursor.fetchall()]
-                    
-                    if 'channel_id' not in columns:
-                        # Добавляем поле channel_id
-                        cursor.execute("ALTER TABLE channel_rewards ADD COLUMN channel_id INTEGER")
-                        logger.info("✅ Миграция: добавлено поле channel_id в таблицу channel_rewards")
-                        
-                        # Коммитим изменения
-                        self.conn.commit()
-                    else:
-                        logger.info("✅ Миграция: поле channel_id уже существует в channel_rewards")
-                
-                # Если есть старое поле channels_hash, можно оставить его (не мешает)
-            except sqlite3.OperationalError as e:
-                # Таблица может не существовать - это нормально, она создастся выше
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"⚠️ Миграция channel_rewards: {e}")
-                pass
-            except Exception as e:
-                # Другие ошибки - логируем, но не прерываем работу
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"❌ Ошибка при миграции channel_rewards: {e}", exc_info=True)
-                pass
+                SELECT * FROM tasks 
+                WHERE is_active = ?
+                ORDER BY created_at DESC
+            """, (1 if active_only else 0,))
+        return [dict(row) for row in cursor.fetchall()]
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBatcher:
+    """
+    Групповой коммит для частых мелких записей (балансы, награды, состояния FSM).
+    Операции из разных корутин копятся несколько миллисекунд и выполняются одной
+    транзакцией, каждая в своем SAVEPOINT: ошибка одной операции не откатывает
+    остальные. Вызывающий получает результат операции только после коммита.
+    Одиночная запись без очереди коммитится сразу, окно ожидания - только под нагрузкой.
+    """
+
+    def __init__(self, manager: 'ConnectionManager', window_ms: int = DB_BATCH_WINDOW_MS,
+                 max_size: int = DB_BATCH_MAX_SIZE):
+        self.manager = manager
+        self.window = max(0, window_ms) / 1000
+        self.max_size = max(1, max_size)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # Счетчики для диагностики: сколько транзакций и операций записано
+        self.batches = 0
+        self.operations = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать накопленные операции и остановить фоновую задачу"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, operation: Callable[[aiosqlite.Connection], Awaitable]):
+        """Поставить операцию в очередь и дождаться коммита ее транзакции"""
+        if self._task is None:
+            # Фоновая задача не запущена (скрипты, остановка) - пишем сразу
+            async with self.manager.write() as conn:
+                return await operation(conn)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            # Под нагрузкой (в очереди есть еще записи) даем остальным корутинам время
+            # добавить свои записи в эту же транзакцию; одиночную запись не задерживаем
+            if self.window and not self._queue.empty():
+                await asyncio.sleep(self.window)
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                # Все, что было до маркера остановки, уже записано
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        await self._flush([item])
+                return
+
+    async def _flush(self, batch: List[Tuple[Callable, asyncio.Future]]):
+        outcomes = []
+        try:
+            async with self.manager.write() as conn:
+                for operation, future in batch:
+                    await conn.execute("SAVEPOINT batch_op")
+                    try:
+                        outcomes.append((future, await operation(conn), None))
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO batch_op")
+                        outcomes.append((future, None, e))
+                    await conn.execute("RELEASE batch_op")
+        except Exception as e:
+            logger.error(f"Ошибка группового коммита ({len(batch)} операций): {e}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.batches += 1
+        self.operations += len(batch)
+        for future, result, error in outcomes:
+            if future.done():
+                # Вызывающий перестал ждать (отмена) - запись все равно выполнена
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class ConnectionManager:
+    """
+    Общий на весь процесс реестр соединений с БД.
+    Миграции схемы выполняются один раз при open(), дальше используется
+    одно соединение на запись и небольшой пул соединений только для чтения,
+    поэтому чтения не ждут блокировку записи другого модуля.
+    """
+
+    def __init__(self, db_name: str = DB_NAME, read_pool_size: int = DB_READ_POOL_SIZE):
+        self.db_name = db_name
+        self.read_pool_size = max(1, read_pool_size)
+        self.writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._read_pool: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._checkpoint_task: Optional[asyncio.Task] = None
+        self.batcher = WriteBatcher(self)
+
+    @staticmethod
+    async def _apply_pragmas(conn: aiosqlite.Connection):
+        for name, value in storage_pragmas():
+            await conn.execute(f"PRAGMA {name}={value}")
+
+    async def open(self):
+        """Выполнить миграции и открыть соединения"""
+        try:
+            # Миграции схемы выполняем один раз в отдельном потоке
+            await asyncio.to_thread(lambda: Database(self.db_name).close())
             
-            # Инициализация настроек
-            cursor.execute("""
-                INSERT OR IGNORE INTO settings (key, value) 
-                VALUES ('bot_created_date', '12.06.2024'),
-                       ('total_users', '0'),
-                       ('total_withdrawn', '0'),
-                       ('withdraw_site_confirmation_text', '💸 Подтвердите вывод\n\nСумма: {amount:.0f} Rcoin\n\n📌 Пример: 5000 Rcoin = 1000 рублей на балансе\n\nПодтверждаете вывод?'),
-                       ('withdraw_site_success_text', '✅ Заявка на вывод создана! Жмите кнопку: "Ссылка на сайт", регистрируйтесь и получите 1000 рублей на баланс. ( может понадобиться VPN )'),
-                       ('withdraw_site_link', 'https://fontan-casino28.com/affiliate/f_tluqfc62?path=%2Fregistration&tds_skip=1'),
-                       ('withdraw_usdt_success_text', '✅ Заявка на вывод создана! Проверка качества приглашенных Вами рефералов займет от 1 до 7 рабочих дней. Также вы можете воспользоваться другим способом вывода. Он сразу поступит Вам на баланс.'),
-                       ('daily_bonus_min', '1'),
-                       ('daily_bonus_max', '50'),
-                       ('subscribe_button_text', '📢 Подписаться на каналы'),
-                       ('subscribe_message_text', '📢 Подпишитесь на каналы для получения награды!'),
-                       ('referral_reward', '350'),
-                       ('friend_referral_reward', '100'),
-                       ('subscribe_reward', '100'),
-                       ('streams_button_text', '💰 Зарабатывай на просмотре стримов...'),
-                       ('streams_message_text', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов\n\n📢 Для получения награды необходимо подписаться на канал: @akatsik\n\nПосле подписки нажмите кнопку "✅ Я подписался, проверить"'),
-                       ('welcome_text', '👋 Добро пожаловать!\n\nЭто бот для заработка Rcoin через выполнение заданий.\n\nВыберите действие в меню:'),
-                       ('stats_base_users', '29201'),
-                       ('stats_bot_created', '12.06.2024г'),
-                       ('stats_base_withdrawn', '169768'),
-                       ('chest_cost', '2000'),
-                       ('chest_message_text', '🎁 Поздравляем!\n\nДарим тебе 200FS БЕЗ ДЕПОЗИТА на проекте ... по промокоду {promo_code}'),
-                       ('chest_project_link', 'https://example.com')
-            """)
+            self.writer = await aiosqlite.connect(self.db_name, timeout=10.0)
+            self.writer.row_factory = aiosqlite.Row
+            await self._apply_pragmas(self.writer)
             
-            # Обновляем настройки вывода на актуальные значения (если они уже существуют)
-            cursor.execute("""
-                UPDATE settings SET value = '✅ Заявка на вывод создана! Жмите кнопку: "Ссылка на сайт", регистрируйтесь и получите 1000 рублей на баланс. ( может понадобиться VPN )'
-                WHERE key = 'withdraw_site_success_text'
-            """)
-            cursor.execute("""
-                UPDATE settings SET value = 'https://fontan-casino28.com/affiliate/f_tluqfc62?path=%2Fregistration&tds_skip=1'
-                WHERE key = 'withdraw_site_link'
-            """)
-            cursor.execute("""
-                UPDATE settings SET value = '✅ Заявка на вывод создана! Проверка качества приглашенных Вами рефералов займет от 1 до 7 рабочих дней. Также вы можете воспользоваться другим способом вывода. Он сразу поступит Вам на баланс.'
-                WHERE key = 'withdraw_usdt_success_text'
-            """)
+            read_uri = f"{pathlib.Path(self.db_name).resolve().as_uri()}?mode=ro"
+            self._read_pool = asyncio.Queue()
+            for _ in range(self.read_pool_size):
+                reader = await aiosqlite.connect(read_uri, uri=True, timeout=10.0)
+                reader.row_factory = aiosqlite.Row
+                await self._apply_pragmas(reader)
+                self._readers.append(reader)
+                self._read_pool.put_nowait(reader)
             
-            self.conn.commit()
+            self.batcher.start()
             
-            # Инициализация настроек из config.py (обновляем значения, если они есть в config)
-            self.init_default_settings()
+            report = await self.pragma_report()
+            logger.info(f"БД {self.db_name}: 1 соединение на запись, {self.read_pool_size} на чтение")
+            logger.info("Профиль SQLite: " + ", ".join(f"{name}={value}" for name, value in report.items()))
             
-            # Инициализация заданий при первом запуске
-            self.init_default_tasks()
+            if DB_CHECKPOINT_INTERVAL > 0 and report.get('journal_mode') == 'wal':
+                self._checkpoint_task = asyncio.create_task(self._checkpoint_loop(DB_CHECKPOINT_INTERVAL))
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Ошибка при создании таблиц: {e}", exc_info=True)
-            self.conn.rollback()
+            logger.error(f"Ошибка при подключении к базе данных: {e}", exc_info=True)
+            await self.close()
             raise
 
-    def get_user(self, user_id: int) -> Optional[Dict]:
+    async def close(self):
+        await self.batcher.stop()
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._checkpoint_task
+            self._checkpoint_task = None
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
+        self._read_pool = None
+        if self.writer is not None:
+            with contextlib.suppress(sqlite3.Error):
+                await self.checkpoint('TRUNCATE')
+            await self.writer.close()
+            self.writer = None
+
+    async def pragma_report(self) -> Dict[str, str]:
+        """Фактические значения PRAGMA на соединении записи (для отчета при старте)"""
+        report = {}
+        for name in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+                     'temp_store', 'wal_autocheckpoint', 'page_size'):
+            async with self.writer.execute(f"PRAGMA {name}") as cursor:
+                row = await cursor.fetchone()
+            report[name] = str(row[0]) if row else ''
+        return report
+
+    async def checkpoint(self, mode: str = 'PASSIVE') -> Optional[Tuple[int, int, int]]:
+        """Перенести WAL в основной файл: (busy, страниц в журнале, перенесено)"""
+        mode = _choice('checkpoint mode', mode, ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'))
+        async with self._write_lock:
+            async with self.writer.execute(f"PRAGMA wal_checkpoint({mode})") as cursor:
+                row = await cursor.fetchone()
+        return tuple(row) if row else None
+
+    async def _checkpoint_loop(self, interval: int):
+        """Периодический checkpoint, чтобы WAL не разрастался между автоконтрольными точками"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.checkpoint('PASSIVE')
+                logger.debug(f"WAL checkpoint: {result}")
+            except Exception as e:
+                logger.warning(f"Ошибка периодического checkpoint: {e}")
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        """Взять соединение только для чтения из пула"""
+        conn = await self._read_pool.get()
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
+            yield conn
+        finally:
+            self._read_pool.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        """Транзакция на запись: коммит при успехе, откат при ошибке"""
+        async with self._write_lock:
+            # IMMEDIATE: блокировка записи берется сразу, поэтому чтение внутри транзакции
+            # не упрется в SQLITE_BUSY, если в ту же БД пишет другой процесс (воркеры)
+            await self.writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.writer
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+
+class SettingsSnapshot:
+    """Неизменяемый снимок таблицы settings с типизированным чтением"""
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values: Dict[str, str]):
+        self._values = types.MappingProxyType(dict(values))
+
+    def get(self, key: str, default: str = "") -> str:
+        value = self._values.get(key)
+        return value if value is not None else default
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        try:
+            return int(float(self._values[key]))
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        try:
+            return float(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def replace(self, changes: Dict[str, str]) -> 'SettingsSnapshot':
+        """Новый снимок с измененными ключами (текущий не меняется)"""
+        return SettingsSnapshot({**self._values, **changes})
+
+
+class TaskCatalog:
+    """Неизменяемый снимок активных заданий с индексами по task_id и task_type"""
+
+    __slots__ = ('generation', '_tasks', '_by_id', '_by_type')
+
+    def __init__(self, tasks: List[Dict], generation: str = ""):
+        # Значение catalog_generation, при котором снимок прочитан
+        self.generation = generation
+        # Порядок как в get_tasks: сначала новые
+        self._tasks = tuple(types.MappingProxyType(task) for task in tasks)
+        self._by_id = {task['task_id']: task for task in self._tasks}
+        by_type: Dict[str, List] = {}
+        for task in self._tasks:
+            by_type.setdefault(task['task_type'], []).append(task)
+        self._by_type = {task_type: tuple(items) for task_type, items in by_type.items()}
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        task = self._by_id.get(task_id)
+        return dict(task) if task is not None else None
+
+    def all(self, task_type: str = None) -> List[Dict]:
+        tasks = self._by_type.get(task_type, ()) if task_type else self._tasks
+        return [dict(task) for task in tasks]
+
+
+class AsyncDatabase:
+    """
+    Асинхронный доступ к базе данных на aiosqlite.
+    Все запросы бота выполняются в потоках aiosqlite и не блокируют event loop.
+    Соединения берутся из ConnectionManager.
+    """
+
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        # Снимок настроек: загружается один раз, при записи заменяется целиком
+        self._settings: Optional[SettingsSnapshot] = None
+        # В БД пишут и другие процессы (воркеры, init_task.py): снимок сверяется со счетчиком settings_generation
+        self._settings_checked = 0.0
+        # Данные, собранные из БД для показа (меню заработка): имя -> (ключ версии, значение).
+        # Ключ строится из снимка настроек, поэтому кэш обновляется вместе с ним, в том числе в других процессах
+        self.view_cache: Dict[str, Tuple[tuple, Any]] = {}
+        # Активные задания в памяти: загружаются при первом обращении, сбрасываются при изменении
+        # (в этом процессе - сразу, в других - по счетчику catalog_generation)
+        self._tasks: Optional[TaskCatalog] = None
+
+    def _transaction(self):
+        return self.manager.write()
+
+    async def _batched(self, operation: Callable[[aiosqlite.Connection], Awaitable]):
+        """Выполнить запись через групповой коммит (см. WriteBatcher)"""
+        return await self.manager.batcher.submit(operation)
+
+    async def _fetchone(self, query: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+        async with self.manager.read() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchone()
+
+    async def _fetchall(self, query: str, params: tuple = ()) -> List[aiosqlite.Row]:
+        async with self.manager.read() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchall()
+
+    async def ping(self) -> bool:
+        """Простая проверка доступности БД"""
+        await self._fetchone("SELECT 1")
+        return True
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        try:
+            row = await self._fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,))
             if row:
                 return {key: row[key] for key in row.keys()}
             return None
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Ошибка в get_user: {e}", exc_info=True)
             return None
 
-    def create_user(self, user_id: int, username: str, first_name: str, referrer_id: Optional[int] = None):
-        cursor = self.conn.cursor()
+    async def create_user(self, user_id: int, username: str, first_name: str, referrer_id: Optional[int] = None):
         try:
-            cursor.execute("""
-                INSERT INTO users (user_id, username, first_name, referrer_id)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, username, first_name, referrer_id))
-            self.conn.commit()
-            
-            # Обновляем статистику
-            if referrer_id:
-                cursor.execute("""
-                    UPDATE users SET invited_count = invited_count + 1 
-                    WHERE user_id = ?
-                """, (referrer_id,))
-                self.conn.commit()
-            
-            # Обновляем общее количество пользователей
-            cursor.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'total_users'")
-            self.conn.commit()
+            async with self._transaction() as conn:
+                await conn.execute("""
+                    INSERT INTO users (user_id, username, first_name, referrer_id)
+                    VALUES (?, ?, ?, ?)
+                """, (user_id, username, first_name, referrer_id))
+                
+                # Обновляем статистику и дерево рефералов
+                if referrer_id:
+                    await conn.execute(_REFERRAL_TREE_INSERT, (referrer_id, user_id, user_id, referrer_id))
+                    await conn.execute("""
+                        UPDATE users SET invited_count = invited_count + 1 
+                        WHERE user_id = ?
+                    """, (referrer_id,))
+                
+                # Обновляем общее количество пользователей
+                await conn.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'total_users'")
+            self._bump_setting('total_users', 1)
             return True
         except sqlite3.IntegrityError:
             return False
 
-    def update_user_balance(self, user_id: int, amount: float) -> bool:
+    async def ensure_user(self, user_id: int, username: str = "", first_name: str = ""):
+        """Создать запись пользователя без реферера, если ее еще нет"""
+        async with self._transaction() as conn:
+            await conn.execute("""
+                INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
+                VALUES (?, ?, ?, 0.0)
+            """, (user_id, username, first_name))
+
+    async def update_user_balance(self, user_id: int, amount: float) -> bool:
         """Обновляет баланс пользователя. Если пользователя нет - создает его."""
-        try:
-            cursor = self.conn.cursor()
-            
+        async def operation(conn: aiosqlite.Connection) -> bool:
             # Создаем пользователя, если его нет
-            cursor.execute("""
+            await conn.execute("""
                 INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
                 VALUES (?, ?, ?, 0.0)
             """, (user_id, "", ""))
             
             # Обновляем баланс
-            cursor.execute("""
+            cursor = await conn.execute("""
                 UPDATE users SET balance = balance + ? WHERE user_id = ?
             """, (amount, user_id))
-            
-            self.conn.commit()
-            
-            # Проверяем, что обновление прошло успешно
-            if cursor.rowcount > 0:
-                return True
-            else:
-                # Если UPDATE не затронул строки, пробуем еще раз
-                cursor.execute("""
-                    INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
-                    VALUES (?, ?, ?, ?)
-                """, (user_id, "", "", amount))
-                cursor.execute("""
-                    UPDATE users SET balance = balance + ? WHERE user_id = ?
-                """, (amount, user_id))
-                self.conn.commit()
-                return cursor.rowcount > 0
+            return cursor.rowcount > 0
+        
+        try:
+            return await self._batched(operation)
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Ошибка при обновлении баланса: {e}", exc_info=True)
-            self.conn.rollback()
             return False
 
-    def get_referrer(self, user_id: int) -> Optional[int]:
-        user = self.get_user(user_id)
+    async def get_referrer(self, user_id: int) -> Optional[int]:
+        user = await self.get_user(user_id)
         return user['referrer_id'] if user else None
 
-    def get_invited_count(self, user_id: int) -> int:
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM users WHERE referrer_id = ?", (user_id,))
-        row = cursor.fetchone()
-        return row['count'] if row else 0
+    async def get_invited_count(self, user_id: int) -> int:
+        return await self.get_referrals_count(user_id, 1)
 
-    def get_friends_referrals_count(self, user_id: int) -> int:
+    async def get_friends_referrals_count(self, user_id: int) -> int:
         """Подсчет рефералов друзей (рефералы рефералов)"""
-        cursor = self.conn.cursor()
-        # Получаем всех прямых рефералов
-        cursor.execute("SELECT user_id FROM users WHERE referrer_id = ?", (user_id,))
-        direct_referrals = cursor.fetchall()
-        
-        total = 0
-        for ref in direct_referrals:
-            cursor.execute("SELECT COUNT(*) as count FROM users WHERE referrer_id = ?", (ref['user_id'],))
-            row = cursor.fetchone()
-            total += row['count'] if row else 0
-        
-        return total
+        return await self.get_referrals_count(user_id, 2)
 
-    def can_get_daily_bonus(self, user_id: int):
+    async def get_referrals_count(self, user_id: int, depth: int = 1) -> int:
+        """Количество рефералов на заданной глубине дерева (1 - прямые)"""
+        row = await self._fetchone("""
+            SELECT COUNT(*) as count FROM referral_tree
+            WHERE ancestor_id = ? AND depth = ?
+        """, (user_id, depth))
+        return row['count'] if row else 0
+
+    async def get_referrals_counts(self, user_id: int, max_depth: int) -> Dict[int, int]:
+        """Количество рефералов по всем уровням до max_depth: {глубина: количество}"""
+        rows = await self._fetchall("""
+            SELECT depth, COUNT(*) as count FROM referral_tree
+            WHERE ancestor_id = ? AND depth <= ?
+            GROUP BY depth
+        """, (user_id, max_depth))
+        return {row['depth']: row['count'] for row in rows}
+
+    async def get_referrals(self, user_id: int, depth: int = 1, limit: int = 100, offset: int = 0) -> List[int]:
+        """ID рефералов на заданной глубине дерева"""
+        rows = await self._fetchall("""
+            SELECT descendant_id FROM referral_tree
+            WHERE ancestor_id = ? AND depth = ?
+            ORDER BY descendant_id
+            LIMIT ? OFFSET ?
+        """, (user_id, depth, limit, offset))
+        return [row['descendant_id'] for row in rows]
+
+    async def can_get_daily_bonus(self, user_id: int):
         """
         Проверяет, может ли пользователь получить ежедневный бонус.
         Возвращает (can_get: bool, next_date: date или None)
-        Бонус обновляется каждый день (не через 24 часа, а в новую дату)
         """
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT last_daily_bonus FROM users WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
+        row = await self._fetchone("SELECT last_daily_bonus FROM users WHERE user_id = ?", (user_id,))
         if not row or not row['last_daily_bonus']:
             return True, None
         
@@ -349,189 +556,311 @@ class Database:
             today = datetime.date.today()
             
             if last_date < today:
-                # Можно получить бонус (прошлый раз был вчера или раньше)
                 return True, None
             else:
-                # Бонус уже получен сегодня, следующий доступен завтра
                 next_date = today + datetime.timedelta(days=1)
                 return False, next_date
         except (ValueError, TypeError):
-            # Если ошибка парсинга даты, разрешаем получить бонус
             return True, None
 
-    def set_daily_bonus(self, user_id: int, amount: float):
-        cursor = self.conn.cursor()
+    async def set_daily_bonus(self, user_id: int, amount: float):
         today = datetime.date.today().isoformat()
-        cursor.execute("""
-            UPDATE users SET last_daily_bonus = ?, balance = balance + ?
-            WHERE user_id = ?
-        """, (today, amount, user_id))
-        self.conn.commit()
+        
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute("""
+                UPDATE users SET last_daily_bonus = ?, balance = balance + ?
+                WHERE user_id = ?
+            """, (today, amount, user_id))
+        
+        await self._batched(operation)
 
-    def add_task(self, task_type: str, title: str, description: str = None, 
-                 channel_username: str = None, channel_link: str = None, reward: float = 0.0) -> int:
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO tasks (task_type, title, description, channel_username, channel_link, reward)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (task_type, title, description, channel_username, channel_link, reward))
-        self.conn.commit()
+    async def add_task(self, task_type: str, title: str, description: str = None,
+                       channel_username: str = None, channel_link: str = None, reward: float = 0.0) -> int:
+        async with self._transaction() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO tasks (task_type, title, description, channel_username, channel_link, reward)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (task_type, title, description, channel_username, channel_link, reward))
+        self._catalog_changed()
         return cursor.lastrowid
 
-    def get_tasks(self, task_type: str = None, active_only: bool = True) -> List[Dict]:
-        cursor = self.conn.cursor()
+    def _catalog_changed(self):
+        """Задания или каналы изменены в этом процессе"""
+        self._tasks = None
+        # Триггеры увеличили catalog_generation - перечитываем снимок настроек с новым значением
+        self._settings = None
+
+    async def get_task_catalog(self) -> TaskCatalog:
+        """Активные задания (таблица читается только после изменений заданий, в том числе другим процессом)"""
+        # Снимок настроек сверяется с БД не чаще SETTINGS_SYNC_INTERVAL (см. _sync_settings)
+        generation = (await self.get_settings()).get('catalog_generation')
+        if self._tasks is None or self._tasks.generation != generation:
+            rows = await self._fetchall("""
+                SELECT * FROM tasks 
+                WHERE is_active = 1
+                ORDER BY created_at DESC
+            """)
+            self._tasks = TaskCatalog([dict(row) for row in rows], generation)
+        return self._tasks
+
+    async def get_task(self, task_id: int) -> Optional[Dict]:
+        """Активное задание по ID"""
+        return (await self.get_task_catalog()).get(task_id)
+
+    async def get_tasks(self, task_type: str = None, active_only: bool = True) -> List[Dict]:
+        if active_only:
+            return (await self.get_task_catalog()).all(task_type)
         if task_type:
-            cursor.execute("""
+            rows = await self._fetchall("""
                 SELECT * FROM tasks 
                 WHERE task_type = ? AND is_active = ?
                 ORDER BY created_at DESC
             """, (task_type, 1 if active_only else 0))
         else:
-            cursor.execute("""
+            rows = await self._fetchall("""
                 SELECT * FROM tasks 
                 WHERE is_active = ?
                 ORDER BY created_at DESC
             """, (1 if active_only else 0,))
-        return [dict(row) for row in cursor.fetchall()]
+        return [dict(row) for row in rows]
 
-    def complete_task(self, user_id: int, task_id: int) -> bool:
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute("""
+    async def complete_task(self, user_id: int, task_id: int) -> bool:
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute("""
                 INSERT INTO completed_tasks (user_id, task_id)
                 VALUES (?, ?)
             """, (user_id, task_id))
             
-            # Начисляем награду
-            cursor.execute("SELECT reward FROM tasks WHERE task_id = ?", (task_id,))
-            task = cursor.fetchone()
-            if task:
-                self.update_user_balance(user_id, task['reward'])
-            
-            self.conn.commit()
+            # Начисляем награду в той же транзакции
+            await conn.execute("""
+                INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
+                VALUES (?, ?, ?, 0.0)
+            """, (user_id, "", ""))
+            await conn.execute("""
+                UPDATE users SET balance = balance + COALESCE((SELECT reward FROM tasks WHERE task_id = ?), 0)
+                WHERE user_id = ?
+            """, (task_id, user_id))
+        
+        try:
+            await self._batched(operation)
             return True
         except sqlite3.IntegrityError:
             return False
 
-    def is_task_completed(self, user_id: int, task_id: int) -> bool:
-        cursor = self.conn.cursor()
-        cursor.execute("""
+    async def grant_reward(self, user_id: int, task_id: int, amount: float,
+                           referral_levels: Tuple[float, ...] = (),
+                           channels: Optional[List[Tuple[int, str]]] = None) -> Optional[Dict]:
+        """
+        Начислить награду за задание и реферальные выплаты одной транзакцией.
+        referral_levels - выплаты по уровням цепочки (рефереру, рефереру реферера, ...),
+        платятся только за первую награду пользователя.
+        channels - список (id канала, ссылка) для задания подписки: тогда amount
+        начисляется за каждый еще не награжденный канал, а задание не закрывается.
+        Возвращает None, если начислять нечего (задание уже выполнено или отключено, новых каналов нет).
+        """
+        async def operation(conn: aiosqlite.Connection) -> Optional[Dict]:
+            # Задание могли отключить (в том числе в другом процессе) после того, как его показали пользователю
+            async with conn.execute(
+                "SELECT 1 FROM tasks WHERE task_id = ? AND is_active = 1", (task_id,)
+            ) as cursor:
+                if await cursor.fetchone() is None:
+                    return None
+            
+            await conn.execute("""
+                INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
+                VALUES (?, ?, ?, 0.0)
+            """, (user_id, "", ""))
+            
+            # Первая награда пользователя - до записи текущей
+            async with conn.execute("""
+                SELECT NOT EXISTS (SELECT 1 FROM completed_tasks WHERE user_id = ?)
+                   AND NOT EXISTS (SELECT 1 FROM channel_rewards WHERE user_id = ?)
+            """, (user_id, user_id)) as cursor:
+                first_reward = bool((await cursor.fetchone())[0])
+            
+            rewarded_channels = []
+            if channels is None:
+                cursor = await conn.execute("""
+                    INSERT OR IGNORE INTO completed_tasks (user_id, task_id)
+                    VALUES (?, ?)
+                """, (user_id, task_id))
+                if cursor.rowcount == 0:
+                    return None
+                total = amount
+            else:
+                for channel_id, channel_link in channels:
+                    cursor = await conn.execute("""
+                        INSERT OR IGNORE INTO channel_rewards (user_id, channel_id)
+                        VALUES (?, ?)
+                    """, (user_id, channel_id))
+                    if cursor.rowcount == 0:
+                        continue
+                    rewarded_channels.append(channel_id)
+                    if channel_link:
+                        await conn.execute("""
+                            INSERT OR IGNORE INTO subscriptions (user_id, channel_username)
+                            VALUES (?, ?)
+                        """, (user_id, channel_link))
+                if not rewarded_channels:
+                    return None
+                total = amount * len(rewarded_channels)
+            
+            await conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (total, user_id))
+            
+            # Реферальная цепочка одним запросом по referral_tree: (реферер, уровень)
+            referrals = []
+            if first_reward and referral_levels:
+                async with conn.execute("""
+                    SELECT ancestor_id, depth FROM referral_tree
+                    WHERE descendant_id = ? AND depth <= ?
+                    ORDER BY depth
+                """, (user_id, len(referral_levels))) as cursor:
+                    chain = await cursor.fetchall()
+                referrals = [(row[0], float(referral_levels[row[1] - 1])) for row in chain]
+                await conn.executemany(
+                    "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                    [(reward, referrer_id) for referrer_id, reward in referrals]
+                )
+            
+            async with conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                balance = (await cursor.fetchone())[0]
+            return {
+                'amount': total,
+                'balance': balance,
+                'channels': rewarded_channels,
+                'referrals': referrals,
+            }
+        
+        return await self._batched(operation)
+
+    async def is_task_completed(self, user_id: int, task_id: int) -> bool:
+        row = await self._fetchone("""
             SELECT COUNT(*) as count FROM completed_tasks 
             WHERE user_id = ? AND task_id = ?
         """, (user_id, task_id))
-        row = cursor.fetchone()
         return row['count'] > 0 if row else False
 
-    def add_subscription(self, user_id: int, channel_username: str):
-        cursor = self.conn.cursor()
+    async def add_subscription(self, user_id: int, channel_username: str):
         try:
-            cursor.execute("""
-                INSERT OR IGNORE INTO subscriptions (user_id, channel_username)
-                VALUES (?, ?)
-            """, (user_id, channel_username))
-            self.conn.commit()
+            async with self._transaction() as conn:
+                await conn.execute("""
+                    INSERT OR IGNORE INTO subscriptions (user_id, channel_username)
+                    VALUES (?, ?)
+                """, (user_id, channel_username))
             return True
         except Exception:
             return False
 
-    def is_subscribed(self, user_id: int, channel_username: str) -> bool:
-        cursor = self.conn.cursor()
-        cursor.execute("""
+    async def is_subscribed(self, user_id: int, channel_username: str) -> bool:
+        row = await self._fetchone("""
             SELECT COUNT(*) as count FROM subscriptions 
             WHERE user_id = ? AND channel_username = ?
         """, (user_id, channel_username))
-        row = cursor.fetchone()
         return row['count'] > 0 if row else False
 
-    def create_withdrawal(self, user_id: int, amount: float, method: str, wallet: str = None) -> int:
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO withdrawals (user_id, amount, method, wallet, status)
-            VALUES (?, ?, ?, ?, 'pending')
-        """, (user_id, amount, method, wallet))
-        
-        # Списываем баланс только для вывода на баланс сайта
-        # Для вывода на криптокошелек (USDT) баланс НЕ списывается
-        if method == "site":
-            cursor.execute("""
-                UPDATE users SET balance = balance - ?
-                WHERE user_id = ?
-            """, (amount, user_id))
+    async def create_withdrawal(self, user_id: int, amount: float, method: str, wallet: str = None,
+                                outbox: Sequence[Tuple[int, str]] = ()) -> int:
+        """Создать заявку; outbox - уведомления (chat_id, текст), записываемые в той же транзакции"""
+        async with self._transaction() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO withdrawals (user_id, amount, method, wallet, status)
+                VALUES (?, ?, ?, ?, 'pending')
+            """, (user_id, amount, method, wallet))
+            withdrawal_id = cursor.lastrowid
+            
+            if outbox:
+                await conn.executemany("INSERT INTO outbox (chat_id, text) VALUES (?, ?)", list(outbox))
+            
+            # Списываем баланс только для вывода на баланс сайта
+            # Для вывода на криптокошелек (USDT) баланс НЕ списывается
+            if method == "site":
+                await conn.execute("""
+                    UPDATE users SET balance = balance - ?
+                    WHERE user_id = ?
+                """, (amount, user_id))
+        return withdrawal_id
+
+    async def get_pending_outbox(self, limit: int = 50) -> List[Dict]:
+        """Неотправленные уведомления, срок следующей попытки которых наступил"""
+        rows = await self._fetchall("""
+            SELECT id, chat_id, text, attempts FROM outbox
+            WHERE sent_at IS NULL AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        """, (limit,))
+        return [dict(row) for row in rows]
+
+    async def mark_outbox_sent(self, outbox_id: int):
+        """Подтвердить доставку уведомления"""
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute("""
+                UPDATE outbox SET sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1 WHERE id = ?
+            """, (outbox_id,))
         
-        # НЕ обновляем статистику total_withdrawn здесь
-        # Она будет обновлена только при подтверждении вывода
+        await self._batched(operation)
+
+    async def mark_outbox_failed(self, outbox_id: int, error: str, retry_in: float):
+        """Отложить уведомление после неудачной попытки на retry_in секунд"""
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute("""
+                UPDATE outbox SET
+                    attempts = attempts + 1,
+                    last_error = ?,
+                    next_attempt_at = datetime('now', ?)
+                WHERE id = ?
+            """, (error, f"+{int(retry_in)} seconds", outbox_id))
         
-        self.conn.commit()
-        return cursor.lastrowid
-    
-    def confirm_withdrawal(self, withdrawal_id: int) -> bool:
+        await self._batched(operation)
+
+    async def confirm_withdrawal(self, withdrawal_id: int) -> bool:
         """Подтверждает вывод - обновляет withdrawn и статистику"""
-        cursor = self.conn.cursor()
-        
-        # Получаем информацию о выводе
-        cursor.execute("""
-            SELECT user_id, amount, method, status FROM withdrawals WHERE id = ?
-        """, (withdrawal_id,))
-        withdrawal = cursor.fetchone()
-        
-        if not withdrawal or withdrawal['status'] != 'pending':
-            return False
-        
-        user_id = withdrawal['user_id']
-        amount = withdrawal['amount']
-        method = withdrawal['method']
+        from config import COIN_TO_RUB
         
-        # Для вывода на криптокошелек (USDT) списываем баланс при подтверждении
-        # Для вывода на баланс сайта баланс уже был списан при создании заявки
-        if method == "usdt":
-            cursor.execute("""
-                UPDATE users SET balance = balance - ?
+        async with self._transaction() as conn:
+            async with conn.execute("""
+                SELECT user_id, amount, method, status FROM withdrawals WHERE id = ?
+            """, (withdrawal_id,)) as cursor:
+                withdrawal = await cursor.fetchone()
+            
+            if not withdrawal or withdrawal['status'] != 'pending':
+                return False
+            
+            user_id = withdrawal['user_id']
+            amount = withdrawal['amount']
+            
+            # Для вывода на криптокошелек (USDT) списываем баланс при подтверждении
+            if withdrawal['method'] == "usdt":
+                await conn.execute("""
+                    UPDATE users SET balance = balance - ?
+                    WHERE user_id = ?
+                """, (amount, user_id))
+            
+            await conn.execute("""
+                UPDATE users SET withdrawn = withdrawn + ?
                 WHERE user_id = ?
             """, (amount, user_id))
-        
-        # Обновляем withdrawn только при подтверждении
-        cursor.execute("""
-            UPDATE users SET withdrawn = withdrawn + ?
-            WHERE user_id = ?
-        """, (amount, user_id))
-        
-        # Обновляем статистику
-        from config import COIN_TO_RUB
-        rub_amount = amount / COIN_TO_RUB
-        cursor.execute("""
-            UPDATE settings SET value = CAST(value AS REAL) + ?
-            WHERE key = 'total_withdrawn'
-        """, (rub_amount,))
-        
-        # Меняем статус заявки
-        cursor.execute("""
-            UPDATE withdrawals SET status = 'completed'
-            WHERE id = ?
-        """, (withdrawal_id,))
-        
-        self.conn.commit()
+            
+            await conn.execute("""
+                UPDATE settings SET value = CAST(value AS REAL) + ?
+                WHERE key = 'total_withdrawn'
+            """, (amount / COIN_TO_RUB,))
+            
+            await conn.execute("""
+                UPDATE withdrawals SET status = 'completed'
+                WHERE id = ?
+            """, (withdrawal_id,))
+        self._bump_setting('total_withdrawn', amount / COIN_TO_RUB, cast=float)
         return True
 
-    def get_statistics(self) -> Dict:
-        cursor = self.conn.cursor()
-        stats = {}
-        
-        cursor.execute("SELECT value FROM settings WHERE key = 'total_users'")
-        row = cursor.fetchone()
-        stats['total_users'] = int(row['value']) if row else 0
-        
-        cursor.execute("SELECT value FROM settings WHERE key = 'total_withdrawn'")
-        row = cursor.fetchone()
-        stats['total_withdrawn'] = float(row['value']) if row else 0.0
-        
-        cursor.execute("SELECT value FROM settings WHERE key = 'bot_created_date'")
-        row = cursor.fetchone()
-        stats['bot_created_date'] = row['value'] if row else '12.06.2024'
-        
-        return stats
+    async def get_statistics(self) -> Dict:
+        settings = await self.get_settings()
+        return {
+            'total_users': settings.get_int('total_users', 0),
+            'total_withdrawn': settings.get_float('total_withdrawn', 0.0),
+            'bot_created_date': settings.get('bot_created_date', '12.06.2024'),
+        }
 
-    def update_task(self, task_id: int, **kwargs):
-        cursor = self.conn.cursor()
+    async def update_task(self, task_id: int, **kwargs):
         updates = []
         values = []
         
@@ -542,125 +871,296 @@ class Database:
         
         if updates:
             values.append(task_id)
-            cursor.execute(f"""
-                UPDATE tasks SET {', '.join(updates)}
-                WHERE task_id = ?
-            """, values)
-            self.conn.commit()
+            async with self._transaction() as conn:
+                await conn.execute(f"""
+                    UPDATE tasks SET {', '.join(updates)}
+                    WHERE task_id = ?
+                """, values)
+            self._catalog_changed()
 
-    def delete_task(self, task_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE tasks SET is_active = 0 WHERE task_id = ?", (task_id,))
-        self.conn.commit()
+    async def delete_task(self, task_id: int):
+        async with self._transaction() as conn:
+            await conn.execute("UPDATE tasks SET is_active = 0 WHERE task_id = ?", (task_id,))
+        self._catalog_changed()
 
-    def get_setting(self, key: str, default: str = "") -> str:
+    async def get_channel_membership(self, chat_key: str, user_id: int, max_age: float) -> Optional[bool]:
+        """Подписан ли пользователь на канал по локальной таблице (None - нет строки новее max_age секунд)"""
+        row = await self._fetchone("""
+            SELECT is_member FROM channel_membership
+            WHERE chat_key = ? AND user_id = ? AND updated_at > datetime('now', ?)
+        """, (chat_key, user_id, f"-{int(max_age)} seconds"))
+        return bool(row['is_member']) if row else None
+
+    async def set_channel_membership(self, chat_keys: List[str], user_id: int, status: str, is_member: bool):
+        """Запомнить статус пользователя в канале (под всеми ключами канала)"""
+        async def operation(conn: aiosqlite.Connection):
+            await conn.executemany("""
+                INSERT INTO channel_membership (chat_key, user_id, status, is_member, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (chat_key, user_id) DO UPDATE SET
+                    status = excluded.status,
+                    is_member = excluded.is_member,
+                    updated_at = excluded.updated_at
+            """, [(chat_key, user_id, status, int(is_member)) for chat_key in chat_keys])
+        
+        await self._batched(operation)
+
+    async def get_settings(self) -> SettingsSnapshot:
+        """Снимок всех настроек (таблица перечитывается только после изменений)"""
+        if self._settings is not None:
+            await self._sync_settings()
+        if self._settings is None:
+            rows = await self._fetchall("SELECT key, value FROM settings")
+            if self._settings is None:
+                self._settings = SettingsSnapshot({row['key']: row['value'] for row in rows})
+        return self._settings
+
+    async def _sync_settings(self):
+        """Сбросить снимок, если настройки изменил другой процесс (не чаще раза в SETTINGS_SYNC_INTERVAL)"""
+        now = time.monotonic()
+        if now - self._settings_checked < SETTINGS_SYNC_INTERVAL:
+            return
+        self._settings_checked = now
+        row = await self._fetchone("SELECT value FROM settings WHERE key = 'settings_generation'")
+        if self._settings is not None and row and row['value'] != self._settings.get('settings_generation'):
+            self._settings = None
+
+    def _bump_setting(self, key: str, delta: float, cast=int):
+        """Отразить в снимке счетчик, увеличенный SQL-запросом (total_users, total_withdrawn)"""
+        if self._settings is not None:
+            value = cast(self._settings.get_float(key)) + cast(delta)
+            self._settings = self._settings.replace({key: str(value)})
+
+    async def get_setting(self, key: str, default: str = "") -> str:
         """Получить настройку по ключу"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cursor.fetchone()
-        return row['value'] if row else default
+        return (await self.get_settings()).get(key, default)
+
+    async def get_setting_int(self, key: str, default: int = 0) -> int:
+        return (await self.get_settings()).get_int(key, default)
+
+    async def get_setting_float(self, key: str, default: float = 0.0) -> float:
+        return (await self.get_settings()).get_float(key, default)
 
-    def set_setting(self, key: str, value: str):
+    async def set_setting(self, key: str, value: str):
         """Установить настройку"""
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO settings (key, value)
-            VALUES (?, ?)
-        """, (key, value))
-        self.conn.commit()
+        async with self._transaction() as conn:
+            await conn.execute("""
+                INSERT OR REPLACE INTO settings (key, value)
+                VALUES (?, ?)
+            """, (key, value))
+        if self._settings is not None:
+            self._settings = self._settings.replace({key: str(value)})
 
-    def get_all_users(self) -> List[int]:
-        """Получить список всех user_id пользователей"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT user_id FROM users")
-        rows = cursor.fetchall()
+    async def get_all_users(self, include_unreachable: bool = False) -> List[int]:
+        """Получить список user_id пользователей (по умолчанию без заблокировавших бота)"""
+        if include_unreachable:
+            rows = await self._fetchall("SELECT user_id FROM users")
+        else:
+            rows = await self._fetchall("SELECT user_id FROM users WHERE is_reachable = 1")
         return [row['user_id'] for row in rows]
-    
-    def get_all_users_with_details(self, limit: int = 100, offset: int = 0) -> List[Dict]:
+
+    async def set_user_reachable(self, user_id: int, reachable: bool):
+        """Отметить, можно ли писать пользователю (False - заблокировал бота или удалил аккаунт)"""
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute("""
+                UPDATE users SET
+                    is_reachable = ?,
+                    unreachable_at = CASE WHEN ? THEN NULL ELSE CURRENT_TIMESTAMP END
+                WHERE user_id = ? AND is_reachable IS NOT ?
+            """, (int(reachable), int(reachable), user_id, int(reachable)))
+        
+        await self._batched(operation)
+
+    async def get_all_users_with_details(self, limit: int = 100, offset: int = 0) -> List[Dict]:
         """Получить список всех пользователей с их данными"""
-        cursor = self.conn.cursor()
-        cursor.execute("""
+        rows = await self._fetchall("""
             SELECT user_id, username, first_name, balance, withdrawn, invited_count, created_at
             FROM users
             ORDER BY created_at DESC
             LIMIT ? OFFSET ?
         """, (limit, offset))
-        rows = cursor.fetchall()
         return [{key: row[key] for key in row.keys()} for row in rows]
-    
-    def get_users_count(self) -> int:
+
+    async def get_fsm_record(self, key: Tuple, ttl: float) -> Optional[Dict]:
+        """Состояние и данные FSM по ключу (bot_id, chat_id, user_id, thread_id, destiny), если не устарели"""
+        row = await self._fetchone("""
+            SELECT state, data FROM fsm_states
+            WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+              AND updated_at > datetime('now', ?)
+        """, (*key, f"-{int(ttl)} seconds"))
+        return dict(row) if row else None
+
+    async def set_fsm_field(self, key: Tuple, field: str, value: Optional[str]):
+        """Записать state или data (NULL - очистить); пустая запись удаляется"""
+        if field not in ('state', 'data'):
+            raise ValueError(f"Недопустимое поле FSM: {field}")
+        
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute(f"""
+                INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, {field}, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET
+                    {field} = excluded.{field},
+                    updated_at = excluded.updated_at
+            """, (*key, value))
+            if value is None:
+                await conn.execute("""
+                    DELETE FROM fsm_states
+                    WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+                      AND state IS NULL AND data IS NULL
+                """, key)
+        
+        await self._batched(operation)
+
+    async def delete_expired_fsm(self, ttl: float) -> int:
+        """Удалить состояния FSM, не менявшиеся дольше ttl секунд"""
+        async with self._transaction() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM fsm_states WHERE updated_at <= datetime('now', ?)", (f"-{int(ttl)} seconds",)
+            )
+        return cursor.rowcount
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, progress_chat_id: int,
+                               progress_message_id: int, total: int) -> int:
+        """Создать задание рассылки"""
+        async with self._transaction() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO broadcasts (from_chat_id, message_id, progress_chat_id, progress_message_id, total)
+                VALUES (?, ?, ?, ?, ?)
+            """, (from_chat_id, message_id, progress_chat_id, progress_message_id, total))
+        return cursor.lastrowid
+
+    async def get_running_broadcasts(self) -> List[Dict]:
+        """Незавершенные рассылки (для продолжения после перезапуска)"""
+        rows = await self._fetchall("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [dict(row) for row in rows]
+
+    async def get_broadcast_recipients(self, broadcast_id: int, after_user_id: int, limit: int) -> List[int]:
+        """Следующая страница получателей после курсора, без уже обработанных"""
+        rows = await self._fetchall("""
+            SELECT user_id FROM users
+            WHERE user_id > ? AND is_reachable = 1
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_deliveries
+                  WHERE broadcast_id = ? AND broadcast_deliveries.user_id = users.user_id
+              )
+            ORDER BY user_id
+            LIMIT ?
+        """, (after_user_id, broadcast_id, limit))
+        return [row['user_id'] for row in rows]
+
+    async def record_broadcast_delivery(self, broadcast_id: int, user_id: int, status: str, error: Optional[str] = None):
+        """Записать результат отправки (status: 'sent', 'failed' или 'unreachable') и обновить счетчики задания"""
+        async def operation(conn: aiosqlite.Connection):
+            cursor = await conn.execute("""
+                INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status, error)
+                VALUES (?, ?, ?, ?)
+            """, (broadcast_id, user_id, status, error))
+            if cursor.rowcount:
+                sent, failed = (1, 0) if status == 'sent' else (0, 1)
+                await conn.execute("""
+                    UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (sent, failed, broadcast_id))
+        
+        await self._batched(operation)
+
+    async def update_broadcast_cursor(self, broadcast_id: int, cursor_user_id: int, finished: bool = False):
+        """Сдвинуть курсор рассылки; finished - отметить задание завершенным"""
+        async with self._transaction() as conn:
+            await conn.execute("""
+                UPDATE broadcasts SET
+                    cursor_user_id = MAX(cursor_user_id, ?),
+                    status = CASE WHEN ? THEN 'completed' ELSE status END,
+                    finished_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE finished_at END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (cursor_user_id, finished, finished, broadcast_id))
+
+    async def get_broadcast_stats(self, broadcast_id: int) -> Optional[Dict]:
+        """Статистика рассылки: счетчики, длительность, скорость и ошибки по типам"""
+        row = await self._fetchone("""
+            SELECT *, (julianday(COALESCE(finished_at, updated_at)) - julianday(created_at)) * 86400 AS duration
+            FROM broadcasts WHERE id = ?
+        """, (broadcast_id,))
+        if not row:
+            return None
+        stats = dict(row)
+        stats['rate'] = (stats['sent'] + stats['failed']) / stats['duration'] if stats['duration'] else 0.0
+        
+        rows = await self._fetchall("""
+            SELECT error, COUNT(*) as count FROM broadcast_deliveries
+            WHERE broadcast_id = ? AND status != 'sent'
+            GROUP BY status, error
+        """, (broadcast_id,))
+        stats['errors'] = {}
+        for row in rows:
+            error = row['error'] or ''
+            stats['errors'][error] = stats['errors'].get(error, 0) + row['count']
+        return stats
+
+    async def get_users_count(self) -> int:
         """Получить общее количество пользователей"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        row = cursor.fetchone()
+        row = await self._fetchone("SELECT COUNT(*) as count FROM users")
+        return row['count'] if row else 0
+
+    async def get_reachable_users_count(self) -> int:
+        """Количество пользователей, которым можно писать (получатели рассылки)"""
+        row = await self._fetchone("SELECT COUNT(*) as count FROM users WHERE is_reachable = 1")
         return row['count'] if row else 0
-    
-    def set_user_balance(self, user_id: int, balance: float) -> bool:
+
+    async def set_user_balance(self, user_id: int, balance: float) -> bool:
         """Установить конкретный баланс пользователя (не добавлять, а установить)"""
         try:
-            cursor = self.conn.cursor()
-            
-            # Создаем пользователя, если его нет
-            cursor.execute("""
-                INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
-                VALUES (?, ?, ?, 0.0)
-            """, (user_id, "", ""))
-            
-            # Устанавливаем баланс
-            cursor.execute("""
-                UPDATE users SET balance = ? WHERE user_id = ?
-            """, (balance, user_id))
-            
-            self.conn.commit()
+            async with self._transaction() as conn:
+                await conn.execute("""
+                    INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
+                    VALUES (?, ?, ?, 0.0)
+                """, (user_id, "", ""))
+                
+                cursor = await conn.execute("""
+                    UPDATE users SET balance = ? WHERE user_id = ?
+                """, (balance, user_id))
             return cursor.rowcount > 0
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Ошибка при установке баланса: {e}", exc_info=True)
-            self.conn.rollback()
             return False
 
-    def get_subscribe_channels(self, active_only: bool = True) -> List[Dict]:
+    async def get_subscribe_channels(self, active_only: bool = True) -> List[Dict]:
         """Получить список активных каналов для подписки"""
-        cursor = self.conn.cursor()
-        cursor.execute("""
+        rows = await self._fetchall("""
             SELECT * FROM subscribe_channels 
             WHERE is_active = 1 
             ORDER BY order_index, id
         """)
-        rows = cursor.fetchall()
         return [{key: row[key] for key in row.keys()} for row in rows]
 
-    def add_subscribe_channel(self, channel_username: str, channel_link: str, display_name: str, channel_chat_id: str = None) -> int:
+    async def add_subscribe_channel(self, channel_username: str, channel_link: str, display_name: str, channel_chat_id: str = None) -> int:
         """Добавить канал для подписки"""
-        cursor = self.conn.cursor()
-        # Проверяем, нет ли уже такого канала (по username или link)
-        cursor.execute("""
+        existing = await self._fetchone("""
             SELECT id FROM subscribe_channels 
             WHERE (channel_username = ? OR channel_link = ?) AND is_active = 1
         """, (channel_username, channel_link))
-        existing = cursor.fetchone()
         if existing:
             # Канал уже существует - возвращаем его ID
             return existing['id']
         
-        cursor.execute("""
-            INSERT INTO subscribe_channels (channel_username, channel_link, display_name, channel_chat_id)
-            VALUES (?, ?, ?, ?)
-        """, (channel_username, channel_link, display_name, channel_chat_id))
-        self.conn.commit()
+        async with self._transaction() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO subscribe_channels (channel_username, channel_link, display_name, channel_chat_id)
+                VALUES (?, ?, ?, ?)
+            """, (channel_username, channel_link, display_name, channel_chat_id))
+        self._catalog_changed()
         return cursor.lastrowid
 
-    def delete_subscribe_channel(self, channel_id: int):
+    async def delete_subscribe_channel(self, channel_id: int):
         """Удалить канал для подписки"""
-        cursor = self.conn.cursor()
-        # Физически удаляем канал из БД
-        cursor.execute("DELETE FROM subscribe_channels WHERE id = ?", (channel_id,))
-        self.conn.commit()
+        async with self._transaction() as conn:
+            await conn.execute("DELETE FROM subscribe_channels WHERE id = ?", (channel_id,))
+        self._catalog_changed()
 
-    def update_subscribe_channel(self, channel_id: int, **kwargs):
+    async def update_subscribe_channel(self, channel_id: int, **kwargs):
         """Обновить канал для подписки"""
-        cursor = self.conn.cursor()
         updates = []
         values = []
         
@@ -671,127 +1171,38 @@ class Database:
         
         if updates:
             values.append(channel_id)
-            cursor.execute(f"""
-                UPDATE subscribe_channels SET {', '.join(updates)}
-                WHERE id = ?
-            """, values)
-            self.conn.commit()
+            async with self._transaction() as conn:
+                await conn.execute(f"""
+                    UPDATE subscribe_channels SET {', '.join(updates)}
+                    WHERE id = ?
+                """, values)
+            self._catalog_changed()
 
-    def get_subscribe_channel(self, channel_id: int) -> Optional[Dict]:
+    async def get_subscribe_channel(self, channel_id: int) -> Optional[Dict]:
         """Получить канал по ID"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM subscribe_channels WHERE id = ?", (channel_id,))
-        row = cursor.fetchone()
+        row = await self._fetchone("SELECT * FROM subscribe_channels WHERE id = ?", (channel_id,))
         if row:
             return {key: row[key] for key in row.keys()}
         return None
-    
-    def has_received_reward_for_channel(self, user_id: int, channel_id: int) -> bool:
+
+    async def has_received_reward_for_channel(self, user_id: int, channel_id: int) -> bool:
         """Проверить, получал ли пользователь награду за конкретный канал"""
-        cursor = self.conn.cursor()
-        cursor.execute("""
+        row = await self._fetchone("""
             SELECT COUNT(*) as count FROM channel_rewards 
             WHERE user_id = ? AND channel_id = ?
         """, (user_id, channel_id))
-        row = cursor.fetchone()
         return row['count'] > 0 if row else False
-    
-    def mark_reward_received_for_channel(self, user_id: int, channel_id: int):
+
+    async def mark_reward_received_for_channel(self, user_id: int, channel_id: int):
         """Отметить, что пользователь получил награду за конкретный канал"""
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute("""
+        async def operation(conn: aiosqlite.Connection):
+            await conn.execute("""
                 INSERT INTO channel_rewards (user_id, channel_id)
                 VALUES (?, ?)
             """, (user_id, channel_id))
-            self.conn.commit()
+        
+        try:
+            await self._batched(operation)
         except sqlite3.IntegrityError:
             # Уже существует
             pass
-    
-    def init_default_settings(self):
-        """Инициализация настроек из config.py при первом запуске"""
-        try:
-            from config import REFERRAL_REWARD, FRIEND_REFERRAL_REWARD, DAILY_BONUS_MIN, DAILY_BONUS_MAX, STATS_BASE_USERS, STATS_BOT_CREATED, STATS_BASE_WITHDRAWN, CHEST_COST
-            import logging
-            logger = logging.getLogger(__name__)
-            cursor = self.conn.cursor()
-            
-            # Обновляем настройки из config.py, если они еще не установлены
-            settings_to_update = [
-                ('referral_reward', str(REFERRAL_REWARD)),
-                ('friend_referral_reward', str(FRIEND_REFERRAL_REWARD)),
-                ('daily_bonus_min', str(DAILY_BONUS_MIN)),
-                ('daily_bonus_max', str(DAILY_BONUS_MAX)),
-                ('stats_base_users', str(STATS_BASE_USERS)),
-                ('stats_bot_created', STATS_BOT_CREATED),
-                ('stats_base_withdrawn', str(STATS_BASE_WITHDRAWN)),
-                ('chest_cost', str(CHEST_COST)),
-            ]
-            
-            for key, value in settings_to_update:
-                # Проверяем, существует ли настройка
-                cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-                if not cursor.fetchone():
-                    # Если нет - добавляем
-                    cursor.execute("INSERT INTO settings (key, value) VALUES (?, ?)", (key, value))
-                    logger.info(f"Инициализирована настройка: {key} = {value}")
-            
-            self.conn.commit()
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Ошибка при инициализации настроек: {e}", exc_info=True)
-    
-    def init_default_tasks(self):
-        """Инициализация заданий при первом запуске, если их нет"""
-        try:
-            from config import SUBSCRIBE_REWARD, STREAM_INFO_REWARD
-            cursor = self.conn.cursor()
-            
-            # Проверяем, есть ли задание типа 'subscribe'
-            cursor.execute("SELECT COUNT(*) as count FROM tasks WHERE task_type = 'subscribe' AND is_active = 1")
-            subscribe_count = cursor.fetchone()['count']
-            
-            if subscribe_count == 0:
-                # Создаем задание для подписки на каналы
-                cursor.execute("""
-                    INSERT INTO tasks (task_type, title, description, reward, is_active)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    'subscribe',
-                    'Подписаться на каналы',
-                    'Подпишитесь на все указанные каналы для получения награды',
-                    SUBSCRIBE_REWARD,
-                    1
-                ))
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info("Создано задание для подписки на каналы")
-            
-            # Проверяем, есть ли задание типа 'info'
-            cursor.execute("SELECT COUNT(*) as count FROM tasks WHERE task_type = 'info' AND is_active = 1")
-            info_count = cursor.fetchone()['count']
-            
-            if info_count == 0:
-                # Создаем задание для просмотра информации о стримах
-                cursor.execute("""
-                    INSERT INTO tasks (task_type, title, description, reward, is_active)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    'info',
-                    'Узнать, как зарабатывать на просмотре трансляций/стримов',
-                    'Заработок на просмотре трансляций и стримов - это простой способ получать дополнительный доход.',
-                    STREAM_INFO_REWARD,
-                    1
-                ))
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info("Создано задание для просмотра информации о стримах")
-            
-            self.conn.commit()
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Ошибка при инициализации заданий: {e}", exc_info=True)
-
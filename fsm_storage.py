@@ -0,0 +1,75 @@
+"""
+Хранилище состояний FSM в SQLite вместо MemoryStorage.
+
+Состояние и данные (JSON) лежат в таблице fsm_states, поэтому пользователь,
+начавший вывод или админ-редактирование, продолжит после перезапуска бота, а
+процессы-воркеры видят одни и те же состояния. Запись идет через групповой коммит
+(WriteBatcher), чтение - по первичному ключу из пула соединений на чтение.
+Состояния, не менявшиеся дольше FSM_STATE_TTL, не возвращаются и периодически удаляются.
+
+Накладные расходы на обновление в сравнении с MemoryStorage: benchmark_fsm.py.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from config import FSM_STATE_TTL, FSM_CLEANUP_INTERVAL
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """BaseStorage aiogram поверх таблицы fsm_states"""
+
+    def __init__(self, db: AsyncDatabase, ttl: float = FSM_STATE_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> Tuple:
+        return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self.db.set_fsm_field(self._key(key), 'state', value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self.db.get_fsm_record(self._key(key), self.ttl)
+        return record['state'] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        value = json.dumps(data, ensure_ascii=False) if data else None
+        await self.db.set_fsm_field(self._key(key), 'data', value)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self.db.get_fsm_record(self._key(key), self.ttl)
+        if not record or not record['data']:
+            return {}
+        return json.loads(record['data'])
+
+    def start_cleanup(self, interval: float = FSM_CLEANUP_INTERVAL):
+        """Периодически удалять устаревшие состояния (в режиме воркеров - только в одном процессе)"""
+        if self._cleanup_task is None and interval > 0:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop(interval))
+
+    async def _cleanup_loop(self, interval: float):
+        while True:
+            try:
+                deleted = await self.db.delete_expired_fsm(self.ttl)
+                if deleted:
+                    logger.info(f"🧹 Удалено устаревших состояний FSM: {deleted}")
+            except Exception as e:
+                logger.error(f"Ошибка при удалении устаревших состояний FSM: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            await asyncio.gather(self._cleanup_task, return_exceptions=True)
+            self._cleanup_task = None
@@ -4,29 +4,13 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from config import ADMINS
-from database import Database
+from database import AsyncDatabase
+from broadcast import BroadcastEngine
 import logging
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-_db_instance = None
-
-def get_db():
-    global _db_instance
-    if _db_instance is None:
-        try:
-            _db_instance = Database()
-        except Exception as e:
-            logger.error(f"Ошибка при создании экземпляра базы данных: {e}", exc_info=True)
-            # Пытаемся пересоздать соединение
-            try:
-                _db_instance = Database()
-            except Exception as e2:
-                logger.error(f"Критическая ошибка БД: {e2}", exc_info=True)
-                raise
-    return _db_instance
-
 
 class AdminStates(StatesGroup):
     waiting_broadcast_message = State()
@@ -80,7 +64,7 @@ def get_withdraw_settings_keyboard():
 
 
 @router.message(Command("admin"))
-async def admin_panel(message: Message, state: FSMContext):
+async def admin_panel(message: Message, state: FSMContext, db: AsyncDatabase):
     """Главная команда админ-панели"""
     try:
         user_id = message.from_user.id
@@ -94,9 +78,8 @@ async def admin_panel(message: Message, state: FSMContext):
         
         # Проверяем доступность БД, но не блокируем загрузку меню
         try:
-            db = get_db()
             # Простая проверка - пытаемся выполнить простой запрос
-            db.conn.execute("SELECT 1")
+            await db.ping()
         except Exception as db_error:
             logger.error(f"Проблема с БД при загрузке админ-панели: {db_error}", exc_info=True)
             # Продолжаем работу, но предупреждаем админа
@@ -147,58 +130,33 @@ async def admin_broadcast_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_broadcast_message)
-async def admin_broadcast_process(message: Message, state: FSMContext):
+async def admin_broadcast_process(message: Message, state: FSMContext, db: AsyncDatabase, broadcaster: BroadcastEngine):
     """Обработка рассылки"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
-    users = db.get_all_users()
+    users_count = await db.get_reachable_users_count()
     
-    if not users:
+    if not users_count:
         await message.answer("❌ Пользователи не найдены.")
         await state.clear()
         return
     
-    # Отправляем сообщение всем пользователям
-    sent = 0
-    failed = 0
-    
-    await message.answer(f"📤 Начинаю рассылку для {len(users)} пользователей...")
-    
-    for user_id in users:
-        try:
-            await message.bot.copy_message(
-                chat_id=user_id,
-                from_chat_id=message.chat.id,
-                message_id=message.message_id
-            )
-            sent += 1
-        except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
-            failed += 1
-    
-    await message.answer(
-        f"✅ Рассылка завершена!\n\n"
-        f"📊 Статистика:\n"
-        f"• Отправлено: {sent}\n"
-        f"• Ошибок: {failed}\n"
-        f"• Всего: {len(users)}",
-        reply_markup=get_admin_keyboard()
-    )
+    # Рассылка сохраняется в БД и идет в фоне, прогресс обновляется в этом сообщении
+    progress_message = await message.answer(f"📤 Начинаю рассылку для {users_count} пользователей...")
+    await broadcaster.create(message.chat.id, message.message_id, progress_message)
     
     await state.clear()
 
 
 @router.callback_query(F.data == "admin_withdraw_settings")
-async def admin_withdraw_settings(callback: CallbackQuery):
+async def admin_withdraw_settings(callback: CallbackQuery, db: AsyncDatabase):
     """Меню настроек вывода"""
     try:
         # Проверяем БД, но не блокируем загрузку меню
         try:
-            db = get_db()
-            db.conn.execute("SELECT 1")
+            await db.ping()
         except Exception as db_error:
             logger.error(f"Проблема с БД в admin_withdraw_settings: {db_error}")
         
@@ -221,12 +179,11 @@ async def admin_withdraw_settings(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "admin_edit_confirmation")
-async def admin_edit_confirmation(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_confirmation(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Редактирование текста подтверждения"""
     try:
         logger.info(f"Начало редактирования текста подтверждения от {callback.from_user.id}")
-        db = get_db()
-        current_text = db.get_setting('withdraw_site_confirmation_text', '')
+        current_text = await db.get_setting('withdraw_site_confirmation_text', '')
         
         # Убираем "Сумма: {amount:.0f} Rcoin" из текущего текста для отображения
         display_text = current_text.replace('Сумма: {amount:.0f} Rcoin', '').replace('\n\n\n', '\n\n').strip()
@@ -248,7 +205,7 @@ async def admin_edit_confirmation(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_withdraw_confirmation_text)
-async def admin_save_confirmation_text(message: Message, state: FSMContext):
+async def admin_save_confirmation_text(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение текста подтверждения"""
     try:
         logger.info(f"Получено сообщение для сохранения текста подтверждения от {message.from_user.id}")
@@ -257,7 +214,6 @@ async def admin_save_confirmation_text(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        db = get_db()
         new_text = message.text
         logger.info(f"Новый текст подтверждения: {new_text[:50]}...")
         
@@ -265,7 +221,7 @@ async def admin_save_confirmation_text(message: Message, state: FSMContext):
         if 'Сумма:' not in new_text and '{amount}' not in new_text:
             new_text = f"{new_text}\n\nСумма: {{amount:.0f}} Rcoin"
         
-        db.set_setting('withdraw_site_confirmation_text', new_text)
+        await db.set_setting('withdraw_site_confirmation_text', new_text)
         logger.info("Текст подтверждения успешно сохранен в БД")
         
         await message.answer(
@@ -283,12 +239,11 @@ async def admin_save_confirmation_text(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_edit_success")
-async def admin_edit_success(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_success(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Редактирование текста успешного вывода"""
     try:
         logger.info(f"Начало редактирования текста успешного вывода от {callback.from_user.id}")
-        db = get_db()
-        current_text = db.get_setting('withdraw_site_success_text', '')
+        current_text = await db.get_setting('withdraw_site_success_text', '')
         
         await callback.message.edit_text(
             "✏️ Изменение текста успешного вывода\n\n"
@@ -307,7 +262,7 @@ async def admin_edit_success(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_withdraw_success_text)
-async def admin_save_success_text(message: Message, state: FSMContext):
+async def admin_save_success_text(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение текста успешного вывода"""
     try:
         logger.info(f"Получено сообщение для сохранения текста успешного вывода от {message.from_user.id}")
@@ -316,11 +271,10 @@ async def admin_save_success_text(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        db = get_db()
         new_text = message.text
         logger.info(f"Новый текст успешного вывода: {new_text[:50]}...")
         
-        db.set_setting('withdraw_site_success_text', new_text)
+        await db.set_setting('withdraw_site_success_text', new_text)
         logger.info("Текст успешного вывода успешно сохранен в БД")
         
         await message.answer(
@@ -338,12 +292,11 @@ async def admin_save_success_text(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_edit_site_link")
-async def admin_edit_site_link(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_site_link(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Редактирование ссылки на сайт"""
     try:
         logger.info(f"Начало редактирования ссылки на сайт от {callback.from_user.id}")
-        db = get_db()
-        current_link = db.get_setting('withdraw_site_link', 'https://example.com')
+        current_link = await db.get_setting('withdraw_site_link', 'https://example.com')
         
         await callback.message.edit_text(
             "🔗 Изменение ссылки на сайт\n\n"
@@ -362,7 +315,7 @@ async def admin_edit_site_link(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_withdraw_site_link)
-async def admin_save_site_link(message: Message, state: FSMContext):
+async def admin_save_site_link(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение ссылки на сайт"""
     try:
         logger.info(f"Получено сообщение для сохранения ссылки на сайт от {message.from_user.id}")
@@ -371,7 +324,6 @@ async def admin_save_site_link(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        db = get_db()
         new_link = message.text.strip()
         logger.info(f"Новая ссылка: {new_link}")
         
@@ -380,7 +332,7 @@ async def admin_save_site_link(message: Message, state: FSMContext):
             await message.answer("❌ Ссылка должна начинаться с http:// или https://")
             return
         
-        db.set_setting('withdraw_site_link', new_link)
+        await db.set_setting('withdraw_site_link', new_link)
         logger.info("Ссылка на сайт успешно сохранена в БД")
         
         await message.answer(
@@ -408,13 +360,12 @@ def get_welcome_stats_settings_keyboard():
 
 
 @router.callback_query(F.data == "admin_welcome_stats_settings")
-async def admin_welcome_stats_settings(callback: CallbackQuery):
+async def admin_welcome_stats_settings(callback: CallbackQuery, db: AsyncDatabase):
     """Меню настроек приветствия и статистики"""
     try:
         # Проверяем БД, но не блокируем загрузку меню
         try:
-            db = get_db()
-            db.conn.execute("SELECT 1")
+            await db.ping()
         except Exception as db_error:
             logger.error(f"Проблема с БД в admin_welcome_stats_settings: {db_error}")
         
@@ -437,10 +388,9 @@ async def admin_welcome_stats_settings(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "admin_edit_welcome_text")
-async def admin_edit_welcome_text(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_welcome_text(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Редактирование приветственного сообщения"""
-    db = get_db()
-    current_text = db.get_setting('welcome_text', '👋 Добро пожаловать!\n\nЭто бот для заработка Rcoin через выполнение заданий.\n\nВыберите действие в меню:')
+    current_text = await db.get_setting('welcome_text', '👋 Добро пожаловать!\n\nЭто бот для заработка Rcoin через выполнение заданий.\n\nВыберите действие в меню:')
     
     await callback.message.edit_text(
         "✏️ Изменение приветственного сообщения\n\n"
@@ -454,16 +404,15 @@ async def admin_edit_welcome_text(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_welcome_text)
-async def admin_save_welcome_text(message: Message, state: FSMContext):
+async def admin_save_welcome_text(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение приветственного сообщения"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_text = message.text
     
-    db.set_setting('welcome_text', new_text)
+    await db.set_setting('welcome_text', new_text)
     
     await message.answer(
         "✅ Приветственное сообщение сохранено!",
@@ -484,12 +433,11 @@ def get_stats_settings_keyboard():
 
 
 @router.callback_query(F.data == "admin_stats_settings")
-async def admin_stats_settings(callback: CallbackQuery):
+async def admin_stats_settings(callback: CallbackQuery, db: AsyncDatabase):
     """Меню редактирования статистики проекта"""
-    db = get_db()
-    base_users = db.get_setting('stats_base_users', '29201')
-    bot_created = db.get_setting('stats_bot_created', '12.06.2024г')
-    base_withdrawn = db.get_setting('stats_base_withdrawn', '169768')
+    base_users = await db.get_setting('stats_base_users', '29201')
+    bot_created = await db.get_setting('stats_bot_created', '12.06.2024г')
+    base_withdrawn = await db.get_setting('stats_base_withdrawn', '169768')
     
     text = (
         "📊 Редактирование статистики проекта\n\n"
@@ -517,7 +465,7 @@ async def admin_edit_stats_base_users(callback: CallbackQuery, state: FSMContext
 
 
 @router.message(AdminStates.waiting_stats_base_users)
-async def admin_save_stats_base_users(message: Message, state: FSMContext):
+async def admin_save_stats_base_users(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение базового количества пользователей"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -529,8 +477,7 @@ async def admin_save_stats_base_users(message: Message, state: FSMContext):
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('stats_base_users', str(value))
+        await db.set_setting('stats_base_users', str(value))
         
         await message.answer(
             f"✅ Базовое количество пользователей установлено: {value}",
@@ -556,16 +503,15 @@ async def admin_edit_stats_bot_created(callback: CallbackQuery, state: FSMContex
 
 
 @router.message(AdminStates.waiting_stats_bot_created)
-async def admin_save_stats_bot_created(message: Message, state: FSMContext):
+async def admin_save_stats_bot_created(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение даты создания бота"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_date = message.text.strip()
     
-    db.set_setting('stats_bot_created', new_date)
+    await db.set_setting('stats_bot_created', new_date)
     
     await message.answer(
         f"✅ Дата создания бота установлена: {new_date}",
@@ -589,7 +535,7 @@ async def admin_edit_stats_base_withdrawn(callback: CallbackQuery, state: FSMCon
 
 
 @router.message(AdminStates.waiting_stats_base_withdrawn)
-async def admin_save_stats_base_withdrawn(message: Message, state: FSMContext):
+async def admin_save_stats_base_withdrawn(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение базового количества выплаченных рублей"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -601,8 +547,7 @@ async def admin_save_stats_base_withdrawn(message: Message, state: FSMContext):
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('stats_base_withdrawn', str(value))
+        await db.set_setting('stats_base_withdrawn', str(value))
         
         await message.answer(
             f"✅ Базовое количество выплаченных рублей установлено: {value}",
@@ -614,12 +559,11 @@ async def admin_save_stats_base_withdrawn(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_users_stats")
-async def admin_users_stats(callback: CallbackQuery):
+async def admin_users_stats(callback: CallbackQuery, db: AsyncDatabase):
     """Меню статистики пользователей"""
     try:
-        db = get_db()
-        total_users = db.get_users_count()
-        users = db.get_all_users_with_details(limit=30, offset=0)
+        total_users = await db.get_users_count()
+        users = await db.get_all_users_with_details(limit=30, offset=0)
         
         if not users:
             await callback.message.edit_text(
@@ -688,12 +632,11 @@ async def admin_users_stats(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("admin_edit_user_balance_"))
-async def admin_edit_user_balance_start(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_user_balance_start(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Начало редактирования баланса пользователя"""
     try:
         user_id = int(callback.data.split("_")[-1])
-        db = get_db()
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         
         if not user:
             await callback.answer("❌ Пользователь не найден", show_alert=True)
@@ -728,7 +671,7 @@ async def admin_edit_user_balance_start(callback: CallbackQuery, state: FSMConte
 
 
 @router.message(AdminStates.waiting_user_balance)
-async def admin_save_user_balance(message: Message, state: FSMContext):
+async def admin_save_user_balance(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение баланса пользователя"""
     try:
         if message.from_user.id not in ADMINS:
@@ -752,11 +695,10 @@ async def admin_save_user_balance(message: Message, state: FSMContext):
             await message.answer("❌ Пожалуйста, отправьте число")
             return
         
-        db = get_db()
-        success = db.set_user_balance(user_id, new_balance)
+        success = await db.set_user_balance(user_id, new_balance)
         
         if success:
-            user = db.get_user(user_id)
+            user = await db.get_user(user_id)
             username = user.get('username', '') if user else ''
             first_name = user.get('first_name', 'Без имени') if user else 'Без имени'
             
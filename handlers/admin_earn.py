@@ -2,30 +2,14 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from config import ADMINS
-from database import Database
+from database import AsyncDatabase
 from handlers.admin import AdminStates, get_admin_keyboard
+from membership import cache as membership_cache
 import logging
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-_db_instance = None
-
-def get_db():
-    global _db_instance
-    if _db_instance is None:
-        try:
-            _db_instance = Database()
-        except Exception as e:
-            logger.error(f"Ошибка при создании экземпляра базы данных: {e}", exc_info=True)
-            # Пытаемся пересоздать соединение
-            try:
-                _db_instance = Database()
-            except Exception as e2:
-                logger.error(f"Критическая ошибка БД: {e2}", exc_info=True)
-                raise
-    return _db_instance
-
 
 def get_earn_settings_keyboard():
     """Меню настроек раздела 'Начать зарабатывать'"""
@@ -40,13 +24,12 @@ def get_earn_settings_keyboard():
 
 
 @router.callback_query(F.data == "admin_earn_settings")
-async def admin_earn_settings(callback: CallbackQuery):
+async def admin_earn_settings(callback: CallbackQuery, db: AsyncDatabase):
     """Меню настроек раздела 'Начать зарабатывать'"""
     try:
         # Проверяем БД, но не блокируем загрузку меню
         try:
-            db = get_db()
-            db.conn.execute("SELECT 1")
+            await db.ping()
         except Exception as db_error:
             logger.error(f"Проблема с БД в admin_earn_settings: {db_error}")
         
@@ -79,11 +62,10 @@ def get_daily_bonus_settings_keyboard():
 
 
 @router.callback_query(F.data == "admin_daily_bonus_settings")
-async def admin_daily_bonus_settings(callback: CallbackQuery):
+async def admin_daily_bonus_settings(callback: CallbackQuery, db: AsyncDatabase):
     """Меню настроек ежедневного бонуса"""
-    db = get_db()
-    min_bonus = db.get_setting('daily_bonus_min', '1')
-    max_bonus = db.get_setting('daily_bonus_max', '50')
+    min_bonus = await db.get_setting('daily_bonus_min', '1')
+    max_bonus = await db.get_setting('daily_bonus_max', '50')
     
     text = (
         "🎁 Настройки ежедневного бонуса\n\n"
@@ -110,7 +92,7 @@ async def admin_edit_daily_min(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_daily_bonus_min)
-async def admin_save_daily_min(message: Message, state: FSMContext):
+async def admin_save_daily_min(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение минимального бонуса"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -122,8 +104,7 @@ async def admin_save_daily_min(message: Message, state: FSMContext):
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('daily_bonus_min', str(min_value))
+        await db.set_setting('daily_bonus_min', str(min_value))
         
         await message.answer(
             f"✅ Минимальный бонус установлен: {min_value}R",
@@ -149,7 +130,7 @@ async def admin_edit_daily_max(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_daily_bonus_max)
-async def admin_save_daily_max(message: Message, state: FSMContext):
+async def admin_save_daily_max(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение максимального бонуса"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -161,8 +142,7 @@ async def admin_save_daily_max(message: Message, state: FSMContext):
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('daily_bonus_max', str(max_value))
+        await db.set_setting('daily_bonus_max', str(max_value))
         
         await message.answer(
             f"✅ Максимальный бонус установлен: {max_value}R",
@@ -187,13 +167,12 @@ def get_subscribe_settings_keyboard():
 
 
 @router.callback_query(F.data == "admin_subscribe_settings")
-async def admin_subscribe_settings(callback: CallbackQuery):
+async def admin_subscribe_settings(callback: CallbackQuery, db: AsyncDatabase):
     """Меню настроек подписки на каналы"""
     try:
         # Проверяем БД, но не блокируем загрузку меню
         try:
-            db = get_db()
-            db.conn.execute("SELECT 1")
+            await db.ping()
         except Exception as db_error:
             logger.error(f"Проблема с БД в admin_subscribe_settings: {db_error}")
         
@@ -230,16 +209,15 @@ async def admin_edit_subscribe_button(callback: CallbackQuery, state: FSMContext
 
 
 @router.message(AdminStates.waiting_subscribe_button_text)
-async def admin_save_subscribe_button(message: Message, state: FSMContext):
+async def admin_save_subscribe_button(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение текста кнопки подписки"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_text = message.text
     
-    db.set_setting('subscribe_button_text', new_text)
+    await db.set_setting('subscribe_button_text', new_text)
     
     await message.answer(
         "✅ Текст кнопки сохранен!",
@@ -263,16 +241,15 @@ async def admin_edit_subscribe_message(callback: CallbackQuery, state: FSMContex
 
 
 @router.message(AdminStates.waiting_subscribe_message_text)
-async def admin_save_subscribe_message(message: Message, state: FSMContext):
+async def admin_save_subscribe_message(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение текста сообщения подписки"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_text = message.text
     
-    db.set_setting('subscribe_message_text', new_text)
+    await db.set_setting('subscribe_message_text', new_text)
     
     await message.answer(
         "✅ Текст сообщения сохранен!",
@@ -352,7 +329,7 @@ async def admin_add_subscribe_channel_link(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_subscribe_channel_name)
-async def admin_add_subscribe_channel_name(message: Message, state: FSMContext):
+async def admin_add_subscribe_channel_name(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение канала"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -364,15 +341,17 @@ async def admin_add_subscribe_channel_name(message: Message, state: FSMContext):
     channel_chat_id = data.get('channel_chat_id')
     display_name = message.text.strip()
     
-    db = get_db()
     
     try:
-        channel_id = db.add_subscribe_channel(
+        channel_id = await db.add_subscribe_channel(
             channel_username=channel_username or '',
             channel_link=channel_link,
             display_name=display_name,
             channel_chat_id=channel_chat_id
         )
+        # Канал могли добавить заново после исправления прав бота - сбрасываем закэшированную ошибку
+        if channel_username:
+            membership_cache.forget(f"@{channel_username}")
         
         await message.answer(
             f"✅ Канал '{display_name}' добавлен!",
@@ -391,10 +370,9 @@ async def admin_add_subscribe_channel_name(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_list_subscribe_channels")
-async def admin_list_subscribe_channels(callback: CallbackQuery):
+async def admin_list_subscribe_channels(callback: CallbackQuery, db: AsyncDatabase):
     """Список каналов для подписки"""
-    db = get_db()
-    channels = db.get_subscribe_channels()
+    channels = await db.get_subscribe_channels()
     
     if not channels:
         await callback.message.edit_text(
@@ -433,15 +411,14 @@ async def admin_list_subscribe_channels(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("admin_delete_channel_"))
-async def admin_delete_channel(callback: CallbackQuery):
+async def admin_delete_channel(callback: CallbackQuery, db: AsyncDatabase):
     """Удаление канала"""
     channel_id = int(callback.data.split("_")[-1])
     
-    db = get_db()
-    db.delete_subscribe_channel(channel_id)
+    await db.delete_subscribe_channel(channel_id)
     
     await callback.answer("✅ Канал удален!", show_alert=True)
-    await admin_list_subscribe_channels(callback)
+    await admin_list_subscribe_channels(callback, db)
 
 
 def get_streams_settings_keyboard():
@@ -480,16 +457,15 @@ async def admin_edit_streams_button(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_streams_button_text)
-async def admin_save_streams_button(message: Message, state: FSMContext):
+async def admin_save_streams_button(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение названия кнопки стримов"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_text = message.text
     
-    db.set_setting('streams_button_text', new_text)
+    await db.set_setting('streams_button_text', new_text)
     
     await message.answer(
         "✅ Название кнопки сохранено!",
@@ -499,10 +475,9 @@ async def admin_save_streams_button(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_edit_streams_message")
-async def admin_edit_streams_message(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_streams_message(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Редактирование текста сообщения стримов"""
-    db = get_db()
-    current_text = db.get_setting('streams_message_text', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')
+    current_text = await db.get_setting('streams_message_text', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')
     
     await callback.message.edit_text(
         "✏️ Изменение текста сообщения стримов\n\n"
@@ -517,16 +492,15 @@ async def admin_edit_streams_message(callback: CallbackQuery, state: FSMContext)
 
 
 @router.message(AdminStates.waiting_streams_message_text)
-async def admin_save_streams_message(message: Message, state: FSMContext):
+async def admin_save_streams_message(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение текста сообщения стримов"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_text = message.text
     
-    db.set_setting('streams_message_text', new_text)
+    await db.set_setting('streams_message_text', new_text)
     
     await message.answer(
         "✅ Текст сообщения сохранен!",
@@ -536,10 +510,9 @@ async def admin_save_streams_message(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_edit_subscribe_reward")
-async def admin_edit_subscribe_reward(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_subscribe_reward(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Редактирование награды за подписку на один канал"""
-    db = get_db()
-    current_reward = db.get_setting('subscribe_reward', '100')
+    current_reward = await db.get_setting('subscribe_reward', '100')
     
     await callback.message.edit_text(
         "💰 Изменение награды за подписку на один канал\n\n"
@@ -554,7 +527,7 @@ async def admin_edit_subscribe_reward(callback: CallbackQuery, state: FSMContext
 
 
 @router.message(AdminStates.waiting_subscribe_reward)
-async def admin_save_subscribe_reward(message: Message, state: FSMContext):
+async def admin_save_subscribe_reward(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение награды за подписку на один канал"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -566,8 +539,7 @@ async def admin_save_subscribe_reward(message: Message, state: FSMContext):
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('subscribe_reward', str(reward_value))
+        await db.set_setting('subscribe_reward', str(reward_value))
         
         await message.answer(
             f"✅ Награда за подписку на один канал установлена: {reward_value}R\n\n"
@@ -615,7 +587,7 @@ async def admin_edit_referral_reward(callback: CallbackQuery, state: FSMContext)
 
 
 @router.message(AdminStates.waiting_referral_reward)
-async def admin_save_referral_reward(message: Message, state: FSMContext):
+async def admin_save_referral_reward(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение награды за реферала"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -627,8 +599,7 @@ async def admin_save_referral_reward(message: Message, state: FSMContext):
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('referral_reward', str(reward_value))
+        await db.set_setting('referral_reward', str(reward_value))
         
         await message.answer(
             f"✅ Награда за реферала установлена: {reward_value}R",
@@ -654,7 +625,7 @@ async def admin_edit_friend_referral_reward(callback: CallbackQuery, state: FSMC
 
 
 @router.message(AdminStates.waiting_friend_referral_reward)
-async def admin_save_friend_referral_reward(message: Message, state: FSMContext):
+async def admin_save_friend_referral_reward(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение награды за реферала друга"""
     if message.from_user.id not in ADMINS:
         await state.clear()
@@ -666,8 +637,7 @@ async def admin_save_friend_referral_reward(message: Message, state: FSMContext)
             await message.answer("❌ Значение должно быть больше или равно 0")
             return
         
-        db = get_db()
-        db.set_setting('friend_referral_reward', str(reward_value))
+        await db.set_setting('friend_referral_reward', str(reward_value))
         
         await message.answer(
             f"✅ Награда за реферала друга установлена: {reward_value}R",
@@ -719,16 +689,15 @@ async def admin_edit_chest_message(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_chest_message_text)
-async def admin_save_chest_message(message: Message, state: FSMContext):
+async def admin_save_chest_message(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение текста сообщения сундука"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_text = message.text
     
-    db.set_setting('chest_message_text', new_text)
+    await db.set_setting('chest_message_text', new_text)
     
     await message.answer(
         "✅ Текст сообщения сундука сохранен!",
@@ -752,13 +721,12 @@ async def admin_edit_chest_link(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_chest_project_link)
-async def admin_save_chest_link(message: Message, state: FSMContext):
+async def admin_save_chest_link(message: Message, state: FSMContext, db: AsyncDatabase):
     """Сохранение ссылки на проект"""
     if message.from_user.id not in ADMINS:
         await state.clear()
         return
     
-    db = get_db()
     new_link = message.text.strip()
     
     # Простая проверка формата ссылки
@@ -766,7 +734,7 @@ async def admin_save_chest_link(message: Message, state: FSMContext):
         await message.answer("❌ Ссылка должна начинаться с http:// или https://")
         return
     
-    db.set_setting('chest_project_link', new_link)
+    await db.set_setting('chest_project_link', new_link)
     
     await message.answer(
         "✅ Ссылка на проект сохранена!",
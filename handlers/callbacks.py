@@ -5,8 +5,11 @@ from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKe
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import Database
+from database import AsyncDatabase
 from config import *
+from membership import check_member, check_members, ERROR_INACCESSIBLE, ERROR_NOT_ADMIN
+from outbox import OutboxRelay
+from bot_identity import BotIdentity
 from keyboards import (
     get_main_menu, get_profile_keyboard, get_withdraw_keyboard,
     get_withdraw_methods_keyboard, get_earn_menu_keyboard,
@@ -15,10 +18,17 @@ from keyboards import (
 import asyncio
 
 router = Router()
-db = Database()
 logger = logging.getLogger(__name__)
 
 
+async def get_referral_levels(db: AsyncDatabase) -> tuple:
+    """Реферальные выплаты по уровням: рефереру и рефереру реферера"""
+    return (
+        await db.get_setting_float('referral_reward', 350),
+        await db.get_setting_float('friend_referral_reward', 100),
+    )
+
+
 class WithdrawStates(StatesGroup):
     waiting_amount = State()
     waiting_wallet = State()
@@ -27,10 +37,10 @@ class WithdrawStates(StatesGroup):
 
 
 @router.callback_query(F.data == "daily_bonus")
-async def daily_bonus(callback: CallbackQuery):
+async def daily_bonus(callback: CallbackQuery, db: AsyncDatabase):
     user_id = callback.from_user.id
     
-    can_get, next_time = db.can_get_daily_bonus(user_id)
+    can_get, next_time = await db.can_get_daily_bonus(user_id)
     
     if not can_get:
         # Показываем информацию о следующем бонусе
@@ -79,12 +89,12 @@ async def daily_bonus(callback: CallbackQuery):
             return
     
     # Выдаем бонус (получаем значения из настроек)
-    min_bonus = int(db.get_setting('daily_bonus_min', str(DAILY_BONUS_MIN)))
-    max_bonus = int(db.get_setting('daily_bonus_max', str(DAILY_BONUS_MAX)))
+    min_bonus = await db.get_setting_int('daily_bonus_min', DAILY_BONUS_MIN)
+    max_bonus = await db.get_setting_int('daily_bonus_max', DAILY_BONUS_MAX)
     amount = random.randint(min_bonus, max_bonus)
-    db.set_daily_bonus(user_id, amount)
+    await db.set_daily_bonus(user_id, amount)
     
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     # Вычисляем время следующего бонуса для отображения
     from datetime import datetime, timedelta
@@ -107,16 +117,11 @@ async def daily_bonus(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("task_"))
-async def handle_task(callback: CallbackQuery):
+async def handle_task(callback: CallbackQuery, db: AsyncDatabase):
     user_id = callback.from_user.id
     task_id = int(callback.data.split("_")[1])
     
-    task = None
-    tasks = db.get_tasks()
-    for t in tasks:
-        if t['task_id'] == task_id:
-            task = t
-            break
+    task = await db.get_task(task_id)
     
     if not task:
         await callback.answer("Задание не найдено!", show_alert=True)
@@ -124,13 +129,13 @@ async def handle_task(callback: CallbackQuery):
     
     # Для заданий типа 'subscribe' и 'info' не проверяем выполнение - кнопки всегда доступны
     if task['task_type'] not in ['subscribe', 'info']:
-        if db.is_task_completed(user_id, task_id):
+        if await db.is_task_completed(user_id, task_id):
             await callback.answer("Вы уже выполнили это задание!", show_alert=True)
             return
     
     if task['task_type'] == 'subscribe':
         # Проверяем, есть ли каналы в настройках
-        channels = db.get_subscribe_channels()
+        channels = await db.get_subscribe_channels()
         
         if not channels:
             # Нет каналов в настройках - задание недоступно
@@ -138,7 +143,7 @@ async def handle_task(callback: CallbackQuery):
             return
         
         # Используем каналы из настроек
-        message_text = db.get_setting('subscribe_message_text', '📢 Подпишитесь на каналы для получения награды!')
+        message_text = await db.get_setting('subscribe_message_text', '📢 Подпишитесь на каналы для получения награды!')
         
         # Создаем кнопки для каждого канала
         buttons = []
@@ -176,18 +181,13 @@ async def handle_task(callback: CallbackQuery):
         
         logger.info(f"Проверка подписки на канал @{channel_username} для пользователя {user_id}")
         
-        try:
-            member = await callback.bot.get_chat_member(f"@{channel_username}", user_id)
-            logger.info(f"Статус пользователя {user_id} в канале @{channel_username}: {member.status}")
-            if member.status in ['member', 'administrator', 'creator']:
-                is_subscribed = True
-                logger.info(f"Пользователь {user_id} подписан на канал @{channel_username}")
-            else:
-                logger.info(f"Пользователь {user_id} НЕ подписан на канал @{channel_username} (статус: {member.status})")
-        except Exception as e:
-            logger.error(f"Ошибка при проверке подписки на канал @{channel_username}: {e}", exc_info=True)
+        check = await check_member(callback.bot, f"@{channel_username}", user_id, db=db)
+        if not check.error:
+            is_subscribed = check.is_member
+            logger.info(f"Пользователь {user_id} {'подписан' if is_subscribed else 'НЕ подписан'} на канал @{channel_username}")
+        else:
             # Если бот не может проверить подписку, показываем сообщение с кнопкой
-            text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+            text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
             
             buttons = [
                 [InlineKeyboardButton(
@@ -212,7 +212,7 @@ async def handle_task(callback: CallbackQuery):
         if not is_subscribed:
             # Пользователь не подписан - показываем сообщение с кнопкой подписки
             logger.info(f"Пользователь {user_id} не подписан на канал @{channel_username}, показываем кнопки подписки")
-            text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+            text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
             
             buttons = [
                 [InlineKeyboardButton(
@@ -236,9 +236,9 @@ async def handle_task(callback: CallbackQuery):
             return
         
         # Пользователь подписан - проверяем, получал ли он уже награду
-        if db.is_task_completed(user_id, task_id):
+        if await db.is_task_completed(user_id, task_id):
             # Уже получил награду - показываем текст с кнопками, но без начисления
-            text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+            text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
             
             buttons = [
                 [InlineKeyboardButton(
@@ -261,39 +261,18 @@ async def handle_task(callback: CallbackQuery):
         # Используем награду из задания, если есть, иначе из конфига
         reward_amount = float(task.get('reward', STREAM_INFO_REWARD))
         
-        # Проверяем реферала перед выполнением задания
-        # Получаем награды за рефералов из БД
-        referral_reward = float(db.get_setting('referral_reward', '350'))
-        friend_referral_reward = float(db.get_setting('friend_referral_reward', '100'))
-        
-        user = db.get_user(user_id)
-        if user and user.get('referrer_id'):
-            cursor = db.conn.cursor()
-            # Проверяем, есть ли уже выполненные задания (кроме текущего)
-            cursor.execute(
-                "SELECT COUNT(*) as count FROM completed_tasks WHERE user_id = ? AND task_id != ?",
-                (user_id, task_id)
-            )
-            completed_before = cursor.fetchone()['count']
-            
-            # Начисляем за реферала только если это первое выполненное задание
-            if completed_before == 0:
-                db.update_user_balance(user['referrer_id'], referral_reward)
-                referrer = db.get_user(user['referrer_id'])
-                if referrer and referrer.get('referrer_id'):
-                    db.update_user_balance(referrer['referrer_id'], friend_referral_reward)
-        
-        db.update_user_balance(user_id, reward_amount)
-        db.complete_task(user_id, task_id)  # Помечаем задание как выполненное
-        
-        # Получаем обновленный баланс
-        user = db.get_user(user_id)
+        # Награда, выполнение задания и реферальные выплаты - одной транзакцией
+        granted = await db.grant_reward(user_id, task_id, reward_amount, await get_referral_levels(db))
+        if not granted:
+            # Повторное нажатие успело выполнить задание раньше
+            await callback.answer()
+            return
         
         # Используем настройку из БД для текста сообщения
-        text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+        text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
         
         # Добавляем информацию о начислении
-        text_with_reward = f"{text}\n\n✅ Начислено: {int(reward_amount)}R\n💰 Ваш баланс: {user['balance']:.2f}R"
+        text_with_reward = f"{text}\n\n✅ Начислено: {int(reward_amount)}R\n💰 Ваш баланс: {granted['balance']:.2f}R"
         
         buttons = [
             [InlineKeyboardButton(
@@ -313,43 +292,23 @@ async def handle_task(callback: CallbackQuery):
         await callback.message.edit_text(text_with_reward, reply_markup=keyboard)
     
     elif task['task_type'] == 'custom':
-        # Для кастомных заданий
-        # Проверяем реферала перед выполнением
-        # Получаем награды за рефералов из БД
-        referral_reward = float(db.get_setting('referral_reward', '350'))
-        friend_referral_reward = float(db.get_setting('friend_referral_reward', '100'))
-        
-        user = db.get_user(user_id)
-        if user and user.get('referrer_id'):
-            cursor = db.conn.cursor()
-            # Проверяем, есть ли уже выполненные задания (кроме текущего)
-            cursor.execute(
-                "SELECT COUNT(*) as count FROM completed_tasks WHERE user_id = ? AND task_id != ?",
-                (user_id, task_id)
-            )
-            completed_before = cursor.fetchone()['count']
-            
-            # Начисляем за реферала только если это первое выполненное задание
-            if completed_before == 0:
-                db.update_user_balance(user['referrer_id'], referral_reward)
-                referrer = db.get_user(user['referrer_id'])
-                if referrer and referrer.get('referrer_id'):
-                    db.update_user_balance(referrer['referrer_id'], friend_referral_reward)
-        
-        db.complete_task(user_id, task_id)
-        user = db.get_user(user_id)
+        # Для кастомных заданий: награда и реферальные выплаты одной транзакцией
+        granted = await db.grant_reward(user_id, task_id, float(task['reward']), await get_referral_levels(db))
+        if not granted:
+            await callback.answer("Вы уже выполнили это задание!", show_alert=True)
+            return
         
         await callback.answer(f"Задание выполнено! Начислено {task['reward']}R", show_alert=True)
         await callback.message.edit_text(
             f"✅ {task['title']}\n\n"
             f"{task['description'] or ''}\n\n"
             f"Начислено: {task['reward']}R\n"
-            f"Ваш баланс: {user['balance']:.2f}R"
+            f"Ваш баланс: {granted['balance']:.2f}R"
         )
 
 
 @router.callback_query(F.data.startswith("check_subscribe_") & ~F.data.startswith("check_subscribe_channels_"))
-async def check_subscription(callback: CallbackQuery):
+async def check_subscription(callback: CallbackQuery, db: AsyncDatabase):
     """Проверка подписки - перенаправляет на функцию с каналами из БД"""
     task_id = int(callback.data.split("_")[-1])
     
@@ -359,21 +318,20 @@ async def check_subscription(callback: CallbackQuery):
     
     try:
         # Вызываем функцию check_subscribe_channels напрямую
-        await check_subscribe_channels(callback)
+        await check_subscribe_channels(callback, db)
     finally:
         # Восстанавливаем оригинальный data
         callback.data = original_data
 
 
 @router.callback_query(F.data == "referral_link")
-async def show_referral_link(callback: CallbackQuery):
+async def show_referral_link(callback: CallbackQuery, db: AsyncDatabase, bot_identity: BotIdentity):
     user_id = callback.from_user.id
-    bot_username = (await callback.bot.get_me()).username
-    referral_link = f"https://t.me/{bot_username}?start={user_id}"
+    referral_link = await bot_identity.referral_link(user_id)
     
     # Получаем награды за рефералов из БД
-    referral_reward = int(float(db.get_setting('referral_reward', '350')))
-    friend_referral_reward = int(float(db.get_setting('friend_referral_reward', '100')))
+    referral_reward = await db.get_setting_int('referral_reward', 350)
+    friend_referral_reward = await db.get_setting_int('friend_referral_reward', 100)
     
     text = (
         f"👥 Пригласите друга и получите {referral_reward}R!\n\n"
@@ -390,12 +348,12 @@ async def show_referral_link(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "open_chest")
-async def open_chest(callback: CallbackQuery):
+async def open_chest(callback: CallbackQuery, db: AsyncDatabase):
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     # Получаем стоимость сундука из БД
-    chest_cost = float(db.get_setting('chest_cost', '2000'))
+    chest_cost = await db.get_setting_float('chest_cost', 2000)
     
     if not user:
         await callback.answer("Ошибка: пользователь не найден", show_alert=True)
@@ -407,14 +365,14 @@ async def open_chest(callback: CallbackQuery):
         return
     
     # Списываем стоимость
-    db.update_user_balance(user_id, -chest_cost)
+    await db.update_user_balance(user_id, -chest_cost)
     
     # Генерируем промокод
     promo_code = f"CHEST{random.randint(1000, 9999)}"
     
     # Получаем текст и ссылку из настроек
-    chest_text = db.get_setting('chest_message_text', '🎁 Поздравляем!\n\nДарим тебе 200FS БЕЗ ДЕПОЗИТА на проекте ... по промокоду {promo_code}')
-    chest_link = db.get_setting('chest_project_link', 'https://example.com')
+    chest_text = await db.get_setting('chest_message_text', '🎁 Поздравляем!\n\nДарим тебе 200FS БЕЗ ДЕПОЗИТА на проекте ... по промокоду {promo_code}')
+    chest_link = await db.get_setting('chest_project_link', 'https://example.com')
     
     # Заменяем {promo_code} на реальный промокод
     text = chest_text.replace('{promo_code}', promo_code)
@@ -430,10 +388,10 @@ async def open_chest(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "withdraw")
-async def start_withdraw(callback: CallbackQuery):
+async def start_withdraw(callback: CallbackQuery, db: AsyncDatabase):
     from config import ADMINS
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     balance = user.get('balance', 0.0)
     is_admin = user_id in ADMINS
     
@@ -478,10 +436,10 @@ async def ask_withdraw_amount(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(WithdrawStates.waiting_amount)
-async def process_withdraw_amount(message: Message, state: FSMContext):
+async def process_withdraw_amount(message: Message, state: FSMContext, db: AsyncDatabase):
     from config import ADMINS
     user_id = message.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     is_admin = user_id in ADMINS
     
     try:
@@ -507,7 +465,7 @@ async def process_withdraw_amount(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "withdraw_site")
-async def withdraw_to_site(callback: CallbackQuery, state: FSMContext):
+async def withdraw_to_site(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     from config import ADMINS, COIN_TO_RUB
     data = await state.get_data()
     amount = data.get('amount')
@@ -517,7 +475,7 @@ async def withdraw_to_site(callback: CallbackQuery, state: FSMContext):
         return
     
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     is_admin = user_id in ADMINS
     
     # Для админов нет ограничений по балансу
@@ -529,7 +487,7 @@ async def withdraw_to_site(callback: CallbackQuery, state: FSMContext):
     rub_amount = amount / COIN_TO_RUB
     
     # Получаем текст подтверждения из настроек
-    confirmation_text = db.get_setting('withdraw_site_confirmation_text', 
+    confirmation_text = await db.get_setting('withdraw_site_confirmation_text', 
         '💸 Подтвердите вывод\n\nСумма: {amount:.0f} Rcoin\n\n📌 Пример: 5000 Rcoin = 1000 рублей на балансе\n\nПодтверждаете вывод?')
     
     # Подставляем сумму в текст
@@ -550,7 +508,8 @@ async def withdraw_to_site(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "confirm_site_withdraw")
-async def confirm_site_withdraw(callback: CallbackQuery, state: FSMContext):
+async def confirm_site_withdraw(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                                outbox: OutboxRelay):
     from config import ADMINS, COIN_TO_RUB
     import logging
     logger = logging.getLogger(__name__)
@@ -563,7 +522,7 @@ async def confirm_site_withdraw(callback: CallbackQuery, state: FSMContext):
         return
     
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     is_admin = user_id in ADMINS
     
     # Для админов нет ограничений по балансу
@@ -574,52 +533,36 @@ async def confirm_site_withdraw(callback: CallbackQuery, state: FSMContext):
     # Генерируем промокод
     promo_code = f"WITHDRAW{random.randint(10000, 99999)}"
     
-    # Создаем заявку на вывод (баланс списывается внутри create_withdrawal)
-    withdrawal_id = db.create_withdrawal(user_id, amount, "site", promo_code)
+    # Уведомление для канала
+    username = user.get('username', 'N/A')
+    if username == 'N/A':
+        username_text = f"ID: {user_id}"
+    else:
+        username_text = f"@{username}"
     
-    # Отправляем в канал
-    from config import WITHDRAWAL_CHANNEL_ID
-    try:
-        username = user.get('username', 'N/A')
-        if username == 'N/A':
-            username_text = f"ID: {user_id}"
-        else:
-            username_text = f"@{username}"
-        
-        message_text = (
-            f"💸 Новая заявка на вывод\n\n"
-            f"Пользователь: {username_text}\n"
-            f"Сумма: {amount:.0f}R\n"
-            f"Способ: Другой способ"
-        )
-        
-        logger.info(f"Попытка отправить уведомление в канал {WITHDRAWAL_CHANNEL_ID}")
-        await callback.bot.send_message(
-            chat_id=WITHDRAWAL_CHANNEL_ID,
-            text=message_text
-        )
-        logger.info(f"Уведомление успешно отправлено в канал")
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка при отправке уведомления в канал {WITHDRAWAL_CHANNEL_ID}: {error_msg}", exc_info=True)
-        # Также отправляем админу для отладки
-        try:
-            await callback.bot.send_message(
-                ADMINS[0],
-                f"⚠️ Ошибка отправки в канал:\n{error_msg}\n\nПроверьте, что бот добавлен в канал как администратор."
-            )
-        except:
-            pass
+    message_text = (
+        f"💸 Новая заявка на вывод\n\n"
+        f"Пользователь: {username_text}\n"
+        f"Сумма: {amount:.0f}R\n"
+        f"Способ: Другой способ"
+    )
+    
+    # Создаем заявку на вывод (баланс списывается внутри create_withdrawal);
+    # уведомление пишется в outbox той же транзакцией и отправляется в фоне
+    withdrawal_id = await db.create_withdrawal(
+        user_id, amount, "site", promo_code, outbox=[(WITHDRAWAL_CHANNEL_ID, message_text)]
+    )
+    outbox.wake()
     
     # Получаем обновленный баланс
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     # Получаем текст успешного вывода из настроек
-    success_text = db.get_setting('withdraw_site_success_text', 
+    success_text = await db.get_setting('withdraw_site_success_text', 
         '✅ Заявка на вывод создана!\n\n⏳ Ожидайте исполнения заявки.')
     
     # Получаем ссылку на сайт из настроек
-    site_link = db.get_setting('withdraw_site_link', 'https://example.com')
+    site_link = await db.get_setting('withdraw_site_link', 'https://example.com')
     
     await callback.message.edit_text(
         success_text,
@@ -648,7 +591,8 @@ async def ask_usdt_wallet(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(WithdrawStates.waiting_wallet)
-async def process_usdt_withdraw(message: Message, state: FSMContext):
+async def process_usdt_withdraw(message: Message, state: FSMContext, db: AsyncDatabase,
+                                outbox: OutboxRelay):
     from config import ADMINS
     user_id = message.from_user.id
     wallet = message.text.strip()
@@ -666,55 +610,37 @@ async def process_usdt_withdraw(message: Message, state: FSMContext):
         await message.answer("Ошибка: сумма не указана")
         return
     
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     # Для админов нет ограничений по балансу
     if not is_admin and amount > user['balance']:
         await message.answer("Недостаточно средств на балансе!")
         return
     
-    # Создаем заявку на вывод (баланс списывается внутри create_withdrawal)
-    withdrawal_id = db.create_withdrawal(user_id, amount, "usdt", wallet)
+    # Уведомление для канала
+    username = user.get('username', 'N/A')
+    if username == 'N/A':
+        username_text = f"ID: {user_id}"
+    else:
+        username_text = f"@{username}"
+    
+    message_text = (
+        f"💸 Новая заявка на вывод\n\n"
+        f"Пользователь: {username_text}\n"
+        f"Сумма: {amount:.0f}R\n"
+        f"Способ: USDT (BEP20)\n"
+        f"Кошелек: {wallet}"
+    )
     
-    # Отправляем в канал
-    from config import WITHDRAWAL_CHANNEL_ID, ADMINS
-    import logging
-    logger = logging.getLogger(__name__)
-    try:
-        username = user.get('username', 'N/A')
-        if username == 'N/A':
-            username_text = f"ID: {user_id}"
-        else:
-            username_text = f"@{username}"
-        
-        message_text = (
-            f"💸 Новая заявка на вывод\n\n"
-            f"Пользователь: {username_text}\n"
-            f"Сумма: {amount:.0f}R\n"
-            f"Способ: USDT (BEP20)\n"
-            f"Кошелек: {wallet}"
-        )
-        
-        logger.info(f"Попытка отправить уведомление в канал {WITHDRAWAL_CHANNEL_ID}")
-        await message.bot.send_message(
-            chat_id=WITHDRAWAL_CHANNEL_ID,
-            text=message_text
-        )
-        logger.info(f"Уведомление успешно отправлено в канал")
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка при отправке уведомления в канал {WITHDRAWAL_CHANNEL_ID}: {error_msg}", exc_info=True)
-        # Также отправляем админу для отладки
-        try:
-            await message.bot.send_message(
-                ADMINS[0],
-                f"⚠️ Ошибка отправки в канал:\n{error_msg}\n\nПроверьте, что бот добавлен в канал как администратор."
-            )
-        except:
-            pass
+    # Создаем заявку на вывод (баланс списывается внутри create_withdrawal);
+    # уведомление пишется в outbox той же транзакцией и отправляется в фоне
+    withdrawal_id = await db.create_withdrawal(
+        user_id, amount, "usdt", wallet, outbox=[(WITHDRAWAL_CHANNEL_ID, message_text)]
+    )
+    outbox.wake()
     
     # Получаем текст успешного вывода USDT из настроек
-    success_text = db.get_setting('withdraw_usdt_success_text', 
+    success_text = await db.get_setting('withdraw_usdt_success_text', 
         '✅ Заявка на вывод создана! Проверка качества приглашенных Вами рефералов займет от 1 до 7 рабочих дней. Также вы можете воспользоваться другим способом вывода. Он сразу поступит Вам на баланс.')
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -730,20 +656,20 @@ async def process_usdt_withdraw(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "back_to_profile")
-async def back_to_profile(callback: CallbackQuery, state: FSMContext):
+async def back_to_profile(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Возврат к профилю из процесса вывода"""
     await state.clear()
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     
     referrer_id = user.get('referrer_id')
     referrer_name = "Нет"
     if referrer_id:
-        referrer = db.get_user(referrer_id)
+        referrer = await db.get_user(referrer_id)
         if referrer:
             referrer_name = f"@{referrer.get('username', '')}" if referrer.get('username') else f"ID: {referrer_id}"
     
-    invited_count = db.get_invited_count(user_id)
+    invited_count = await db.get_invited_count(user_id)
     
     profile_text = (
         f"👤 Личный кабинет\n\n"
@@ -762,12 +688,12 @@ async def back_to_profile(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "back_to_withdraw_start")
-async def back_to_withdraw_start(callback: CallbackQuery, state: FSMContext):
+async def back_to_withdraw_start(callback: CallbackQuery, state: FSMContext, db: AsyncDatabase):
     """Возврат к началу процесса вывода"""
     from config import ADMINS
     await state.clear()
     user_id = callback.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     balance = user.get('balance', 0.0)
     is_admin = user_id in ADMINS
     
@@ -810,10 +736,9 @@ async def back_to_withdraw_methods(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "back_to_earn_menu")
-async def back_to_earn_menu(callback: CallbackQuery):
+async def back_to_earn_menu(callback: CallbackQuery, db: AsyncDatabase):
     """Возврат в меню заработка"""
-    user_id = callback.from_user.id
-    keyboard = get_earn_menu_keyboard(user_id)
+    keyboard = await get_earn_menu_keyboard(db)
     
     await callback.message.edit_text(
         "💰 Выберите способ заработка:",
@@ -823,7 +748,7 @@ async def back_to_earn_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("check_subscribe_channels_"))
-async def check_subscribe_channels(callback: CallbackQuery):
+async def check_subscribe_channels(callback: CallbackQuery, db: AsyncDatabase):
     """Проверка подписки на все каналы из настроек"""
     user_id = callback.from_user.id
     task_id = int(callback.data.split("_")[-1])
@@ -833,29 +758,24 @@ async def check_subscribe_channels(callback: CallbackQuery):
     logger.info("=" * 80)
     
     # Проверяем и создаем пользователя, если его нет
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     if not user:
         username = callback.from_user.username or ""
         first_name = callback.from_user.first_name or ""
-        db.create_user(user_id, username, first_name, None)
-        user = db.get_user(user_id)
+        await db.create_user(user_id, username, first_name, None)
+        user = await db.get_user(user_id)
         if not user:
             await callback.answer("Ошибка: не удалось создать пользователя", show_alert=True)
             return
     
-    channels = db.get_subscribe_channels()
+    channels = await db.get_subscribe_channels()
     
     if not channels:
         await callback.answer("Каналы не настроены", show_alert=True)
         return
     
     # Получаем задание для награды
-    task = None
-    tasks = db.get_tasks()
-    for t in tasks:
-        if t['task_id'] == task_id:
-            task = t
-            break
+    task = await db.get_task(task_id)
     
     if not task:
         await callback.answer("Задание не найдено!", show_alert=True)
@@ -873,97 +793,73 @@ async def check_subscribe_channels(callback: CallbackQuery):
     from config import SUBSCRIBE_REWARD
     
     # Получаем награду за один канал (из настроек или из config)
-    reward_per_channel = float(db.get_setting('subscribe_reward', str(SUBSCRIBE_REWARD)))
-    
-    cursor = db.conn.cursor()
+    reward_per_channel = await db.get_setting_float('subscribe_reward', SUBSCRIBE_REWARD)
     
     # Создаем пользователя если нет
-    cursor.execute("""
-        INSERT OR IGNORE INTO users (user_id, username, first_name, balance)
-        VALUES (?, ?, ?, 0.0)
-    """, (user_id, callback.from_user.username or "", callback.from_user.first_name or ""))
+    await db.ensure_user(user_id, callback.from_user.username or "", callback.from_user.first_name or "")
     
     # Проверяем каждый канал отдельно и начисляем за те, за которые еще не начисляли
     total_reward = 0.0
     new_channels_count = 0
     already_rewarded_channels = []
     error_channels = []
+    subscribed_channels = []
+    
+    # Проверяем подписку на все каналы параллельно (каналы без username не проверяются)
+    channels = [channel for channel in channels if channel.get('id')]
+    checked_channels = [channel for channel in channels if channel.get('channel_username')]
+    checks = await check_members(
+        callback.bot,
+        [f"@{channel['channel_username']}" for channel in checked_channels],
+        user_id,
+        db=db
+    )
     
-    for channel in channels:
+    for channel, check in zip(checked_channels, checks):
         channel_id = channel.get('id')
         channel_username = channel.get('channel_username')
         channel_link = channel.get('channel_link', '')
         display_name = channel.get('display_name', channel_username or 'Канал')
         
-        if not channel_id:
+        # Критическая ошибка по любому каналу - останавливаем проверку
+        if check.error == ERROR_INACCESSIBLE:
+            await callback.answer(
+                f"Ошибка: Бот не может проверить подписку на канал @{channel_username}.\n"
+                f"Убедитесь, что бот добавлен в канал как администратор с правами на просмотр участников.",
+                show_alert=True
+            )
+            return
+        elif check.error == ERROR_NOT_ADMIN:
+            await callback.answer(
+                f"Ошибка: Бот не добавлен в канал @{channel_username} как администратор!",
+                show_alert=True
+            )
+            return
+        elif check.error:
+            # Другие ошибки - пропускаем этот канал
+            error_channels.append(display_name)
             continue
         
-        # Проверяем подписку на этот канал
-        is_subscribed = False
-        if channel_username:
-            try:
-                member = await callback.bot.get_chat_member(f"@{channel_username}", user_id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    is_subscribed = True
-            except Exception as e:
-                error_msg = str(e).lower()
-                logger.error(f"Ошибка при проверке подписки на канал @{channel_username}: {e}")
-                
-                # Если критическая ошибка - останавливаем проверку
-                if "member list is inaccessible" in error_msg:
-                    await callback.answer(
-                        f"Ошибка: Бот не может проверить подписку на канал @{channel_username}.\n"
-                        f"Убедитесь, что бот добавлен в канал как администратор с правами на просмотр участников.",
-                        show_alert=True
-                    )
-                    return
-                elif "chat not found" in error_msg or "bot is not a member" in error_msg:
-                    await callback.answer(
-                        f"Ошибка: Бот не добавлен в канал @{channel_username} как администратор!",
-                        show_alert=True
-                    )
-                    return
-                else:
-                    # Другие ошибки - пропускаем этот канал
-                    error_channels.append(display_name)
-                    continue
-        
-        # Если подписан и еще не получал награду за этот канал - начисляем
-        if is_subscribed:
-            if not db.has_received_reward_for_channel(user_id, channel_id):
-                # Начисляем за этот канал
-                cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (reward_per_channel, user_id))
-                total_reward += reward_per_channel
-                new_channels_count += 1
-                
-                # Отмечаем, что награда получена за этот канал
-                db.mark_reward_received_for_channel(user_id, channel_id)
-                
-                # Сохраняем подписку
-                if not channel_link:
-                    if channel_username:
-                        channel_link = f"https://t.me/{channel_username.replace('@', '')}"
-                
-                if channel_link:
-                    db.add_subscription(user_id, channel_link)
-            else:
-                already_rewarded_channels.append(display_name)
-    
-    # Коммитим все изменения
-    db.conn.commit()
-    
-    # Рефералы - начисляем только если это первое задание пользователя
-    user = db.get_user(user_id)
-    if user and user.get('referrer_id') and new_channels_count > 0:
-        referral_reward = float(db.get_setting('referral_reward', '350'))
-        friend_referral_reward = float(db.get_setting('friend_referral_reward', '100'))
-        
-        cursor.execute("SELECT COUNT(*) as count FROM completed_tasks WHERE user_id = ? AND task_id != ?", (user_id, task_id))
-        if cursor.fetchone()['count'] == 0:
-            db.update_user_balance(user['referrer_id'], referral_reward)
-            referrer = db.get_user(user['referrer_id'])
-            if referrer and referrer.get('referrer_id'):
-                db.update_user_balance(referrer['referrer_id'], friend_referral_reward)
+        # Подписанные каналы награждаются одной транзакцией после цикла
+        if check.is_member:
+            if not channel_link and channel_username:
+                channel_link = f"https://t.me/{channel_username.replace('@', '')}"
+            subscribed_channels.append((channel_id, channel_link, display_name))
+    
+    # Награда за новые каналы, подписки и реферальные выплаты (только за первую награду) - одной транзакцией
+    if subscribed_channels:
+        granted = await db.grant_reward(
+            user_id, task_id, reward_per_channel, await get_referral_levels(db),
+            channels=[(channel_id, channel_link) for channel_id, channel_link, _ in subscribed_channels]
+        )
+        rewarded_ids = set(granted['channels']) if granted else set()
+        if granted:
+            total_reward = granted['amount']
+            new_channels_count = len(rewarded_ids)
+        already_rewarded_channels = [
+            display_name for channel_id, _, display_name in subscribed_channels
+            if channel_id not in rewarded_ids
+        ]
     
     # Формируем ответ
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -989,18 +885,13 @@ async def check_subscribe_channels(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("check_streams_subscribe_"))
-async def check_streams_subscribe(callback: CallbackQuery):
+async def check_streams_subscribe(callback: CallbackQuery, db: AsyncDatabase):
     """Проверка подписки на канал @akatsik для задания 'просмотр стрима'"""
     user_id = callback.from_user.id
     task_id = int(callback.data.split("_")[-1])
     
     # Получаем задание
-    task = None
-    tasks = db.get_tasks()
-    for t in tasks:
-        if t['task_id'] == task_id:
-            task = t
-            break
+    task = await db.get_task(task_id)
     
     if not task:
         await callback.answer("Задание не найдено!", show_alert=True)
@@ -1015,25 +906,18 @@ async def check_streams_subscribe(callback: CallbackQuery):
     
     logger.info(f"Проверка подписки на канал @{channel_username} для пользователя {user_id} (обработчик check_streams_subscribe)")
     
-    try:
-        member = await callback.bot.get_chat_member(f"@{channel_username}", user_id)
-        logger.info(f"Статус пользователя {user_id} в канале @{channel_username}: {member.status}")
-        if member.status in ['member', 'administrator', 'creator']:
-            is_subscribed = True
-            logger.info(f"Пользователь {user_id} подписан на канал @{channel_username}")
-        else:
-            logger.info(f"Пользователь {user_id} НЕ подписан на канал @{channel_username} (статус: {member.status})")
-    except Exception as e:
-        logger.error(f"Ошибка при проверке подписки на канал @{channel_username}: {e}", exc_info=True)
-        error_msg = str(e).lower()
-        
-        if "member list is inaccessible" in error_msg:
+    check = await check_member(callback.bot, f"@{channel_username}", user_id, db=db)
+    if not check.error:
+        is_subscribed = check.is_member
+        logger.info(f"Пользователь {user_id} {'подписан' if is_subscribed else 'НЕ подписан'} на канал @{channel_username}")
+    else:
+        if check.error == ERROR_INACCESSIBLE:
             await callback.answer(
                 f"Ошибка: Бот не может проверить подписку на канал @{channel_username}.\n"
                 f"Убедитесь, что бот добавлен в канал как администратор с правами на просмотр участников.",
                 show_alert=True
             )
-        elif "chat not found" in error_msg or "bot is not a member" in error_msg:
+        elif check.error == ERROR_NOT_ADMIN:
             await callback.answer(
                 f"Ошибка: Бот не добавлен в канал @{channel_username} как администратор!",
                 show_alert=True
@@ -1042,7 +926,7 @@ async def check_streams_subscribe(callback: CallbackQuery):
             await callback.answer("Ошибка при проверке подписки. Попробуйте позже.", show_alert=True)
         
         # Показываем сообщение с кнопкой подписки
-        text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+        text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
         
         buttons = [
             [InlineKeyboardButton(
@@ -1066,7 +950,7 @@ async def check_streams_subscribe(callback: CallbackQuery):
     if not is_subscribed:
         # Пользователь не подписан
         logger.info(f"Пользователь {user_id} не подписан на канал @{channel_username}, показываем кнопки подписки")
-        base_text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+        base_text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
         # Добавляем явное упоминание, что подписки нет
         text = f"{base_text}\n\n❌ Вы не подписаны на канал.\nПодпишитесь и нажмите «✅ Я подписался, проверить»."
         
@@ -1092,9 +976,9 @@ async def check_streams_subscribe(callback: CallbackQuery):
         return
     
     # Пользователь подписан - проверяем, получал ли он уже награду
-    if db.is_task_completed(user_id, task_id):
+    if await db.is_task_completed(user_id, task_id):
         # Уже получил награду - показываем текст с кнопками, но без начисления
-        text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+        text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
         
         buttons = [
             [InlineKeyboardButton(
@@ -1116,38 +1000,17 @@ async def check_streams_subscribe(callback: CallbackQuery):
     # Пользователь подписан и еще не получал награду - начисляем награду ОДИН РАЗ
     reward_amount = float(task.get('reward', STREAM_INFO_REWARD))
     
-    # Проверяем реферала перед выполнением задания
-    referral_reward = float(db.get_setting('referral_reward', '350'))
-    friend_referral_reward = float(db.get_setting('friend_referral_reward', '100'))
-    
-    user = db.get_user(user_id)
-    if user and user.get('referrer_id'):
-        cursor = db.conn.cursor()
-        # Проверяем, есть ли уже выполненные задания (кроме текущего)
-        cursor.execute(
-            "SELECT COUNT(*) as count FROM completed_tasks WHERE user_id = ? AND task_id != ?",
-            (user_id, task_id)
-        )
-        completed_before = cursor.fetchone()['count']
-        
-        # Начисляем за реферала только если это первое выполненное задание
-        if completed_before == 0:
-            db.update_user_balance(user['referrer_id'], referral_reward)
-            referrer = db.get_user(user['referrer_id'])
-            if referrer and referrer.get('referrer_id'):
-                db.update_user_balance(referrer['referrer_id'], friend_referral_reward)
-    
-    db.update_user_balance(user_id, reward_amount)
-    db.complete_task(user_id, task_id)  # Помечаем задание как выполненное - награда только один раз
-    
-    # Получаем обновленный баланс
-    user = db.get_user(user_id)
+    # Награда, выполнение задания и реферальные выплаты - одной транзакцией (награда только один раз)
+    granted = await db.grant_reward(user_id, task_id, reward_amount, await get_referral_levels(db))
+    if not granted:
+        await callback.answer()
+        return
     
     # Используем настройку из БД для текста сообщения
-    text = db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
+    text = await db.get_setting('streams_message_text', task.get('description', task.get('title', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов')))
     
     # Добавляем информацию о начислении
-    text_with_reward = f"{text}\n\n✅ Начислено: {int(reward_amount)}R\n💰 Ваш баланс: {user['balance']:.2f}R"
+    text_with_reward = f"{text}\n\n✅ Начислено: {int(reward_amount)}R\n💰 Ваш баланс: {granted['balance']:.2f}R"
     
     buttons = [
         [InlineKeyboardButton(
@@ -1168,12 +1031,12 @@ async def check_streams_subscribe(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "back_to_main_menu")
-async def back_to_main_menu(callback: CallbackQuery):
+async def back_to_main_menu(callback: CallbackQuery, db: AsyncDatabase):
     """Возврат в главное меню"""
     from keyboards import get_main_menu
     
     # Используем глобальный экземпляр БД, а не создаем новый
-    text = db.get_setting(
+    text = await db.get_setting(
         'welcome_text',
         "👋 Добро пожаловать!\n\nЭто бот для заработка Rcoin через выполнение заданий.\n\nВыберите действие в меню:"
     )
@@ -0,0 +1,30 @@
+from aiogram import Router
+from aiogram.types import ChatMemberUpdated
+from database import AsyncDatabase
+from membership import cache as membership_cache, chat_key, is_member_status, MembershipCheck
+import logging
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+@router.chat_member()
+async def track_channel_membership(event: ChatMemberUpdated, db: AsyncDatabase):
+    """Подписка/отписка в канале, где бот администратор: обновляем channel_membership и кэш"""
+    user = event.new_chat_member.user
+    if user.is_bot:
+        return
+
+    # Канал проверяется по @username, но может быть сохранен и по chat_id
+    keys = [chat_key(event.chat.id)]
+    if event.chat.username:
+        keys.append(chat_key(f"@{event.chat.username}"))
+
+    status = event.new_chat_member.status
+    is_member = is_member_status(event.new_chat_member)
+    await db.set_channel_membership(keys, user.id, status, is_member)
+
+    for key in keys:
+        membership_cache.put(key, user.id, MembershipCheck(key, is_member))
+
+    logger.debug(f"chat_member: {user.id} в {keys[-1]}: {status}")
@@ -2,7 +2,8 @@ from aiogram import Router, F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from database import Database
+from database import AsyncDatabase
+from bot_identity import BotIdentity
 from keyboards import get_main_menu
 import re
 import logging
@@ -10,24 +11,10 @@ import logging
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Ленивая инициализация базы данных
-_db_instance = None
-
-def get_db():
-    global _db_instance
-    if _db_instance is None:
-        try:
-            _db_instance = Database()
-        except Exception as e:
-            logger.error(f"Ошибка при создании экземпляра базы данных: {e}", exc_info=True)
-            raise
-    return _db_instance
-
 
 @router.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, db: AsyncDatabase):
     try:
-        db = get_db()
         user_id = message.from_user.id
         username = message.from_user.username or ""
         first_name = message.from_user.first_name or ""
@@ -44,7 +31,7 @@ async def cmd_start(message: Message):
                 if referrer_id == user_id:
                     referrer_id = None
                 else:
-                    ref_user = db.get_user(referrer_id)
+                    ref_user = await db.get_user(referrer_id)
                     if not ref_user:
                         referrer_id = None
             except (ValueError, IndexError) as e:
@@ -53,17 +40,21 @@ async def cmd_start(message: Message):
         
         # Создаем пользователя, если его нет
         try:
-            user = db.get_user(user_id)
+            user = await db.get_user(user_id)
             if not user:
                 logger.info(f"Создание нового пользователя {user_id}")
-                db.create_user(user_id, username, first_name, referrer_id)
-                user = db.get_user(user_id)
+                await db.create_user(user_id, username, first_name, referrer_id)
+                user = await db.get_user(user_id)
+            elif not user.get('is_reachable', 1):
+                # Пользователь снова написал боту - возвращаем его в рассылки
+                logger.info(f"Пользователь {user_id} снова доступен")
+                await db.set_user_reachable(user_id, True)
         except Exception as e:
             logger.error(f"Ошибка при работе с пользователем: {e}", exc_info=True)
             # Продолжаем работу даже если есть ошибка
         
         # Получаем приветственное сообщение из БД
-        welcome_text = db.get_setting(
+        welcome_text = await db.get_setting(
             'welcome_text',
             "👋 Добро пожаловать!\n\nЭто бот для заработка Rcoin через выполнение заданий.\n\nВыберите действие в меню:"
         )
@@ -90,20 +81,19 @@ async def cmd_start(message: Message):
 
 
 @router.message(F.text == "👤 Личный кабинет")
-async def show_profile(message: Message):
+async def show_profile(message: Message, db: AsyncDatabase):
     try:
-        db = get_db()
         user_id = message.from_user.id
         username = message.from_user.username or ""
         first_name = message.from_user.first_name or ""
         
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         
         # Создаем пользователя, если его нет
         if not user:
             logger.info(f"Создание пользователя {user_id} из личного кабинета")
-            db.create_user(user_id, username, first_name, None)
-            user = db.get_user(user_id)
+            await db.create_user(user_id, username, first_name, None)
+            user = await db.get_user(user_id)
             if not user:
                 await message.answer("Ошибка: не удалось создать пользователя.")
                 return
@@ -112,19 +102,19 @@ async def show_profile(message: Message):
         referrer_name = "Нет"
         if referrer_id:
             try:
-                referrer = db.get_user(referrer_id)
+                referrer = await db.get_user(referrer_id)
                 if referrer:
                     referrer_name = f"@{referrer.get('username', '')}" if referrer.get('username') else f"ID: {referrer_id}"
             except:
                 pass
         
         try:
-            invited_count = db.get_invited_count(user_id)
+            invited_count = await db.get_invited_count(user_id)
         except:
             invited_count = 0
         
         try:
-            friends_referrals = db.get_friends_referrals_count(user_id)
+            friends_referrals = await db.get_friends_referrals_count(user_id)
         except:
             friends_referrals = 0
     
@@ -165,21 +155,20 @@ async def show_profile(message: Message):
 
 
 @router.message(F.text == "💰 Начать зарабатывать")
-async def show_earn_menu(message: Message):
+async def show_earn_menu(message: Message, db: AsyncDatabase):
     try:
-        db = get_db()
         user_id = message.from_user.id
         username = message.from_user.username or ""
         first_name = message.from_user.first_name or ""
         
         # Создаем пользователя, если его нет
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         if not user:
             logger.info(f"Создание пользователя {user_id} из меню заработка")
-            db.create_user(user_id, username, first_name, None)
+            await db.create_user(user_id, username, first_name, None)
         
         from keyboards import get_earn_menu_keyboard
-        keyboard = get_earn_menu_keyboard(user_id)
+        keyboard = await get_earn_menu_keyboard(db)
         
         text = "💰 Выберите способ заработка:"
         await message.answer(text, reply_markup=keyboard)
@@ -189,20 +178,19 @@ async def show_earn_menu(message: Message):
 
 
 @router.message(F.text == "🎁 Открыть сундук")
-async def show_chest(message: Message):
+async def show_chest(message: Message, db: AsyncDatabase):
     try:
-        db = get_db()
         user_id = message.from_user.id
         username = message.from_user.username or ""
         first_name = message.from_user.first_name or ""
         
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         
         # Создаем пользователя, если его нет
         if not user:
             logger.info(f"Создание пользователя {user_id} из сундука")
-            db.create_user(user_id, username, first_name, None)
-            user = db.get_user(user_id)
+            await db.create_user(user_id, username, first_name, None)
+            user = await db.get_user(user_id)
             if not user:
                 await message.answer("Ошибка: не удалось создать пользователя.")
                 return
@@ -221,24 +209,23 @@ async def show_chest(message: Message):
 
 
 @router.message(F.text == "👥 Реферальная программа")
-async def show_referral_program(message: Message):
+async def show_referral_program(message: Message, db: AsyncDatabase, bot_identity: BotIdentity):
     try:
-        db = get_db()
         user_id = message.from_user.id
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         
         if not user:
             await message.answer("Ошибка: пользователь не найден.")
             return
         
-        invited_count = db.get_invited_count(user_id)
-        friends_referrals = db.get_friends_referrals_count(user_id)
+        invited_count = await db.get_invited_count(user_id)
+        friends_referrals = await db.get_friends_referrals_count(user_id)
         
-        referral_link = f"https://t.me/{(await message.bot.get_me()).username}?start={user_id}"
+        referral_link = await bot_identity.referral_link(user_id)
         
         # Получаем награды за рефералов из БД
-        referral_reward = int(float(db.get_setting('referral_reward', '350')))
-        friend_referral_reward = int(float(db.get_setting('friend_referral_reward', '100')))
+        referral_reward = await db.get_setting_int('referral_reward', 350)
+        friend_referral_reward = await db.get_setting_int('friend_referral_reward', 100)
         
         text = (
             "👥 Реферальная программа\n\n"
@@ -263,15 +250,14 @@ async def show_referral_program(message: Message):
 
 
 @router.message(F.text == "📊 Статистика проекта")
-async def show_statistics(message: Message):
+async def show_statistics(message: Message, db: AsyncDatabase):
     try:
-        db = get_db()
-        stats = db.get_statistics()
+        stats = await db.get_statistics()
         
         # Получаем настройки статистики из БД
-        base_users = int(db.get_setting('stats_base_users', '29201'))
-        bot_created = db.get_setting('stats_bot_created', '12.06.2024г')
-        base_withdrawn = int(db.get_setting('stats_base_withdrawn', '169768'))
+        base_users = await db.get_setting_int('stats_base_users', 29201)
+        bot_created = await db.get_setting('stats_bot_created', '12.06.2024г')
+        base_withdrawn = await db.get_setting_int('stats_base_withdrawn', 169768)
         
         # Прибавляем реальное количество пользователей к базовому
         total_users = base_users + stats['total_users']
@@ -1,69 +1,101 @@
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from database import Database
-
-_db_instance = None
+import logging
+from typing import Tuple
 
-def get_db():
-    global _db_instance
-    if _db_instance is None:
-        _db_instance = Database()
-    return _db_instance
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Статические клавиатуры собираются один раз; наружу отдаются копии:
+# модели aiogram запрещают присваивание полей, но списки кнопок в них изменяемы
+_MAIN_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="👤 Личный кабинет")],
+        [KeyboardButton(text="💰 Начать зарабатывать")],
+        [KeyboardButton(text="👥 Реферальная программа")],
+        [KeyboardButton(text="📊 Статистика проекта")]
+    ],
+    resize_keyboard=True
+)
+
+# Кнопка "Вывод" всегда показывается
+_PROFILE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💸 Вывод", callback_data="withdraw")],
+    [InlineKeyboardButton(text="◀️ Назад в меню", callback_data="back_to_main_menu")]
+])
+
+# Кнопка "Далее" показывается только если баланс >= 5000
+_WITHDRAW_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Далее", callback_data="withdraw_amount")],
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_profile")]
+])
+_WITHDRAW_KEYBOARD_LOW_BALANCE = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_profile")]
+])
+
+_WITHDRAW_METHODS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Другой способ", callback_data="withdraw_site")],
+    [InlineKeyboardButton(text="💎 USDT (BEP20)", callback_data="withdraw_usdt")],
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_withdraw_start")]
+])
+
+_CANCEL_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="cancel")]
+])
 
 
 def get_main_menu():
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="👤 Личный кабинет")],
-            [KeyboardButton(text="💰 Начать зарабатывать")],
-            [KeyboardButton(text="👥 Реферальная программа")],
-            [KeyboardButton(text="📊 Статистика проекта")]
-        ],
-        resize_keyboard=True
-    )
-    return keyboard
+    return _MAIN_MENU.model_copy(deep=True)
 
 
 def get_profile_keyboard(balance: float):
-    buttons = []
-    # Кнопка "Вывод" всегда показывается
-    buttons.append([InlineKeyboardButton(text="💸 Вывод", callback_data="withdraw")])
-    buttons.append([InlineKeyboardButton(text="◀️ Назад в меню", callback_data="back_to_main_menu")])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    return keyboard
+    return _PROFILE_KEYBOARD.model_copy(deep=True)
 
 
 def get_withdraw_keyboard(balance: float = 0.0):
-    buttons = []
-    # Кнопка "Далее" показывается только если баланс >= 5000
-    if balance >= 5000:
-        buttons.append([InlineKeyboardButton(text="✅ Далее", callback_data="withdraw_amount")])
-    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_profile")])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    return keyboard
+    keyboard = _WITHDRAW_KEYBOARD if balance >= 5000 else _WITHDRAW_KEYBOARD_LOW_BALANCE
+    return keyboard.model_copy(deep=True)
 
 
 def get_withdraw_methods_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Другой способ", callback_data="withdraw_site")],
-        [InlineKeyboardButton(text="💎 USDT (BEP20)", callback_data="withdraw_usdt")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_withdraw_start")]
-    ])
+    return _WITHDRAW_METHODS_KEYBOARD.model_copy(deep=True)
+
+
+async def get_earn_menu_keyboard(db: AsyncDatabase):
+    """
+    Меню заработка одинаково для всех пользователей и берется из db.view_cache.
+    Пересобирается, только когда меняются задания или каналы (catalog_generation)
+    либо настройки, из которых собираются кнопки. Возвращается копия кэшированной клавиатуры.
+    """
+    settings = await db.get_settings()
+    version = (
+        settings.get('catalog_generation', None),
+        settings.get('streams_button_text', None),
+        settings.get('referral_reward', None),
+        settings.get('chest_cost', None)
+    )
+    cached = db.view_cache.get('earn_menu')
+    if cached is not None and cached[0] == version:
+        return cached[1].model_copy(deep=True)
+    
+    keyboard, complete = await _build_earn_menu_keyboard(db)
+    # Меню без заданий из-за ошибки БД не кэшируется
+    if complete:
+        db.view_cache['earn_menu'] = (version, keyboard)
+        return keyboard.model_copy(deep=True)
     return keyboard
 
 
-def get_earn_menu_keyboard(user_id: int):
-    import logging
-    logger = logging.getLogger(__name__)
-    
+async def _build_earn_menu_keyboard(db: AsyncDatabase) -> Tuple[InlineKeyboardMarkup, bool]:
     buttons = []
+    complete = True
     
     try:
-        db = get_db()
         # Ежедневный бонус - всегда показываем кнопку
         buttons.append([InlineKeyboardButton(text="🎁 Ежедневный бонус до 1000R", callback_data="daily_bonus")])
         
         # Задания из базы данных
-        tasks = db.get_tasks()
+        tasks = await db.get_tasks()
         for task in tasks:
             try:
                 if task['task_type'] == 'subscribe':
@@ -79,7 +111,7 @@ def get_earn_menu_keyboard(user_id: int):
                 elif task['task_type'] == 'info':
                     # Кнопка для заданий типа 'info' ВСЕГДА показывается, независимо от выполнения
                     # Используем настройку из БД для названия кнопки
-                    button_text = db.get_setting('streams_button_text', f"💰 Зарабатывай на просмотре стримов... + {int(task['reward'])}R")
+                    button_text = await db.get_setting('streams_button_text', f"💰 Зарабатывай на просмотре стримов... + {int(task['reward'])}R")
                     # Если в настройке нет награды, добавляем её
                     if f"+ {int(task['reward'])}R" not in button_text:
                         button_text = f"{button_text} + {int(task['reward'])}R"
@@ -98,20 +130,21 @@ def get_earn_menu_keyboard(user_id: int):
                 continue
     except Exception as e:
         logger.error(f"Ошибка в get_earn_menu_keyboard: {e}", exc_info=True)
+        complete = False
     
     # Пригласить друга - используем награду из БД
-    referral_reward = int(float(db.get_setting('referral_reward', '350')))
+    referral_reward = await db.get_setting_int('referral_reward', 350)
     buttons.append([InlineKeyboardButton(text=f"👥 Пригласить друга + {referral_reward}R", callback_data="referral_link")])
     
     # Сундук с подарком - используем стоимость из БД
-    chest_cost = int(float(db.get_setting('chest_cost', '2000')))
+    chest_cost = await db.get_setting_int('chest_cost', 2000)
     buttons.append([InlineKeyboardButton(text=f"🎁 Открыть сундук с подарком ({chest_cost}R)", callback_data="open_chest")])
     
     # Кнопка "Назад в меню"
     buttons.append([InlineKeyboardButton(text="◀️ Назад в меню", callback_data="back_to_main_menu")])
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    return keyboard
+    return keyboard, complete
 
 
 def get_chest_keyboard(balance: float):
@@ -124,8 +157,5 @@ def get_chest_keyboard(balance: float):
 
 
 def get_cancel_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="cancel")]
-    ])
-    return keyboard
+    return _CANCEL_KEYBOARD.model_copy(deep=True)
 
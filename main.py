@@ -1,55 +1,96 @@
 import asyncio
 import logging
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from handlers import start, callbacks, admin, admin_earn
-
-# Настройка логирования в файл и консоль
-import logging.handlers
-import os
-
-# Создаем директорию для логов, если её нет
-os.makedirs('logs', exist_ok=True)
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/bot.log', encoding='utf-8'),
-        logging.StreamHandler()  # Также выводим в консоль
-    ]
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import (
+    BOT_TOKEN, RUN_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WORKERS
 )
+from database import ConnectionManager
+from app import setup_logging, create_dispatcher, stop_services
+
 logger = logging.getLogger(__name__)
-logger.info("=" * 50)
-logger.info("БОТ ЗАПУЩЕН - ЛОГИРОВАНИЕ АКТИВНО")
-logger.info("=" * 50)
+
+
+async def run_polling(dp: Dispatcher, bot: Bot):
+    # Webhook, оставшийся от режима webhook, не дает получать обновления через getUpdates
+    await bot.delete_webhook()
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Встроенный aiohttp-сервер: Telegram (через reverse proxy) присылает обновления на WEBHOOK_PATH"""
+    if not WEBHOOK_SECRET:
+        logger.warning("⚠️ WEBHOOK_SECRET не задан: webhook примет запросы без проверки секрета")
+    
+    app = web.Application()
+    # handle_in_background: ответ 200 сразу, обновление обрабатывается в фоне
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Webhook-сервер слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        
+        # Без публичного адреса webhook не регистрируется (локальная проверка через post_update.py)
+        if WEBHOOK_BASE_URL:
+            webhook_url = WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+            await bot.set_webhook(
+                url=webhook_url,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            logger.info(f"Webhook зарегистрирован: {webhook_url}")
+        
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
+    if WORKERS > 1:
+        # Главный процесс принимает обновления и раздает их воркерам по user_id
+        from supervisor import run_supervisor
+        await run_supervisor(WORKERS)
+        return
+    
+    # Единый на процесс менеджер соединений с БД (миграции выполняются один раз)
+    db_manager = ConnectionManager()
+    await db_manager.open()
+    
     # Инициализация бота и диспетчера
     bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    
-    # Регистрация роутеров
-    # Важно: callbacks.router должен быть ПЕРВЫМ, чтобы FSM состояния обрабатывались раньше
-    dp.include_router(callbacks.router)
-    dp.include_router(admin.router)  # Админ-панель
-    dp.include_router(admin_earn.router)  # Настройки раздела "Начать зарабатывать"
-    dp.include_router(start.router)
+    dp = await create_dispatcher(bot, db_manager)
     
-    logger.info("Бот запущен и готов к работе")
+    logger.info(f"Бот запущен и готов к работе (режим: {RUN_MODE})")
     
     try:
         # Запуск бота
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await run_polling(dp, bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
         raise
+    finally:
+        await stop_services(dp)
+        await db_manager.close()
 
 
 if __name__ == "__main__":
+    # Настройка логирования в файл и консоль (не при импорте: spawn-воркеры загружают этот модуль заново)
+    setup_logging()
+    logger.info("=" * 50)
+    logger.info("БОТ ЗАПУЩЕН - ЛОГИРОВАНИЕ АКТИВНО")
+    logger.info("=" * 50)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
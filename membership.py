@@ -0,0 +1,188 @@
+"""
+Проверка подписки пользователя на каналы через get_chat_member.
+
+Проверки по нескольким каналам выполняются параллельно; общее на процесс
+ограничение (семафор) не дает одному нажатию занять все соединения с Bot API,
+а таймаут на вызов - ждать зависший канал дольше остальных.
+
+Источник данных по порядку: кэш в памяти, таблица channel_membership (ее держит
+актуальной handlers/chat_member.py по событиям chat_member) и запрос к Bot API,
+результат которого тоже сохраняется в таблицу. Из таблицы берется только подписка
+не старше MEMBERSHIP_TABLE_TTL: события могли потеряться (бот был выключен или не
+администратор канала, канал без событий вроде @akatsik), поэтому "не подписан" и
+устаревшие строки всегда перепроверяются через get_chat_member.
+
+Результаты кэшируются: подписка - на MEMBERSHIP_CACHE_TTL, отсутствие подписки -
+на короткий MEMBERSHIP_NEGATIVE_TTL (пользователь может подписаться и сразу нажать
+"проверить"), ошибки настройки канала - на MEMBERSHIP_ERROR_TTL для всех пользователей.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import ChatMember
+from config import (
+    MEMBERSHIP_CHECK_CONCURRENCY, MEMBERSHIP_CHECK_TIMEOUT, MEMBERSHIP_CACHE_TTL,
+    MEMBERSHIP_NEGATIVE_TTL, MEMBERSHIP_ERROR_TTL, MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_TABLE_TTL
+)
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+# Классы ошибок проверки
+ERROR_INACCESSIBLE = 'inaccessible'  # бот не видит список участников
+ERROR_NOT_ADMIN = 'not_admin'        # канал не найден или бота в нем нет
+ERROR_TIMEOUT = 'timeout'
+ERROR_OTHER = 'other'
+
+# Ошибки настройки канала: проверка по нему невозможна для любого пользователя
+CRITICAL_ERRORS = (ERROR_INACCESSIBLE, ERROR_NOT_ADMIN)
+
+_semaphore = asyncio.Semaphore(max(1, MEMBERSHIP_CHECK_CONCURRENCY))
+
+
+class MembershipCheck(NamedTuple):
+    chat: str
+    is_member: bool
+    error: Optional[str] = None       # один из ERROR_*, None - проверка прошла
+    error_text: str = ""
+
+
+def chat_key(chat) -> str:
+    """Ключ канала для кэша и таблицы: "@username" в нижнем регистре или chat_id"""
+    return str(chat).lower()
+
+
+def is_member_status(member: ChatMember) -> bool:
+    """Считается ли участник подписчиком (ограниченный участник - только если он в чате)"""
+    if member.status == 'restricted':
+        return bool(getattr(member, 'is_member', False))
+    return member.status in MEMBER_STATUSES
+
+
+def classify_error(error: Exception) -> str:
+    """Отнести ошибку Bot API к одному из классов ERROR_*"""
+    if isinstance(error, asyncio.TimeoutError):
+        return ERROR_TIMEOUT
+    error_msg = str(error).lower()
+    if "member list is inaccessible" in error_msg:
+        return ERROR_INACCESSIBLE
+    if "chat not found" in error_msg or "bot is not a member" in error_msg:
+        return ERROR_NOT_ADMIN
+    return ERROR_OTHER
+
+
+class MembershipCache:
+    """LRU-кэш результатов проверки с отдельными TTL для подписки, ее отсутствия и ошибок канала"""
+
+    def __init__(self, max_size: int = MEMBERSHIP_CACHE_SIZE, ttl: float = MEMBERSHIP_CACHE_TTL,
+                 negative_ttl: float = MEMBERSHIP_NEGATIVE_TTL, error_ttl: float = MEMBERSHIP_ERROR_TTL):
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        # (user_id, канал) -> (истекает, результат)
+        self._members: 'collections.OrderedDict[Tuple[int, str], Tuple[float, MembershipCheck]]' = collections.OrderedDict()
+        # канал -> (истекает, результат с ошибкой настройки)
+        self._channel_errors: Dict[str, Tuple[float, MembershipCheck]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat: str, user_id: int) -> Optional[MembershipCheck]:
+        now = time.monotonic()
+        key = chat_key(chat)
+        
+        entry = self._channel_errors.get(key)
+        if entry:
+            if entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            del self._channel_errors[key]
+        
+        entry = self._members.get((user_id, key))
+        if entry:
+            if entry[0] > now:
+                self._members.move_to_end((user_id, key))
+                self.hits += 1
+                return entry[1]
+            del self._members[(user_id, key)]
+        
+        self.misses += 1
+        return None
+
+    def put(self, chat: str, user_id: int, check: MembershipCheck):
+        now = time.monotonic()
+        key = chat_key(chat)
+        if check.error:
+            # Таймауты и прочие сбои не кэшируем - следующая проверка может пройти
+            if check.error in CRITICAL_ERRORS and self.error_ttl > 0:
+                self._channel_errors[key] = (now + self.error_ttl, check)
+            return
+        
+        ttl = self.ttl if check.is_member else self.negative_ttl
+        if ttl <= 0 or self.max_size == 0:
+            return
+        self._members[(user_id, key)] = (now + ttl, check)
+        self._members.move_to_end((user_id, key))
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    def forget(self, chat: str, user_id: Optional[int] = None):
+        """Сбросить кэш канала: для одного пользователя или целиком (вместе с ошибкой канала)"""
+        key = chat_key(chat)
+        if user_id is not None:
+            self._members.pop((user_id, key), None)
+            return
+        self._channel_errors.pop(key, None)
+        for cached_key in [cached_key for cached_key in self._members if cached_key[1] == key]:
+            del self._members[cached_key]
+
+    def clear(self):
+        self._members.clear()
+        self._channel_errors.clear()
+
+
+cache = MembershipCache()
+
+
+async def check_member(bot: Bot, chat: str, user_id: int, use_cache: bool = True,
+                       db: Optional[AsyncDatabase] = None) -> MembershipCheck:
+    """Проверить подписку пользователя на один канал (@username или chat_id)"""
+    if use_cache:
+        cached = cache.get(chat, user_id)
+        if cached is not None:
+            return cached
+        if db is not None and MEMBERSHIP_TABLE_TTL > 0:
+            is_member = await db.get_channel_membership(chat_key(chat), user_id, MEMBERSHIP_TABLE_TTL)
+            if is_member:
+                check = MembershipCheck(chat, True)
+                cache.put(chat, user_id, check)
+                return check
+    
+    try:
+        async with _semaphore:
+            member = await asyncio.wait_for(bot.get_chat_member(chat, user_id), MEMBERSHIP_CHECK_TIMEOUT)
+    except Exception as e:
+        error = classify_error(e)
+        logger.error(f"Ошибка при проверке подписки на канал {chat}: {e or error}")
+        check = MembershipCheck(chat, False, error, str(e) or error)
+    else:
+        check = MembershipCheck(chat, is_member_status(member))
+        if db is not None:
+            # Дальше строку обновляют события chat_member (если канал их присылает)
+            await db.set_channel_membership([chat_key(chat)], user_id, member.status, check.is_member)
+    
+    cache.put(chat, user_id, check)
+    return check
+
+
+async def check_members(bot: Bot, chats: List[str], user_id: int, use_cache: bool = True,
+                        db: Optional[AsyncDatabase] = None) -> List[MembershipCheck]:
+    """Проверить подписку на несколько каналов параллельно (результаты в порядке chats)"""
+    return list(await asyncio.gather(*(check_member(bot, chat, user_id, use_cache, db) for chat in chats)))
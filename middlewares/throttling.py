@@ -0,0 +1,94 @@
+"""
+Ограничение частых нажатий inline-кнопок.
+
+Для каждой пары (пользователь, префикс callback_data) хранятся времена последних
+limit пропущенных нажатий. Если limit нажатий уже было за window секунд,
+нажатие сразу подтверждается callback.answer() и до обработчика не доходит:
+ни запросов к БД, ни проверок подписки через Bot API.
+Пары без нажатий дольше окна периодически удаляются.
+
+Регистрируется на dp.update до UserLockMiddleware, чтобы лишнее нажатие
+не ждало обработки предыдущего.
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from config import THROTTLE_LIMIT, THROTTLE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Кнопки, нажатие которых стоит нескольких запросов к БД и Bot API
+HOT_CALLBACK_PREFIXES = (
+    "daily_bonus",
+    "check_subscribe_channels_",
+    "check_streams_subscribe_",
+    "open_chest",
+)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer middleware для dp.update: скользящее окно на пользователя и префикс кнопки"""
+
+    def __init__(self, prefixes: Iterable[str] = HOT_CALLBACK_PREFIXES,
+                 limit: int = THROTTLE_LIMIT, window: float = THROTTLE_WINDOW):
+        # Длинные префиксы проверяются первыми
+        self.prefixes = tuple(sorted(prefixes, key=len, reverse=True))
+        self.limit = limit
+        self.window = window
+        self._hits: Dict[Tuple[int, str], Deque[float]] = {}
+        self._next_eviction = 0.0
+        self.throttled = 0
+
+    def _match(self, data: Optional[str]) -> Optional[str]:
+        if data:
+            for prefix in self.prefixes:
+                if data.startswith(prefix):
+                    return prefix
+        return None
+
+    def _evict(self, now: float):
+        expired = [key for key, hits in self._hits.items() if now - hits[-1] >= self.window]
+        for key in expired:
+            del self._hits[key]
+        self._next_eviction = now + self.window
+
+    def allow(self, user_id: int, prefix: str) -> bool:
+        """Учесть нажатие; False - лимит за окно исчерпан"""
+        now = time.monotonic()
+        if now >= self._next_eviction:
+            self._evict(now)
+        
+        key = (user_id, prefix)
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque(maxlen=self.limit)
+        elif len(hits) == self.limit and now - hits[0] < self.window:
+            return False
+        hits.append(now)
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        callback = event.callback_query if isinstance(event, Update) else None
+        if callback is None or self.limit <= 0:
+            return await handler(event, data)
+        
+        prefix = self._match(callback.data)
+        if prefix is None or self.allow(callback.from_user.id, prefix):
+            return await handler(event, data)
+        
+        self.throttled += 1
+        try:
+            await callback.answer()
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на лишнее нажатие {callback.data}: {e}")
+        return None
@@ -0,0 +1,55 @@
+"""
+Последовательная обработка обновлений одного пользователя.
+
+Обновления aiogram обрабатывает параллельно, поэтому двойное нажатие кнопки
+(вывод средств, открытие сундука) может дважды пройти проверку баланса.
+Middleware держит asyncio.Lock на user_id: обновления одного пользователя идут
+по очереди, разных пользователей - параллельно. Блокировки хранятся в
+WeakValueDictionary и исчезают, как только их никто не ждет, поэтому память
+не растет с числом пользователей.
+"""
+
+import asyncio
+import weakref
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+
+class UserLockMiddleware(BaseMiddleware):
+    """Outer middleware для dp.update"""
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _get_lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    @property
+    def active_users(self) -> int:
+        """Пользователи, у которых сейчас обрабатывается обновление"""
+        return len(self._locks)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user: User = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        
+        lock = self._get_lock(user.id)
+        waited = lock.locked()
+        async with lock:
+            # FSM middleware прочитал состояние до ожидания: предыдущее обновление могло его сменить
+            state = data.get("state")
+            if waited and state is not None:
+                data["raw_state"] = await state.get_state()
+            return await handler(event, data)
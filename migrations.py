@@ -0,0 +1,492 @@
+"""
+Версионные миграции схемы БД.
+
+Каждая миграция - функция, получающая курсор; она выполняется ровно один раз
+в отдельной транзакции, а номер версии записывается в таблицу schema_version.
+Теплый старт (все миграции уже применены) стоит одного запроса.
+Новые таблицы, колонки и индексы добавляются только новой миграцией в конце MIGRATIONS.
+"""
+
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _column_exists(cursor: sqlite3.Cursor, table: str, column: str) -> bool:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def _add_column_if_missing(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    """Добавить колонку в существующую таблицу (для баз, созданных до миграций)"""
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"✅ Миграция: добавлено поле {column} в таблицу {table}")
+
+
+def _initial_schema(cursor: sqlite3.Cursor):
+    # Таблица пользователей
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            balance REAL DEFAULT 0.0,
+            withdrawn REAL DEFAULT 0.0,
+            referrer_id INTEGER,
+            invited_count INTEGER DEFAULT 0,
+            last_daily_bonus DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Таблица заданий
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_type TEXT NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            channel_username TEXT,
+            channel_link TEXT,
+            reward REAL DEFAULT 0.0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Поле channel_link появилось позже (для существующих баз данных)
+    _add_column_if_missing(cursor, 'tasks', 'channel_link', 'TEXT')
+
+    # Таблица выполненных заданий
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS completed_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            task_id INTEGER,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (task_id) REFERENCES tasks(task_id),
+            UNIQUE(user_id, task_id)
+        )
+    """)
+
+    # Таблица подписок
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            channel_username TEXT,
+            subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            UNIQUE(user_id, channel_username)
+        )
+    """)
+
+    # Таблица выводов
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            method TEXT,
+            wallet TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Таблица настроек
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    # Таблица каналов для подписки
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS subscribe_channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_username TEXT,
+            channel_link TEXT,
+            channel_chat_id TEXT,
+            display_name TEXT,
+            order_index INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _add_column_if_missing(cursor, 'subscribe_channels', 'channel_chat_id', 'TEXT')
+
+    # Таблица для отслеживания награды за каждый канал отдельно
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS channel_rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            channel_id INTEGER,
+            rewarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (channel_id) REFERENCES subscribe_channels(id),
+            UNIQUE(user_id, channel_id)
+        )
+    """)
+    # В старых базах channel_rewards хранила channels_hash вместо channel_id (старое поле не мешает)
+    _add_column_if_missing(cursor, 'channel_rewards', 'channel_id', 'INTEGER')
+
+
+def _default_settings(cursor: sqlite3.Cursor):
+    from config import (
+        REFERRAL_REWARD, FRIEND_REFERRAL_REWARD, DAILY_BONUS_MIN, DAILY_BONUS_MAX,
+        STATS_BASE_USERS, STATS_BOT_CREATED, STATS_BASE_WITHDRAWN, CHEST_COST
+    )
+
+    cursor.execute("""
+        INSERT OR IGNORE INTO settings (key, value)
+        VALUES ('bot_created_date', '12.06.2024'),
+               ('total_users', '0'),
+               ('total_withdrawn', '0'),
+               ('withdraw_site_confirmation_text', '💸 Подтвердите вывод\n\nСумма: {amount:.0f} Rcoin\n\n📌 Пример: 5000 Rcoin = 1000 рублей на балансе\n\nПодтверждаете вывод?'),
+               ('withdraw_site_success_text', '✅ Заявка на вывод создана! Жмите кнопку: "Ссылка на сайт", регистрируйтесь и получите 1000 рублей на баланс. ( может понадобиться VPN )'),
+               ('withdraw_site_link', 'https://fontan-casino28.com/affiliate/f_tluqfc62?path=%2Fregistration&tds_skip=1'),
+               ('withdraw_usdt_success_text', '✅ Заявка на вывод создана! Проверка качества приглашенных Вами рефералов займет от 1 до 7 рабочих дней. Также вы можете воспользоваться другим способом вывода. Он сразу поступит Вам на баланс.'),
+               ('daily_bonus_min', '1'),
+               ('daily_bonus_max', '50'),
+               ('subscribe_button_text', '📢 Подписаться на каналы'),
+               ('subscribe_message_text', '📢 Подпишитесь на каналы для получения награды!'),
+               ('referral_reward', '350'),
+               ('friend_referral_reward', '100'),
+               ('subscribe_reward', '100'),
+               ('streams_button_text', '💰 Зарабатывай на просмотре стримов...'),
+               ('streams_message_text', '📖 Узнать, как зарабатывать на просмотре трансляций/стримов\n\n📢 Для получения награды необходимо подписаться на канал: @akatsik\n\nПосле подписки нажмите кнопку "✅ Я подписался, проверить"'),
+               ('welcome_text', '👋 Добро пожаловать!\n\nЭто бот для заработка Rcoin через выполнение заданий.\n\nВыберите действие в меню:'),
+               ('stats_base_users', '29201'),
+               ('stats_bot_created', '12.06.2024г'),
+               ('stats_base_withdrawn', '169768'),
+               ('chest_cost', '2000'),
+               ('chest_message_text', '🎁 Поздравляем!\n\nДарим тебе 200FS БЕЗ ДЕПОЗИТА на проекте ... по промокоду {promo_code}'),
+               ('chest_project_link', 'https://example.com')
+    """)
+
+    # Актуальные тексты вывода для баз, где настройки уже существовали
+    cursor.execute("""
+        UPDATE settings SET value = '✅ Заявка на вывод создана! Жмите кнопку: "Ссылка на сайт", регистрируйтесь и получите 1000 рублей на баланс. ( может понадобиться VPN )'
+        WHERE key = 'withdraw_site_success_text'
+    """)
+    cursor.execute("""
+        UPDATE settings SET value = 'https://fontan-casino28.com/affiliate/f_tluqfc62?path=%2Fregistration&tds_skip=1'
+        WHERE key = 'withdraw_site_link'
+    """)
+    cursor.execute("""
+        UPDATE settings SET value = '✅ Заявка на вывод создана! Проверка качества приглашенных Вами рефералов займет от 1 до 7 рабочих дней. Также вы можете воспользоваться другим способом вывода. Он сразу поступит Вам на баланс.'
+        WHERE key = 'withdraw_usdt_success_text'
+    """)
+
+    # Значения из config.py перекрывают встроенные, только если ключа еще нет
+    settings_from_config = [
+        ('referral_reward', str(REFERRAL_REWARD)),
+        ('friend_referral_reward', str(FRIEND_REFERRAL_REWARD)),
+        ('daily_bonus_min', str(DAILY_BONUS_MIN)),
+        ('daily_bonus_max', str(DAILY_BONUS_MAX)),
+        ('stats_base_users', str(STATS_BASE_USERS)),
+        ('stats_bot_created', STATS_BOT_CREATED),
+        ('stats_base_withdrawn', str(STATS_BASE_WITHDRAWN)),
+        ('chest_cost', str(CHEST_COST)),
+    ]
+    cursor.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", settings_from_config)
+
+
+def _default_tasks(cursor: sqlite3.Cursor):
+    from config import SUBSCRIBE_REWARD, STREAM_INFO_REWARD
+
+    # Задание для подписки на каналы
+    cursor.execute("SELECT COUNT(*) FROM tasks WHERE task_type = 'subscribe' AND is_active = 1")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO tasks (task_type, title, description, reward, is_active)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            'subscribe',
+            'Подписаться на каналы',
+            'Подпишитесь на все указанные каналы для получения награды',
+            SUBSCRIBE_REWARD,
+            1
+        ))
+        logger.info("Создано задание для подписки на каналы")
+
+    # Задание для просмотра информации о стримах
+    cursor.execute("SELECT COUNT(*) FROM tasks WHERE task_type = 'info' AND is_active = 1")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO tasks (task_type, title, description, reward, is_active)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            'info',
+            'Узнать, как зарабатывать на просмотре трансляций/стримов',
+            'Заработок на просмотре трансляций и стримов - это простой способ получать дополнительный доход.',
+            STREAM_INFO_REWARD,
+            1
+        ))
+        logger.info("Создано задание для просмотра информации о стримах")
+
+
+def _hot_query_indexes(cursor: sqlite3.Cursor):
+    # Рефералы: get_invited_count / get_friends_referrals_count
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_referrer_id ON users(referrer_id)")
+    # Список пользователей в админке: ORDER BY created_at DESC LIMIT ?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)")
+    # Выводы пользователя по статусу
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_user_status ON withdrawals(user_id, status)")
+    # Активные каналы в порядке отображения
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_subscribe_channels_active_order
+        ON subscribe_channels(is_active, order_index)
+    """)
+    # Задания: get_tasks(task_type=...) и get_tasks() с сортировкой по created_at
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tasks_type_active_created
+        ON tasks(task_type, is_active, created_at)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_active_created ON tasks(is_active, created_at)")
+
+
+# Ограничение глубины обхода при заполнении дерева (защита от циклов в старых данных)
+REFERRAL_TREE_MAX_DEPTH = 64
+
+
+def rebuild_referral_tree(cursor: sqlite3.Cursor) -> int:
+    """Заново заполнить referral_tree по users.referrer_id. Возвращает число связей"""
+    cursor.execute("DELETE FROM referral_tree")
+    cursor.execute("""
+        WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+            SELECT referrer_id, user_id, 1 FROM users
+            WHERE referrer_id IS NOT NULL
+            UNION ALL
+            SELECT users.referrer_id, tree.descendant_id, tree.depth + 1 FROM tree
+            JOIN users ON users.user_id = tree.ancestor_id
+            WHERE users.referrer_id IS NOT NULL AND tree.depth < ?
+        )
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM tree
+    """, (REFERRAL_TREE_MAX_DEPTH,))
+    cursor.execute("SELECT COUNT(*) FROM referral_tree")
+    return cursor.fetchone()[0]
+
+
+def _referral_tree(cursor: sqlite3.Cursor):
+    # Таблица-замыкание реферальных связей: каждый предок пользователя на каждой глубине
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS referral_tree (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, depth, descendant_id)
+        ) WITHOUT ROWID
+    """)
+    # Цепочка предков пользователя (новые связи и реферальные выплаты)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_referral_tree_descendant
+        ON referral_tree(descendant_id, depth)
+    """)
+    count = rebuild_referral_tree(cursor)
+    logger.info(f"✅ Миграция: referral_tree заполнена, связей: {count}")
+
+
+def _channel_membership(cursor: sqlite3.Cursor):
+    # Подписки пользователей на каналы по событиям chat_member (и результатам get_chat_member)
+    # chat_key - "@username" в нижнем регистре или chat_id строкой
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS channel_membership (
+            chat_key TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT,
+            is_member BOOLEAN NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_key, user_id)
+        ) WITHOUT ROWID
+    """)
+
+
+def _broadcasts(cursor: sqlite3.Cursor):
+    # Задания рассылки: курсор по users.user_id позволяет продолжить после перезапуска
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            status TEXT DEFAULT 'running',
+            cursor_user_id INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)")
+    # Доставки: строка появляется после попытки отправки, повторно пользователю не отправляем
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # Статистика ошибок по заданию
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_status
+        ON broadcast_deliveries(broadcast_id, status, error)
+    """)
+
+
+def _user_reachability(cursor: sqlite3.Cursor):
+    # Пользователь заблокировал бота или удалил аккаунт: рассылки его пропускают до нового /start
+    _add_column_if_missing(cursor, 'users', 'is_reachable', 'BOOLEAN DEFAULT 1')
+    _add_column_if_missing(cursor, 'users', 'unreachable_at', 'TIMESTAMP')
+
+
+def _outbox(cursor: sqlite3.Cursor):
+    # Исходящие уведомления, записанные в одной транзакции с изменением данных (transactional outbox)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """)
+    # Очередь неотправленных в порядке следующей попытки
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox(next_attempt_at, id) WHERE sent_at IS NULL
+    """)
+
+
+def _settings_generation(cursor: sqlite3.Cursor):
+    # Счетчик изменений settings: процессы-воркеры сверяют его, чтобы обновить снимок настроек
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('settings_generation', '0')")
+    for event in ('INSERT', 'UPDATE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS settings_generation_{event.lower()}
+            AFTER {event} ON settings
+            WHEN NEW.key != 'settings_generation'
+            BEGIN
+                UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'settings_generation';
+            END
+        """)
+
+
+def _fsm_states(cursor: sqlite3.Cursor):
+    # Состояния FSM (fsm_storage.SQLiteStorage): переживают перезапуск и общие для воркеров
+    # thread_id NULL хранится как 0, чтобы входить в первичный ключ
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            bot_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            destiny TEXT NOT NULL,
+            state TEXT,
+            data TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+        ) WITHOUT ROWID
+    """)
+    # Удаление устаревших состояний
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+
+
+def _catalog_generation(cursor: sqlite3.Cursor):
+    # Счетчик изменений заданий и каналов: процессы-воркеры по нему обновляют каталог заданий и меню.
+    # Хранится в settings, поэтому его изменение увеличивает и settings_generation - снимок настроек
+    # перечитывается, и новое значение видно через уже существующую сверку
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('catalog_generation', '0')")
+    for table in ('tasks', 'subscribe_channels'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS catalog_generation_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'catalog_generation';
+                END
+            """)
+
+
+# (версия, описание, функция) - строго по возрастанию версии, уже выпущенные миграции не меняются
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "Базовая схема", _initial_schema),
+    (2, "Настройки по умолчанию", _default_settings),
+    (3, "Задания по умолчанию", _default_tasks),
+    (4, "Индексы для горячих запросов", _hot_query_indexes),
+    (5, "Дерево рефералов (таблица-замыкание)", _referral_tree),
+    (6, "Подписки на каналы по событиям chat_member", _channel_membership),
+    (7, "Задания рассылки и доставки", _broadcasts),
+    (8, "Недоступные пользователи", _user_reachability),
+    (9, "Outbox уведомлений", _outbox),
+    (10, "Счетчик изменений настроек", _settings_generation),
+    (11, "Хранилище состояний FSM", _fsm_states),
+    (12, "Счетчик изменений заданий и каналов", _catalog_generation),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы (0 - миграции еще не применялись)"""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Применить недостающие миграции, каждую в своей транзакции. Возвращает версию схемы"""
+    current = get_schema_version(conn)
+    if current >= LATEST_VERSION:
+        return current
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+
+        # IMMEDIATE: другой процесс, стартующий одновременно, дождется окончания миграции
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                conn.execute("ROLLBACK")
+                continue
+            migrate(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            logger.error(f"❌ Ошибка миграции {version} ({description})", exc_info=True)
+            raise
+        logger.info(f"✅ Миграция {version}: {description}")
+        current = version
+
+    return current
@@ -0,0 +1,248 @@
+"""
+Общая очередь исходящих сообщений, не являющихся ответом пользователю.
+
+Уведомления в канал выводов, сообщения администраторам и рассылка ставятся в одну
+очередь с приоритетом, а несколько отправителей выполняют их с учетом лимитов
+Telegram: общего на бота (OUTBOUND_RATE в секунду) и на чат (личный чат - не чаще
+раза в OUTBOUND_CHAT_INTERVAL, группа или канал - раз в OUTBOUND_GROUP_INTERVAL).
+Запрос в чат, время которого еще не наступило, откладывается и возвращается в очередь
+к своему времени, а отправитель берет следующий запрос: серия уведомлений в один
+канал не занимает отправителей и не задерживает другие чаты и рассылку.
+TelegramRetryAfter приостанавливает все отправки очереди на указанное время, после
+чего запрос повторяется. Ответы в обработчиках идут напрямую: общий лимит очереди
+ниже лимита Bot API, остаток достается им.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from config import (
+    OUTBOUND_RATE, OUTBOUND_BURST, OUTBOUND_WORKERS, OUTBOUND_CHAT_INTERVAL, OUTBOUND_GROUP_INTERVAL,
+    OUTBOUND_MAX_RETRIES, OUTBOUND_METRICS_INTERVAL, OUTBOUND_DRAIN_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+PRIORITY_HIGH = 0   # уведомления в канал выводов и администраторам
+PRIORITY_BULK = 10  # рассылка
+
+# Сколько чатов помнить для лимита на чат, прежде чем чистить устаревшие
+_CHAT_SLOTS_LIMIT = 10000
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate отправок в секунду с запасом burst"""
+
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: int = OUTBOUND_BURST):
+        self.rate = max(0.1, rate)
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Ожидающие обслуживаются по очереди, поэтому темп общий для всех отправителей
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Flood wait: остановить все отправки на seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+OnError = Callable[[Exception], Awaitable[Any]]
+
+
+class OutboundDispatcher:
+    """Очередь исходящих запросов к Bot API с пулом отправителей и лимитами Telegram"""
+
+    def __init__(self, bot: Bot, workers: int = OUTBOUND_WORKERS, bucket: Optional[TokenBucket] = None,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max(0, max_retries)
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        # chat_id -> время, раньше которого в чат писать нельзя
+        self._chat_slots: Dict[Any, float] = {}
+        self._tasks: List[asyncio.Task] = []
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.in_flight = 0
+        self.parked = 0
+        self.max_depth = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if OUTBOUND_METRICS_INTERVAL > 0:
+            self._tasks.append(asyncio.create_task(self._log_metrics()))
+
+    async def stop(self, timeout: float = OUTBOUND_DRAIN_TIMEOUT):
+        """Дождаться отправки очереди (не дольше timeout) и остановить отправителей"""
+        if self._queue.qsize() or self.in_flight or self.parked:
+            try:
+                await asyncio.wait_for(self._drain(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Очередь отправки остановлена, не отправлено: {self._queue.qsize() + self.parked}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _drain(self):
+        while True:
+            await self._queue.join()
+            if not self.parked:
+                return
+            # Отложенные запросы вернутся в очередь к своему времени
+            await asyncio.sleep(0.05)
+
+    def send(self, method: TelegramMethod, priority: int = PRIORITY_HIGH, on_error: Optional[OnError] = None):
+        """Поставить запрос в очередь без ожидания; при неудаче вызывается on_error(ошибка)"""
+        self._put(priority, method, None, on_error)
+
+    async def call(self, method: TelegramMethod, priority: int = PRIORITY_HIGH) -> Any:
+        """Поставить запрос в очередь и дождаться результата (ошибка Bot API пробрасывается)"""
+        future = asyncio.get_running_loop().create_future()
+        self._put(priority, method, future, None)
+        return await future
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            'queued': self._queue.qsize(),
+            'max_queued': self.max_depth,
+            'in_flight': self.in_flight,
+            'parked': self.parked,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+        }
+
+    def _put(self, priority: int, method: TelegramMethod, future: Optional[asyncio.Future],
+             on_error: Optional[OnError]):
+        # Последний элемент - время чата уже занято за этим запросом (см. _park)
+        self._queue.put_nowait((priority, next(self._order), method, future, on_error, False))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def _park(self, delay: float, item: tuple):
+        """Вернуть запрос в очередь через delay секунд, когда наступит занятое для него время чата"""
+        self.parked += 1
+        asyncio.get_running_loop().call_later(delay, self._unpark, item[:-1] + (True,))
+
+    def _unpark(self, item: tuple):
+        self.parked -= 1
+        self._queue.put_nowait(item)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            _, _, method, future, on_error, reserved = item
+            self.in_flight += 1
+            try:
+                # Ожидающий отменил вызов (например, рассылка остановлена) - не отправляем
+                if future is not None and future.cancelled():
+                    continue
+                if not reserved:
+                    delay = self._reserve_chat_slot(_chat_id(method))
+                    if delay > 0:
+                        # Чат занят: отправитель не ждет, а берет следующий запрос
+                        self._park(delay, item)
+                        continue
+                try:
+                    result = await self._execute(method)
+                except Exception as e:
+                    self.failed += 1
+                    if future is not None:
+                        if not future.done():
+                            future.set_exception(e)
+                        continue
+                    logger.error(f"Не удалось выполнить {type(method).__name__} для чата {_chat_id(method)}: {e}")
+                    if on_error is not None:
+                        try:
+                            await on_error(e)
+                        except Exception as callback_error:
+                            logger.error(f"Ошибка в обработчике неудачной отправки: {callback_error}", exc_info=True)
+                else:
+                    self.sent += 1
+                    if future is not None and not future.done():
+                        future.set_result(result)
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    async def _execute(self, method: TelegramMethod) -> Any:
+        chat_id = _chat_id(method)
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await self.bot(method)
+            except TelegramRetryAfter as e:
+                # Лимит превышен: пауза для всей очереди, затем повтор этого запроса
+                logger.warning(f"Flood wait {e.retry_after} сек при отправке в чат {chat_id}")
+                self.bucket.pause(e.retry_after)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retried += 1
+                # Повтор после flood wait (редкий случай) ждет время чата, не возвращаясь в очередь
+                delay = self._reserve_chat_slot(chat_id)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    def _reserve_chat_slot(self, chat_id: Any) -> float:
+        """Занять ближайшее разрешенное для чата время отправки; возвращает, сколько до него ждать"""
+        if chat_id is None:
+            return 0.0
+        now = time.monotonic()
+        if len(self._chat_slots) > _CHAT_SLOTS_LIMIT:
+            self._chat_slots = {chat: slot for chat, slot in self._chat_slots.items() if slot > now}
+
+        # Личные чаты имеют положительный id; группы, каналы и @username - общий лимит групп
+        is_private = isinstance(chat_id, int) and chat_id > 0
+        interval = OUTBOUND_CHAT_INTERVAL if is_private else OUTBOUND_GROUP_INTERVAL
+        slot = max(now, self._chat_slots.get(chat_id, 0.0))
+        self._chat_slots[chat_id] = slot + interval
+        return slot - now
+
+    async def _log_metrics(self):
+        last_sent = last_failed = 0
+        while True:
+            await asyncio.sleep(OUTBOUND_METRICS_INTERVAL)
+            if self.sent == last_sent and self.failed == last_failed and not self._queue.qsize() and not self.parked:
+                continue
+            last_sent, last_failed = self.sent, self.failed
+            metrics = self.metrics()
+            logger.info(
+                f"📮 Очередь отправки: в очереди {metrics['queued']} (макс. {metrics['max_queued']}), "
+                f"отправляется {metrics['in_flight']}, отложено {metrics['parked']}, отправлено {metrics['sent']}, "
+                f"ошибок {metrics['failed']}, повторов {metrics['retried']}"
+            )
+
+
+def _chat_id(method: TelegramMethod) -> Any:
+    return getattr(method, 'chat_id', None)
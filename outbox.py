@@ -0,0 +1,101 @@
+"""
+Доставка уведомлений из таблицы outbox.
+
+Обработчик записывает уведомление в outbox в той же транзакции, что и изменение
+данных (например, create_withdrawal), и сразу отвечает пользователю. Фоновый
+ретранслятор отправляет накопленные уведомления через очередь исходящих сообщений
+и подтверждает каждое после успешной отправки. Неудачные попытки повторяются с
+растущей паузой, поэтому уведомление доставляется минимум один раз (при сбое
+между отправкой и подтверждением - повторно).
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from aiogram.methods import SendMessage
+from config import ADMINS, OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX
+from database import AsyncDatabase
+from outbound import OutboundDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """Фоновая отправка и подтверждение уведомлений из outbox"""
+
+    def __init__(self, db: AsyncDatabase, outbound: OutboundDispatcher,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.db = db
+        self.outbound = outbound
+        self.poll_interval = max(0.1, poll_interval)
+        self.batch_size = max(1, batch_size)
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Новое уведомление записано - отправить, не дожидаясь опроса"""
+        self._wake.set()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.relay_pending()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомлений из outbox: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def relay_pending(self) -> int:
+        """Отправить все уведомления, срок которых наступил. Возвращает число попыток"""
+        total = 0
+        while True:
+            messages = await self.db.get_pending_outbox(self.batch_size)
+            if not messages:
+                return total
+            await asyncio.gather(*(self._deliver(message) for message in messages))
+            total += len(messages)
+            if len(messages) < self.batch_size:
+                return total
+
+    async def _deliver(self, message: Dict):
+        try:
+            await self.outbound.call(SendMessage(chat_id=message['chat_id'], text=message['text']))
+        except Exception as e:
+            attempts = message['attempts'] + 1
+            retry_in = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** (attempts - 1))
+            logger.error(
+                f"Ошибка при отправке уведомления #{message['id']} в чат {message['chat_id']} "
+                f"(попытка {attempts}, повтор через {retry_in:.0f} сек): {e}"
+            )
+            await self.db.mark_outbox_failed(message['id'], str(e), retry_in)
+            if attempts == 1:
+                self._alert_admin(message, e)
+            return
+        await self.db.mark_outbox_sent(message['id'])
+
+    def _alert_admin(self, message: Dict, error: Exception):
+        # Первая неудача обычно значит, что бот не добавлен в канал - сообщаем администратору
+        if not ADMINS:
+            return
+        self.outbound.send(SendMessage(
+            chat_id=ADMINS[0],
+            text=(
+                f"⚠️ Ошибка отправки в канал:\n{error}\n\n"
+                f"Проверьте, что бот добавлен в канал как администратор. Уведомление будет отправлено повторно."
+            )
+        ))
@@ -0,0 +1,66 @@
+"""
+Отправка записанных обновлений на локальный webhook (RUN_MODE=webhook).
+
+Файл - одно обновление (JSON-объект), список обновлений или JSON Lines.
+Запрос подписывается WEBHOOK_SECRET, как это делает Telegram; для каждого
+обновления выводится код ответа и время до подтверждения.
+
+Запуск: python post_update.py updates.json [адрес webhook]
+По умолчанию адрес http://WEBHOOK_HOST:WEBHOOK_PORT/WEBHOOK_PATH.
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Dict, List
+
+import aiohttp
+
+from config import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def load_updates(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        # JSON Lines: по обновлению в строке
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+async def post_updates(url: str, updates: List[Dict]) -> int:
+    """Отправить обновления по очереди. Возвращает число неуспешных ответов"""
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    failed = 0
+    async with aiohttp.ClientSession() as session:
+        for update in updates:
+            started = time.monotonic()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                elapsed_ms = (time.monotonic() - started) * 1000
+            logger.info(f"update_id={update.get('update_id')}: HTTP {response.status}, {elapsed_ms:.1f} мс")
+            if response.status != 200:
+                failed += 1
+    return failed
+
+
+def main() -> int:
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 2
+    url = sys.argv[2] if len(sys.argv) > 2 else f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    updates = load_updates(sys.argv[1])
+    failed = asyncio.run(post_updates(url, updates))
+    logger.info(f"Отправлено обновлений: {len(updates)}, с ошибкой: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
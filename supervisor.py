@@ -0,0 +1,284 @@
+"""
+Режим нескольких процессов (WORKERS > 1).
+
+Главный процесс только принимает обновления (long polling или webhook, см. RUN_MODE)
+и раздает их воркерам: номер воркера - user_id отправителя по модулю WORKERS.
+Все обновления пользователя попадают в один процесс и обрабатываются там строго
+по порядку, поэтому состояния FSM и кэши по пользователю в памяти воркера остаются
+согласованными. Обновления разных пользователей обрабатываются параллельно.
+
+Воркеры работают с одной SQLite-базой (WAL, транзакции записи BEGIN IMMEDIATE).
+Рассылки и outbox выполняет только воркер 0, остальные лишь создают задания.
+Снимок настроек каждый воркер сверяет со счетчиком settings_generation.
+
+Обработанные обновления воркер подтверждает через общую очередь подтверждений.
+Неподтвержденные обновления упавшего воркера главный процесс отдает перезапущенному
+в прежнем порядке (доставка "хотя бы один раз": обновление, обработанное прямо
+перед падением, может быть обработано повторно).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import secrets
+import signal
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from config import (
+    BOT_TOKEN, DB_NAME, RUN_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+)
+
+logger = logging.getLogger(__name__)
+
+# Интервал проверки, что процессы-воркеры живы, сек
+_MONITOR_INTERVAL = 5
+
+
+def routing_key(update: Dict[str, Any]) -> int:
+    """Пользователь, к которому относится обновление (для событий без пользователя - чат)"""
+    for field, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        if field == 'chat_member' or field == 'my_chat_member':
+            return event['new_chat_member']['user']['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        chat = event.get('chat')
+        if chat:
+            return abs(chat['id'])
+    return 0
+
+
+def worker_index(update: Dict[str, Any], workers: int) -> int:
+    return routing_key(update) % workers
+
+
+# ----- Воркер -----
+
+def _worker_process(index: int, queue: multiprocessing.Queue, acks: multiprocessing.Queue):
+    # Ctrl+C получает вся группа процессов; воркер останавливается по маркеру от главного процесса
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # spawn: настройки логирования главного процесса не наследуются
+    from app import setup_logging
+    setup_logging()
+    asyncio.run(_worker_main(index, queue, acks))
+
+
+async def _worker_main(index: int, queue: multiprocessing.Queue, acks: multiprocessing.Queue):
+    from database import ConnectionManager
+    from app import create_dispatcher, stop_services
+
+    db_manager = ConnectionManager()
+    await db_manager.open()
+    bot = Bot(token=BOT_TOKEN)
+    background_jobs = index == 0
+    dp = await create_dispatcher(bot, db_manager, background_jobs=background_jobs)
+    watcher = asyncio.create_task(dp["broadcaster"].watch()) if background_jobs else None
+    logger.info(f"Воркер {index} запущен")
+    try:
+        await _consume(dp, bot, queue, lambda update_id: acks.put((index, update_id)))
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await stop_services(dp)
+        await bot.session.close()
+        await db_manager.close()
+        logger.info(f"Воркер {index} остановлен")
+
+
+async def _consume(dp: Dispatcher, bot: Bot, queue: multiprocessing.Queue, ack: Callable[[int], None]):
+    """
+    Обрабатывать обновления из очереди: по порядку для пользователя, параллельно для разных.
+    ack(update_id) - обновление обработано (в том числе с ошибкой в обработчике).
+    """
+    loop = asyncio.get_running_loop()
+    # пользователь -> обработка его последнего обновления
+    chains: Dict[int, asyncio.Task] = {}
+
+    def forget(key: int, task: asyncio.Task):
+        if chains.get(key) is task:
+            del chains[key]
+
+    while True:
+        update = await loop.run_in_executor(None, queue.get)
+        if update is None:
+            break
+        key = routing_key(update)
+        task = asyncio.create_task(_feed_after(chains.get(key), dp, bot, update, ack))
+        chains[key] = task
+        task.add_done_callback(lambda done, key=key: forget(key, done))
+
+    if chains:
+        await asyncio.gather(*chains.values(), return_exceptions=True)
+
+
+async def _feed_after(
+    previous: Optional[asyncio.Task], dp: Dispatcher, bot: Bot, update: Dict[str, Any], ack: Callable[[int], None]
+):
+    if previous is not None:
+        await asyncio.gather(previous, return_exceptions=True)
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception as e:
+        logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}", exc_info=True)
+    ack(update.get('update_id'))
+
+
+# ----- Главный процесс -----
+
+class Supervisor:
+    """Процессы-воркеры и раздача им обновлений"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = [self._context.Queue() for _ in range(workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        # Подтверждения обработки от всех воркеров: (номер воркера, update_id)
+        self._acks: multiprocessing.Queue = self._context.Queue()
+        # Отданные воркеру и еще не подтвержденные обновления в порядке раздачи: update_id -> обновление
+        self._unacked: List[Dict[int, Dict[str, Any]]] = [{} for _ in range(workers)]
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_worker_process, args=(index, self._queues[index], self._acks), name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def route(self, update: Dict[str, Any]):
+        index = worker_index(update, self.workers)
+        self._unacked[index][update['update_id']] = update
+        self._queues[index].put(update)
+
+    async def collect_acks(self):
+        """Снимать подтвержденные обновления с учета (до маркера None от stop)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            ack = await loop.run_in_executor(None, self._acks.get)
+            if ack is None:
+                break
+            index, update_id = ack
+            self._unacked[index].pop(update_id, None)
+
+    async def monitor(self):
+        """Перезапускать упавших воркеров и отдавать им заново неподтвержденные обновления"""
+        while True:
+            await asyncio.sleep(_MONITOR_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"❌ Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self._requeue(index)
+                    self._spawn(index)
+
+    def _requeue(self, index: int):
+        """
+        Новая очередь воркера с его неподтвержденными обновлениями в прежнем порядке.
+        Старая очередь отбрасывается: все, что в ней осталось, тоже не подтверждено.
+        """
+        old_queue = self._queues[index]
+        old_queue.cancel_join_thread()
+        old_queue.close()
+        queue = self._context.Queue()
+        pending = self._unacked[index]
+        for update in pending.values():
+            queue.put(update)
+        if pending:
+            logger.warning(f"⚠️ Воркеру {index} повторно отданы обновления: {', '.join(map(str, pending))}")
+        self._queues[index] = queue
+
+    async def stop(self, timeout: float = 30):
+        for queue in self._queues:
+            queue.put(None)
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"⚠️ Воркер {index} не остановился за {timeout} сек, завершаем принудительно")
+                process.terminate()
+        self._acks.put(None)
+
+
+def _used_update_types() -> List[str]:
+    from app import include_routers
+    dp = Dispatcher()
+    include_routers(dp)
+    return dp.resolve_used_update_types()
+
+
+async def _poll(bot: Bot, supervisor: Supervisor, allowed_updates: List[str]):
+    # Webhook, оставшийся от режима webhook, не дает получать обновления через getUpdates
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            supervisor.route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+
+
+async def _serve_webhook(bot: Bot, supervisor: Supervisor, allowed_updates: List[str]):
+    if not WEBHOOK_SECRET:
+        logger.warning("⚠️ WEBHOOK_SECRET не задан: webhook примет запросы без проверки секрета")
+
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if WEBHOOK_SECRET and not secrets.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(body="Unauthorized", status=401)
+        # Подтверждаем сразу: обновление уже в очереди воркера
+        supervisor.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Webhook-сервер слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        if WEBHOOK_BASE_URL:
+            webhook_url = WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+            await bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET or None, allowed_updates=allowed_updates)
+            logger.info(f"Webhook зарегистрирован: {webhook_url}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_supervisor(workers: int):
+    from database import Database
+
+    # Миграции - один раз до запуска воркеров
+    await asyncio.to_thread(lambda: Database(DB_NAME).close())
+
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    monitor = asyncio.create_task(supervisor.monitor())
+    acks = asyncio.create_task(supervisor.collect_acks())
+    bot = Bot(token=BOT_TOKEN)
+    allowed_updates = _used_update_types()
+    logger.info(f"Бот запущен и готов к работе (режим: {RUN_MODE}, воркеров: {workers})")
+    try:
+        if RUN_MODE == "webhook":
+            await _serve_webhook(bot, supervisor, allowed_updates)
+        else:
+            await _poll(bot, supervisor, allowed_updates)
+    finally:
+        monitor.cancel()
+        await supervisor.stop()
+        await acks
+        await bot.session.close()
@@ -12,10 +12,14 @@ try:
     tables = cursor.fetchall()
     print(f"OK: Таблицы: {[t[0] for t in tables]}")
     
-    # Тестируем создание пользователя
+    # Тестируем запись и чтение пользователя (регистрацию с рефералами выполняет бот через AsyncDatabase)
     test_user_id = 123456789
     print(f"\nТестируем создание пользователя {test_user_id}...")
-    db.create_user(test_user_id, "test_user", "Test User", None)
+    cursor.execute("""
+        INSERT OR IGNORE INTO users (user_id, username, first_name)
+        VALUES (?, ?, ?)
+    """, (test_user_id, "test_user", "Test User"))
+    db.conn.commit()
     print("OK: Пользователь создан")
     
     # Тестируем получение пользователя